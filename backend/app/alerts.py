@@ -0,0 +1,173 @@
+"""Оповещения о нехватке и истечении сроков годности через Postgres LISTEN/NOTIFY.
+
+Проводки (create_transaction, пакет, подтверждение заявки) в своей транзакции вызывают
+pg_notify, когда остаток материала пересекает min_quantity или поступает партия, срок
+годности которой уже в окне EXPIRY_ALERT_DAYS. Postgres доставляет уведомление только
+после commit, поэтому откаченная операция оповещений не шлет.
+
+Каждый воркер держит одно отдельное соединение с LISTEN (AlertBroadcaster) и раздает
+события своим SSE-клиентам (/alerts/stream), так что оповещение доходит до клиентов
+всех воркеров. LISTEN не работает через PgBouncer в режиме transaction pooling: для
+ALERTS_DATABASE_URL нужен прямой адрес Postgres.
+
+Партии, которые входят в окно со временем, а не при поступлении, оповещаются
+ежедневным запуском (например, из cron):
+    python -m app.alerts
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+from datetime import datetime, timedelta
+
+import asyncpg
+from sqlalchemy import select, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+
+from . import models
+from .database import ASYNC_DATABASE_URL, open_session
+
+ALERT_CHANNEL = "stock_alerts"
+EXPIRY_ALERT_DAYS = int(os.getenv("EXPIRY_ALERT_DAYS", "30"))
+ALERTS_DATABASE_URL = os.getenv("ALERTS_DATABASE_URL", ASYNC_DATABASE_URL)
+ALERT_QUEUE_SIZE = int(os.getenv("ALERT_QUEUE_SIZE", "100"))
+ALERT_RECONNECT_DELAY = float(os.getenv("ALERT_RECONNECT_DELAY", "5"))
+
+logger = logging.getLogger(__name__)
+
+
+# --- ПУБЛИКАЦИЯ (в транзакции операции) ---
+def notify(db: Session, events: list[dict]):
+    """Ставит уведомления в текущую транзакцию одним запросом; уйдут после commit."""
+    if not events:
+        return
+    db.execute(
+        text("SELECT pg_notify(:channel, payload) FROM unnest(CAST(:payloads AS text[])) AS payload"),
+        {"channel": ALERT_CHANNEL, "payloads": [json.dumps(event, ensure_ascii=False, default=str)
+                                                for event in events]},
+    )
+
+
+def stock_crossings(rows, deltas: dict[int, float]):
+    """События пересечения min_quantity по строкам (material_id, name, unit, min_quantity, quantity)
+    с новыми остатками; deltas - изменения, которые к ним привели."""
+    events = []
+    for row in rows:
+        before = row.quantity - deltas[row.material_id]
+        if before >= row.min_quantity > row.quantity:
+            event_type = "low_stock"
+        elif before < row.min_quantity <= row.quantity:
+            event_type = "stock_restored"
+        else:
+            continue
+        events.append({"type": event_type, "material_id": row.material_id, "name": row.name,
+                       "unit": row.unit.value, "quantity": row.quantity, "min_quantity": row.min_quantity})
+    return events
+
+
+def expiring_batch_event(batch_id: int, material_id: int, name: str, quantity: float, expiration_date):
+    return {"type": "expiring", "batch_id": batch_id, "material_id": material_id, "name": name,
+            "quantity": quantity, "expiration_date": expiration_date.isoformat()}
+
+
+def expiry_threshold(now: datetime = None):
+    """Партии со сроком годности не позже этого момента считаются истекающими."""
+    return (now or datetime.utcnow()) + timedelta(days=EXPIRY_ALERT_DAYS)
+
+
+def notify_entering_expiry_window(db: Session, now: datetime = None):
+    """Оповещает о партиях, вошедших в окно истечения за последние сутки (для ежедневного запуска)."""
+    threshold = expiry_threshold(now)
+    rows = db.execute(
+        select(models.Batch.id, models.Batch.material_id, models.Material.name, models.Batch.current_quantity,
+               models.Batch.expiration_date)
+        .join(models.Material, models.Material.id == models.Batch.material_id)
+        .where(models.Batch.expiration_date > threshold - timedelta(days=1),
+               models.Batch.expiration_date <= threshold, models.Batch.current_quantity > 0)
+        .order_by(models.Batch.expiration_date, models.Batch.id)
+    ).all()
+    notify(db, [expiring_batch_event(*row) for row in rows])
+    db.commit()
+    return len(rows)
+
+
+# --- ПОДПИСКА (в процессе API) ---
+def _listen_dsn():
+    return make_url(ALERTS_DATABASE_URL).set(drivername="postgresql").render_as_string(hide_password=False)
+
+
+class AlertBroadcaster:
+    """Одно LISTEN-соединение на процесс; события раздаются очередям подписчиков.
+
+    Соединение открывается с первым подписчиком и закрывается, когда подписчиков не осталось.
+    Медленный клиент с полной очередью теряет событие, а не задерживает остальных.
+    """
+
+    def __init__(self):
+        self._queues = set()
+        self._task = None
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=ALERT_QUEUE_SIZE)
+        self._queues.add(queue)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._listen())
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._queues.discard(queue)
+
+    def _dispatch(self, connection, pid, channel, payload):
+        for queue in list(self._queues):
+            try:
+                queue.put_nowait(payload)
+            except asyncio.QueueFull:
+                pass
+
+    async def _listen(self):
+        while self._queues:
+            try:
+                connection = await asyncpg.connect(_listen_dsn())
+            except (OSError, asyncpg.PostgresError) as e:
+                logger.warning("Нет соединения для LISTEN %s: %s", ALERT_CHANNEL, e)
+                await asyncio.sleep(ALERT_RECONNECT_DELAY)
+                continue
+            try:
+                await connection.add_listener(ALERT_CHANNEL, self._dispatch)
+                while self._queues and not connection.is_closed():
+                    await asyncio.sleep(1)
+            finally:
+                if not connection.is_closed():
+                    await connection.close()
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+broadcaster = AlertBroadcaster()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Оповещения о партиях, вошедших в окно истечения срока годности")
+    parser.parse_args(argv)
+
+    db = open_session()
+    try:
+        count = notify_entering_expiry_window(db)
+    finally:
+        db.close()
+    print(f"[INFO] Партий, вошедших в окно истечения ({EXPIRY_ALERT_DAYS} дн.): {count}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""Журнал активности через outbox-таблицу audit_outbox.
+
+Записи копятся в сессии и перед commit пишутся в audit_outbox одним многострочным INSERT -
+в той же транзакции, что и основная операция (при rollback пропадают вместе с ней).
+audit_outbox - узкая таблица без индексов и внешних ключей, поэтому запись в нее дешевле
+строки activity_logs. Фоновый поток раз в AUDIT_FLUSH_INTERVAL секунд (или по накоплении
+AUDIT_BATCH_SIZE записей) переносит пачки в activity_logs одним запросом DELETE ... RETURNING
++ INSERT: запись либо еще в outbox, либо уже в журнале, поэтому падение процесса ничего не теряет -
+остаток переносит следующий запуск любого воркера. Время записи - now() транзакции операции.
+AUDIT_MODE=sync пишет сразу в activity_logs (для тестов и скриптов).
+"""
+import atexit
+import logging
+import os
+import threading
+
+from sqlalchemy import event, insert, text
+from sqlalchemy.orm import Session
+
+from . import models
+from .database import get_engine
+
+AUDIT_MODE = os.getenv("AUDIT_MODE", "batched")
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "500"))
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", "1.0"))
+
+logger = logging.getLogger(__name__)
+
+_PENDING_KEY = "audit_pending"
+
+# Пачка переносится атомарно; SKIP LOCKED позволяет нескольким воркерам разбирать outbox параллельно
+DRAIN_BATCH = text("""
+    WITH moved AS (
+        DELETE FROM audit_outbox WHERE id IN (
+            SELECT id FROM audit_outbox ORDER BY id LIMIT :limit FOR UPDATE SKIP LOCKED
+        )
+        RETURNING user_id, action, details, created_at
+    )
+    INSERT INTO activity_logs (user_id, action, details, created_at)
+    SELECT user_id, action, details, created_at FROM moved
+""")
+
+
+class AuditWriter:
+    def __init__(self):
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+                self._thread.start()
+
+    def notify(self, count: int):
+        """Сообщает о записях, закоммиченных в outbox этим процессом."""
+        self.start()
+        with self._lock:
+            self._pending += count
+            full = self._pending >= AUDIT_BATCH_SIZE
+        if full:
+            self._wake.set()
+
+    def flush(self) -> int:
+        """Переносит все записи outbox в activity_logs; возвращает число перенесенных."""
+        written = 0
+        while True:
+            with get_engine().begin() as conn:
+                moved = conn.execute(DRAIN_BATCH, {"limit": AUDIT_BATCH_SIZE}).rowcount
+            written += moved
+            with self._lock:
+                self._pending = max(0, self._pending - moved)
+            if moved < AUDIT_BATCH_SIZE:
+                return written
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(AUDIT_FLUSH_INTERVAL)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Audit flush failed, records stay in audit_outbox and will be retried")
+
+    def stop(self):
+        """Останавливает поток и переносит остаток outbox."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is None:
+            return
+        self._thread.join()
+        self._thread = None
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Audit flush failed on shutdown, records stay in audit_outbox until next start")
+
+
+writer = AuditWriter()
+atexit.register(writer.stop)
+
+
+def record(db: Session, user_id: int, action: str, details: str = None):
+    if AUDIT_MODE == "sync":
+        db.add(models.ActivityLog(user_id=user_id, action=action, details=details))
+        return
+    db.info.setdefault(_PENDING_KEY, []).append({"user_id": user_id, "action": action, "details": details})
+
+
+@event.listens_for(Session, "before_commit")
+def _write_outbox(session):
+    records = session.info.get(_PENDING_KEY)
+    if records:
+        session.execute(insert(models.AuditOutbox), records)
+
+
+@event.listens_for(Session, "after_commit")
+def _notify_writer(session):
+    records = session.info.pop(_PENDING_KEY, None)
+    if records:
+        writer.notify(len(records))
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rolled_back(session):
+    session.info.pop(_PENDING_KEY, None)
@@ -1,31 +1,84 @@
 from datetime import timedelta
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-from . import crud, schemas
-from .database import get_db
-from .security import create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES
+from jose import JWTError
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import crud, schemas, security
+from .database import get_async_db
+from .security import create_access_token, create_refresh_token, ACCESS_TOKEN_EXPIRE_MINUTES
 
 router = APIRouter()
 
-@router.post("/token", response_model=schemas.Token)
-def login_for_access_token(db: Session = Depends(get_db), form_data: OAuth2PasswordRequestForm = Depends()):
-    user = crud.authenticate_user(db, email=form_data.username, password=form_data.password)
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Incorrect email or password",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+busy_exception = HTTPException(
+    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+    detail="Too many concurrent logins, please retry",
+    headers={"Retry-After": "1"},
+)
+
+
+def issue_tokens(email: str):
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
+        data={"sub": email}, expires_delta=access_token_expires
     )
-    return {"access_token": access_token, "token_type": "bearer"}
+    refresh_token = create_refresh_token(data={"sub": email})
+    return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
+
+
+@router.post("/token", response_model=schemas.Token)
+async def login_for_access_token(db: AsyncSession = Depends(get_async_db), form_data: OAuth2PasswordRequestForm = Depends()):
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Incorrect email or password",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    user = await db.run_sync(crud.get_user_by_email, form_data.username)
+    if not user or not user.is_active:
+        raise credentials_exception
+    email, hashed_password = user.email, user.hashed_password
+    # Соединение возвращается в пул до bcrypt: иначе волна логинов занимает весь пул
+    await db.rollback()
+    try:
+        verified, new_hash = await security.verify_and_update_password_async(form_data.password, hashed_password)
+    except security.PasswordHasherBusy:
+        raise busy_exception
+    except ValueError:
+        verified, new_hash = False, None
+    if not verified:
+        raise credentials_exception
+    if new_hash:
+        await db.run_sync(crud.update_user_password_hash, user, new_hash)
+    return issue_tokens(email)
+
+
+@router.post("/token/refresh", response_model=schemas.Token)
+async def refresh_access_token(request: schemas.TokenRefresh, db: AsyncSession = Depends(get_async_db)):
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate refresh token",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    try:
+        payload = security.jwt.decode(request.refresh_token, security.SECRET_KEY, algorithms=[security.ALGORITHM])
+    except JWTError:
+        raise credentials_exception
+    email = payload.get("sub")
+    if payload.get("type") != "refresh" or email is None:
+        raise credentials_exception
+    user = await db.run_sync(crud.get_user_by_email, email)
+    if user is None or not user.is_active:
+        raise credentials_exception
+    return issue_tokens(user.email)
+
 
 @router.post("/users/", response_model=schemas.User)
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = crud.get_user_by_email(db, email=user.email)
+async def create_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
+    db_user = await db.run_sync(crud.get_user_by_email, user.email)
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
-    return crud.create_user(db=db, user=user)
\ No newline at end of file
+    await db.rollback()
+    try:
+        hashed_password = await security.get_password_hash_async(user.password)
+    except security.PasswordHasherBusy:
+        raise busy_exception
+    return await db.run_sync(crud.create_user, user, hashed_password)
@@ -0,0 +1,485 @@
+"""Нагрузочный прогон по всем маршрутам API с отчетом p50/p95/p99, пропускной способностью
+и числом SQL-запросов на запрос (заголовок X-DB-Queries).
+
+Сервер должен быть запущен отдельно на базе, заполненной app.seed. Маршруты гоняются
+по очереди, каждый - заданным числом запросов с заданной параллельностью.
+Изменяющие маршруты (создание, списание, подтверждение) меняют данные стенда.
+
+Запуск:
+    python -m app.seed --reset
+    python -m app.bench --concurrency 16 --requests 300 --save baseline.json
+    python -m app.bench --concurrency 16 --requests 300 --baseline baseline.json   # сравнение
+    python -m app.bench --routes "GET /materials/" "POST /transactions/"
+    python -m app.bench --stress 400 --concurrency 200   # параллельные списания с одной партии
+
+При сравнении код возврата 1, если p95 какого-либо маршрута вырос больше чем на --threshold %.
+Маршруты приложения без сценария (по app.main.app.routes) - ошибка, код возврата 2.
+Для потоковых выгрузок запросы к БД идут уже после заголовков, поэтому их число там не видно;
+для потока оповещений замеряется время до первого события, после чего соединение закрывается.
+
+--stress N вместо замеров дважды списывает с одной партии N раз по единице с заданной
+параллельностью: с остатком N/2 (половина запросов - с явной партией, половина - по FEFO)
+и с остатком N только по FEFO. Проверяется, что принято ровно min(N, остаток) списаний,
+во втором прогоне нет ни одного отказа, остаток не ушел в минус, а сумма проводок журнала
+материала равна остатку партии и материала. При расхождении код возврата 1.
+"""
+import argparse
+import collections
+import http.client
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlencode, urlsplit
+
+
+class Client:
+    """HTTP-клиент одного потока: keep-alive соединение с сервером."""
+
+    def __init__(self, base_url, token=None):
+        parts = urlsplit(base_url)
+        connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        self.connection = connection_class(parts.hostname, parts.port, timeout=60)
+        self.token = token
+
+    def request(self, method, path, json_body=None, form=None, multipart=None, headers=None, stream=False):
+        """stream=True: читает только первую строку ответа (SSE) и закрывает соединение."""
+        headers, body = dict(headers or {}), None
+        if self.token:
+            headers.setdefault("Authorization", f"Bearer {self.token}")
+        if json_body is not None:
+            headers["Content-Type"] = "application/json"
+            body = json.dumps(json_body).encode()
+        elif form is not None:
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+            body = urlencode(form).encode()
+        elif multipart is not None:
+            boundary = uuid.uuid4().hex
+            filename, content = multipart
+            headers["Content-Type"] = f"multipart/form-data; boundary={boundary}"
+            body = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+                    f'Content-Type: application/octet-stream\r\n\r\n').encode() + content + \
+                f"\r\n--{boundary}--\r\n".encode()
+        try:
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            data = response.readline() if stream else response.read()
+            if stream:
+                self.connection.close()
+        except (http.client.HTTPException, OSError):
+            self.connection.close()
+            raise
+        return response.status, response.getheader("X-DB-Queries"), data
+
+
+def percentile(sorted_values, share):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, max(0, round(share * len(sorted_values)) - 1))]
+
+
+# --- СЦЕНАРИИ ---
+# Каждый сценарий: (имя "МЕТОД /маршрут", build(ctx, i) -> kwargs для Client.request или None
+# для пропуска, on_response(ctx, data) или None). ctx заполняется в prepare().
+
+def _json(data):
+    return json.loads(data) if data else None
+
+
+def _material(ctx, i):
+    return ctx["materials"][i % len(ctx["materials"])]
+
+
+def _stocked(ctx, i):
+    return ctx["stocked"][i % len(ctx["stocked"])] if ctx["stocked"] else None
+
+
+def _created_material_body(ctx, i):
+    return {"name": f"Bench {ctx['run']} #{i}", "unit": "piece", "min_quantity": 5, "initial_quantity": 0}
+
+
+def _remember(key):
+    def on_response(ctx, data):
+        ctx[key].append(_json(data)["id"])
+    return on_response
+
+
+def _pop(ctx, key):
+    try:
+        return ctx[key].popleft()
+    except IndexError:
+        return None
+
+
+def _approve(ctx, i):
+    request_id = _pop(ctx, "pending_requests")
+    return None if request_id is None else {"method": "POST", "path": f"/requests/{request_id}/approve"}
+
+
+def _delete_material(ctx, i):
+    material_id = _pop(ctx, "created_materials")
+    return None if material_id is None else {"method": "DELETE", "path": f"/materials/{material_id}"}
+
+
+def _update_material(ctx, i):
+    if not ctx["created_materials"]:
+        return None
+    material_id = ctx["created_materials"][i % len(ctx["created_materials"])]
+    body = {**_created_material_body(ctx, material_id), "name": f"Bench {ctx['run']} upd #{material_id}"}
+    return {"method": "PUT", "path": f"/materials/{material_id}", "json_body": body}
+
+
+def _write_off(ctx, i):
+    material_id = _stocked(ctx, i)
+    return None if material_id is None else {
+        "method": "POST", "path": "/transactions/", "json_body": {"material_id": material_id, "delta": -1}}
+
+
+def _bulk_write_off(ctx, i):
+    if not ctx["stocked"]:
+        return None
+    items = [{"material_id": _stocked(ctx, i * 10 + n), "delta": -1} for n in range(10)]
+    return {"method": "POST", "path": "/transactions/bulk", "json_body": {"items": items}}
+
+
+def _alert_stream(ctx, i):
+    # Билет живет секунды, поэтому берется перед каждым подключением (вне замера)
+    _, _, data = Client(ctx["base_url"], ctx["token"]).request("POST", "/alerts/ticket")
+    return {"method": "GET", "path": "/alerts/stream?" + urlencode({"ticket": _json(data)["ticket"]}), "stream": True}
+
+
+def _import_file(ctx, i):
+    rows = "".join(f"Bench import {ctx['run']} {(i + n) % 50},piece,5,10,2030-01-01\n" for n in range(20))
+    return ("bench.csv", ("name,unit,min_quantity,initial_quantity,expiration_date\n" + rows).encode())
+
+
+SCENARIOS = [
+    ("POST /token", lambda ctx, i: {"method": "POST", "path": "/token", "form": {
+        "username": ctx["email"], "password": ctx["password"]}}, None),
+    ("POST /token/refresh", lambda ctx, i: {"method": "POST", "path": "/token/refresh", "json_body": {
+        "refresh_token": ctx["refresh_token"]}}, None),
+    ("POST /users/", lambda ctx, i: {"method": "POST", "path": "/users/", "json_body": {
+        "email": f"bench-{ctx['run']}-{i}@bench.example.com", "full_name": f"Bench {i}",
+        "password": ctx["password"]}}, None),
+    ("GET /users/me/", lambda ctx, i: {"method": "GET", "path": "/users/me/"}, None),
+    ("GET /users/me/activity", lambda ctx, i: {"method": "GET", "path": "/users/me/activity?limit=50"}, None),
+    ("GET /activity", lambda ctx, i: {"method": "GET", "path": "/activity?limit=100"}, None),
+    ("GET /users/", lambda ctx, i: {"method": "GET", "path": "/users/"}, None),
+    ("GET /users/{id}", lambda ctx, i: {
+        "method": "GET", "path": f"/users/{ctx['users'][i % len(ctx['users'])]}"}, None),
+    ("GET /users/{id}/activity", lambda ctx, i: {
+        "method": "GET", "path": f"/users/{ctx['users'][i % len(ctx['users'])]}/activity?limit=50"}, None),
+    ("POST /requests/", lambda ctx, i: {"method": "POST", "path": "/requests/", "json_body": {"items": [
+        {"material_name": f"Bench {ctx['run']} request #{i}-{n}", "quantity": 10, "unit": "pack"}
+        for n in range(3)]}}, _remember("pending_requests")),
+    ("GET /requests/", lambda ctx, i: {
+        "method": "GET", "path": "/requests/?fields=id,created_at,status,item_count"}, None),
+    ("POST /requests/{id}/approve", _approve, None),
+    ("GET /narcotic-logs/", lambda ctx, i: {"method": "GET", "path": "/narcotic-logs/?limit=100"}, None),
+    ("GET /narcotic-logs/export", lambda ctx, i: {
+        "method": "GET", "path": "/narcotic-logs/export?" + urlencode({"date_from": ctx["month_ago"]})}, None),
+    ("GET /exports/inventory", lambda ctx, i: {"method": "GET", "path": "/exports/inventory?format=ndjson"}, None),
+    ("GET /dashboard/stats", lambda ctx, i: {"method": "GET", "path": "/dashboard/stats"}, None),
+    ("POST /alerts/ticket", lambda ctx, i: {"method": "POST", "path": "/alerts/ticket"}, None),
+    ("GET /alerts/stream", _alert_stream, None),
+    ("GET /reports/consumption", lambda ctx, i: {
+        "method": "GET", "path": f"/reports/consumption?material_id={_material(ctx, i)}&window=7"}, None),
+    ("POST /materials/", lambda ctx, i: {
+        "method": "POST", "path": "/materials/", "json_body": _created_material_body(ctx, i)},
+     _remember("created_materials")),
+    ("GET /materials/", lambda ctx, i: {"method": "GET", "path": "/materials/?" + urlencode({
+        "fields": "batches.id,batches.current_quantity,batches.expiration_date"})}, None),
+    ("GET /materials/suggest", lambda ctx, i: {
+        "method": "GET", "path": "/materials/suggest?" + urlencode({"q": random.choice(("шпр", "бинт", "морф"))})},
+     None),
+    ("POST /materials/import", lambda ctx, i: {
+        "method": "POST", "path": "/materials/import", "multipart": _import_file(ctx, i)}, None),
+    ("GET /materials/stock-as-of", lambda ctx, i: {
+        "method": "GET", "path": "/materials/stock-as-of?" + urlencode({"at": ctx["month_ago"]})}, None),
+    ("GET /materials/{id}/ledger", lambda ctx, i: {
+        "method": "GET", "path": f"/materials/{_material(ctx, i)}/ledger?limit=100"}, None),
+    ("PUT /materials/{id}", _update_material, None),
+    ("DELETE /materials/{id}", _delete_material, None),
+    ("POST /transactions/", _write_off, None),
+    ("POST /transactions/bulk", _bulk_write_off, None),
+    ("GET /system/db-pool", lambda ctx, i: {"method": "GET", "path": "/system/db-pool"}, None),
+    ("GET /metrics", lambda ctx, i: {"method": "GET", "path": "/metrics", "headers": {
+        "Authorization": f"Bearer {ctx['metrics_token']}"} if ctx["metrics_token"] else None}, None),
+]
+
+
+def uncovered_routes():
+    """Маршруты приложения, для которых нет сценария (параметры пути сравниваются как {id})."""
+    from fastapi.routing import APIRoute
+    from .main import app
+
+    routes = {f"{method} {re.sub(r'{[^}]+}', '{id}', route.path)}"
+              for route in app.routes if isinstance(route, APIRoute)
+              for method in route.methods - {"HEAD", "OPTIONS"}}
+    return sorted(routes - {name for name, _, _ in SCENARIOS})
+
+
+def prepare(base_url, email, password, metrics_token=None):
+    """Вход под администратором стенда и выбор id для параметризованных маршрутов."""
+    client = Client(base_url)
+    status, _, data = client.request("POST", "/token", form={"username": email, "password": password})
+    if status != 200:
+        raise SystemExit(f"[ERROR] Не удалось войти как {email}: HTTP {status} (база заполнена app.seed?)")
+    tokens = _json(data)
+    client.token = tokens["access_token"]
+    _, _, data = client.request("GET", "/materials/?limit=500&fields=id,is_narcotic,total_quantity")
+    materials = _json(data)
+    _, _, data = client.request("GET", "/users/")
+    return {
+        "run": uuid.uuid4().hex[:8], "base_url": base_url, "email": email, "password": password,
+        "metrics_token": metrics_token,
+        "token": tokens["access_token"], "refresh_token": tokens["refresh_token"],
+        "materials": [m["id"] for m in materials] or [0],
+        # Для списаний - ненаркотические материалы с запасом, чтобы запросы не упирались в 400
+        "stocked": [m["id"] for m in materials if not m["is_narcotic"] and m["total_quantity"] >= 100],
+        "users": [u["id"] for u in _json(data)] or [0],
+        "month_ago": (datetime.now(timezone.utc) - timedelta(days=30)).isoformat(),
+        "pending_requests": collections.deque(), "created_materials": collections.deque(),
+    }
+
+
+def _ledger(client, material_id):
+    entries, after = [], {}
+    while True:
+        _, _, data = client.request("GET", f"/materials/{material_id}/ledger?" + urlencode({"limit": 1000, **after}))
+        page = _json(data)
+        entries.extend(page)
+        if len(page) < 1000:
+            return entries
+        after = {"after_created_at": page[-1]["created_at"], "after_id": page[-1]["id"]}
+
+
+def _stress_run(base_url, ctx, label, writes, stock, concurrency, explicit_batch):
+    """N параллельных списаний по единице с одной партии на stock единиц.
+
+    explicit_batch - доля запросов с явной партией (остальные идут по FEFO).
+    Возвращает список нарушенных условий.
+    """
+    client = Client(base_url, ctx["token"])
+    name = f"Bench stress {ctx['run']} {label}"
+    _, _, data = client.request("POST", "/materials/", json_body={
+        "name": name, "unit": "piece", "min_quantity": 0, "initial_quantity": stock})
+    material = _json(data)
+    batch_id = material["batches"][0]["id"]
+
+    counter = iter(range(writes))
+    counter_lock = threading.Lock()
+    statuses = {"batch": collections.Counter(), "fefo": collections.Counter()}
+
+    def worker():
+        worker_client = Client(base_url, ctx["token"])
+        while True:
+            with counter_lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            kind = "batch" if i % 100 < explicit_batch * 100 else "fefo"
+            body = {"material_id": material["id"], "delta": -1, "batch_id": batch_id if kind == "batch" else None}
+            try:
+                status, _, _ = worker_client.request("POST", "/transactions/", json_body=body)
+            except (http.client.HTTPException, OSError) as e:
+                status = type(e).__name__
+            with counter_lock:
+                statuses[kind][status] += 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(min(concurrency, writes))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    # Соединение подготовки простаивало дольше keep-alive сервера
+    client = Client(base_url, ctx["token"])
+    _, _, data = client.request("GET", "/materials/?" + urlencode({
+        "q": name, "fields": "id,total_quantity,batches.id,batches.current_quantity"}))
+    current = next(m for m in _json(data) if m["id"] == material["id"])
+    batch_quantity = current["batches"][0]["current_quantity"]
+    ledger = _ledger(client, material["id"])
+    ledger_sum = sum(entry["delta"] for entry in ledger)
+
+    accepted = statuses["batch"][200] + statuses["fefo"][200]
+    expected = min(writes, stock)
+    print(f"[INFO] {label}: списаний {writes}, параллельно {len(threads)}, за {elapsed:.2f} с; "
+          f"ответы с партией: {dict(statuses['batch'])}, по FEFO: {dict(statuses['fefo'])}")
+    print(f"[INFO] {label}: партия {stock} -> {batch_quantity}, материал: {current['total_quantity']}, "
+          f"проводок: {len(ledger)}, сумма журнала: {ledger_sum}")
+    failures = []
+    unexpected = {status: count for counter in statuses.values() for status, count in counter.items()
+                  if status not in (200, 400)}
+    if unexpected:
+        failures.append(f"{label}: неожиданные ответы: {unexpected}")
+    if accepted != expected:
+        failures.append(f"{label}: принято {accepted} списаний, ожидалось {expected}")
+    if writes <= stock and statuses["fefo"][400]:
+        # Остатка хватает на все запросы: отказ по FEFO означает, что партия была лишь занята
+        failures.append(f"{label}: {statuses['fefo'][400]} ложных отказов по FEFO при остатке на складе")
+    if batch_quantity < 0:
+        failures.append(f"{label}: отрицательный остаток партии: {batch_quantity}")
+    if batch_quantity != stock - accepted:
+        failures.append(f"{label}: потерянные обновления: остаток партии {batch_quantity}, "
+                        f"ожидался {stock - accepted}")
+    if not (ledger_sum == batch_quantity == current["total_quantity"]):
+        failures.append(f"{label}: сумма журнала {ledger_sum}, партия {batch_quantity}, "
+                        f"материал {current['total_quantity']} не совпадают")
+    if len(ledger) != accepted + 1:
+        failures.append(f"{label}: проводок {len(ledger)}, ожидалось {accepted + 1}")
+    return failures
+
+
+def stress_write_offs(base_url, ctx, writes, concurrency):
+    """Два прогона по N параллельных списаний с одной партии; возвращает список нарушенных условий.
+
+    1. Остаток N/2, половина запросов с явной партией: принято ровно N/2, остаток не ушел в минус.
+    2. Остаток N, только FEFO: принято все, любой отказ - ложный (партия была занята, а не пуста).
+    """
+    return (_stress_run(base_url, ctx, "перепродажа", writes, writes // 2, concurrency, explicit_batch=0.5)
+            + _stress_run(base_url, ctx, "только FEFO", writes, writes, concurrency, explicit_batch=0))
+
+
+def run_scenario(base_url, ctx, scenario, requests, concurrency):
+    name, build, on_response = scenario
+    counter = iter(range(requests))
+    counter_lock = threading.Lock()
+    samples, errors, skipped, queries = [], collections.Counter(), [0], []
+
+    def worker():
+        client = Client(base_url, ctx["token"])
+        while True:
+            with counter_lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            kwargs = build(ctx, i)
+            if kwargs is None:
+                skipped[0] += 1
+                continue
+            started = time.perf_counter()
+            try:
+                status, query_count, data = client.request(**kwargs)
+            except (http.client.HTTPException, OSError) as e:
+                errors[type(e).__name__] += 1
+                continue
+            samples.append(time.perf_counter() - started)
+            if status >= 400:
+                errors[str(status)] += 1
+            elif on_response:
+                on_response(ctx, data)
+            if query_count is not None:
+                queries.append(int(query_count))
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(samples)
+    return {
+        "requests": len(latencies), "skipped": skipped[0], "errors": dict(errors),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "queries_per_request": round(sum(queries) / len(queries), 2) if queries else None,
+    }
+
+
+def print_report(results, baseline, threshold):
+    """Печатает таблицу; возвращает маршруты, у которых p95 вырос больше порога."""
+    regressions = []
+    print(f"{'маршрут':<32} {'n':>6} {'ошибки':>7} {'p50':>9} {'p95':>9} {'p99':>9} {'rps':>8} {'SQL':>6}"
+          + ("   p95 к базе" if baseline else ""))
+    for name, row in results.items():
+        line = (f"{name:<32} {row['requests']:>6} {sum(row['errors'].values()):>7} {row['p50_ms']:>9} "
+                f"{row['p95_ms']:>9} {row['p99_ms']:>9} {row['rps']:>8} "
+                f"{'-' if row['queries_per_request'] is None else row['queries_per_request']:>6}")
+        before = (baseline or {}).get(name)
+        if before and before["p95_ms"]:
+            change = (row["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100
+            line += f"   {change:+.1f}%"
+            if change > threshold:
+                line += " !"
+                regressions.append(name)
+        print(line)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон по маршрутам API")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--email", default="admin@bench.example.com", help="администратор стенда (см. app.seed)")
+    parser.add_argument("--password", default="bench")
+    parser.add_argument("--metrics-token", default=os.getenv("METRICS_TOKEN", ""),
+                        help="токен /metrics, если на сервере задан METRICS_TOKEN")
+    parser.add_argument("--concurrency", type=int, default=8, help="число параллельных клиентов")
+    parser.add_argument("--requests", type=int, default=200, help="запросов на маршрут")
+    parser.add_argument("--routes", nargs="*", help='только указанные маршруты, например "GET /materials/"')
+    parser.add_argument("--save", help="сохранить результаты в JSON (база для сравнения)")
+    parser.add_argument("--baseline", help="сравнить с ранее сохраненными результатами")
+    parser.add_argument("--threshold", type=float, default=10.0, help="допустимый рост p95, %%")
+    parser.add_argument("--stress", type=int, metavar="N",
+                        help="вместо замеров: N параллельных списаний с одной партии и проверка остатков")
+    args = parser.parse_args(argv)
+
+    if args.stress:
+        ctx = prepare(args.base_url, args.email, args.password, args.metrics_token)
+        failures = stress_write_offs(args.base_url, ctx, args.stress, args.concurrency)
+        for failure in failures:
+            print(f"[ERROR] {failure}")
+        if not failures:
+            print("[INFO] Остатки и журнал согласованы")
+        return 1 if failures else 0
+
+    uncovered = uncovered_routes()
+    if uncovered:
+        print(f"[ERROR] Маршруты без сценария: {', '.join(uncovered)}")
+        return 2
+    scenarios = [s for s in SCENARIOS if not args.routes or s[0] in args.routes]
+    unknown = set(args.routes or ()) - {s[0] for s in SCENARIOS}
+    if unknown:
+        print(f"[ERROR] Неизвестные маршруты: {', '.join(sorted(unknown))}")
+        return 2
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["routes"]
+
+    ctx = prepare(args.base_url, args.email, args.password, args.metrics_token)
+    results = {}
+    for scenario in scenarios:
+        print(f"[INFO] {scenario[0]:<40}", end="\r", flush=True)
+        results[scenario[0]] = run_scenario(args.base_url, ctx, scenario, args.requests, args.concurrency)
+    print()
+    regressions = print_report(results, baseline, args.threshold)
+
+    if args.save:
+        report = {
+            "meta": {"base_url": args.base_url, "concurrency": args.concurrency, "requests": args.requests,
+                     "started_at": datetime.now(timezone.utc).isoformat()},
+            "routes": results,
+        }
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"[INFO] Результаты сохранены в {args.save}")
+    if regressions:
+        print(f"[WARN] p95 вырос больше чем на {args.threshold}%: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,162 @@
+"""Кэши: статистика дашборда и аутентифицированные пользователи.
+
+Статистика пересчитывается не чаще раза в DASHBOARD_CACHE_TTL секунд и сбрасывается
+операциями, меняющими остатки. Хранилище подменяемое (set_backend): по умолчанию
+словарь в памяти процесса; для нескольких воркеров можно подставить общее хранилище
+с тем же интерфейсом get/set/delete/incr (incr атомарно увеличивает счетчик без TTL,
+как INCR в Redis) - тогда сброс в одном воркере виден всем.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import event
+
+from . import models, metrics
+
+DASHBOARD_CACHE_TTL = int(os.getenv("DASHBOARD_CACHE_TTL", "60"))
+DASHBOARD_KEY = "dashboard:stats"
+DASHBOARD_GENERATION_KEY = "dashboard:generation"
+PRINCIPAL_CACHE_TTL = int(os.getenv("PRINCIPAL_CACHE_TTL", "30"))
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "1024"))
+
+
+class MemoryBackend:
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key, value, ttl: int):
+        with self._lock:
+            now = time.monotonic()
+            # Записи прошлых поколений больше не читаются, вычищаем их по истечении TTL
+            for stale_key in [k for k, (_, expires_at) in self._data.items() if expires_at < now]:
+                del self._data[stale_key]
+            self._data[key] = (value, now + ttl)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def incr(self, key) -> int:
+        with self._lock:
+            value = (self._data.get(key) or (0, None))[0] + 1
+            self._data[key] = (value, float("inf"))
+            return value
+
+
+_backend = MemoryBackend()
+# Вычисления статистики, идущие в этом процессе: параллельные промахи по одному ключу
+# ждут одно вычисление, а не запускают тяжелый запрос каждый
+_inflight = {}
+
+
+def set_backend(backend):
+    global _backend
+    _backend = backend
+
+
+def _dashboard_generation():
+    return _backend.get(DASHBOARD_GENERATION_KEY) or 0
+
+
+async def _compute_dashboard_entry(compute, key, generation):
+    stats = jsonable_encoder(await compute())
+    digest = hashlib.sha1(json.dumps(stats, sort_keys=True).encode()).hexdigest()
+    entry = {"etag": f'"{digest}"', "stats": stats}
+    # Результат, посчитанный до сброса, в кэш не кладем
+    if generation == _dashboard_generation():
+        _backend.set(key, entry, DASHBOARD_CACHE_TTL)
+    return entry
+
+
+async def get_dashboard_stats(compute, params=()):
+    """Возвращает {"etag": ..., "stats": ...}, ожидая compute() только при промахе.
+
+    Поколение хранится в общем хранилище и входит в ключ: сброс в любом воркере разом
+    делает устаревшими записи всех вариантов параметров.
+    """
+    generation = _dashboard_generation()
+    key = ":".join([DASHBOARD_KEY, str(generation), *map(str, params)])
+    entry = _backend.get(key)
+    metrics.cache_requests.inc(("dashboard", "miss" if entry is None else "hit"))
+    if entry is not None:
+        return entry
+
+    task = _inflight.get(key)
+    if task is None:
+        task = _inflight[key] = asyncio.ensure_future(_compute_dashboard_entry(compute, key, generation))
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    # shield: отключение одного клиента не отменяет вычисление для остальных
+    return await asyncio.shield(task)
+
+
+def invalidate_dashboard():
+    _backend.incr(DASHBOARD_GENERATION_KEY)
+
+
+class LRUCache:
+    """Ограниченный по размеру кэш с TTL; при переполнении вытесняется давно не читавшаяся запись.
+
+    name - метка в метрике cache_requests_total (попадания/промахи).
+    """
+
+    def __init__(self, maxsize: int, ttl: int, name: str = "lru"):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.name = name
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] < time.monotonic():
+                del self._data[key]
+                entry = None
+            if entry is not None:
+                self._data.move_to_end(key)
+        metrics.cache_requests.inc((self.name, "miss" if entry is None else "hit"))
+        return None if entry is None else entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+# Пользователи по subject токена (email); TTL ограничивает устаревание в других воркерах
+principals = LRUCache(PRINCIPAL_CACHE_SIZE, PRINCIPAL_CACHE_TTL, name="principals")
+
+
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def _invalidate_principals(mapper, connection, target):
+    # Смена email оставила бы запись под старым ключом, поэтому сбрасываем кэш целиком
+    principals.clear()
@@ -0,0 +1,47 @@
+"""Контрольные точки остатков для запросов "остаток на дату" и журнала материала.
+
+Точка не может быть ближе CHECKPOINT_LAG_HOURS к текущему моменту: created_at проводки -
+время начала ее транзакции, и транзакция, начатая до точки, может зафиксироваться уже после
+ее расчета. Такая проводка не попала бы ни в точку, ни в проводки после нее.
+
+Запуск (например, из cron вскоре после полуночи):
+    python -m app.checkpoints                      # на начало суток UTC CHECKPOINT_LAG_HOURS назад
+    python -m app.checkpoints --at 2026-01-01T00:00:00+00:00
+"""
+import argparse
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+from .database import open_session
+from . import crud
+
+# С запасом дольше любой транзакции записи проводок
+CHECKPOINT_LAG_HOURS = float(os.getenv("CHECKPOINT_LAG_HOURS", "24"))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Сохранение контрольных точек остатков")
+    parser.add_argument("--at", type=datetime.fromisoformat, help="момент контрольной точки (ISO 8601)")
+    args = parser.parse_args(argv)
+
+    latest = datetime.now(timezone.utc) - timedelta(hours=CHECKPOINT_LAG_HOURS)
+    # По умолчанию - начало суток, на которые приходится latest (при запуске после полуночи - вчерашних)
+    at = args.at or latest.replace(hour=0, minute=0, second=0, microsecond=0)
+    if at.tzinfo is None:
+        at = at.replace(tzinfo=timezone.utc)
+    if at > latest:
+        print(f"[ERROR] Точка {at.isoformat()} ближе {CHECKPOINT_LAG_HOURS:g} ч к текущему моменту: "
+              "еще не зафиксированные проводки до нее будут потеряны")
+        return 1
+    db = open_session()
+    try:
+        created = crud.create_balance_checkpoints(db, at)
+    finally:
+        db.close()
+    print(f"[INFO] Контрольных точек на {at.isoformat()}: {created}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,25 +1,131 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import select, func, text
-from datetime import datetime, timedelta
-from . import models, schemas, security
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy import (select, insert, update, func, text, tuple_, and_, or_, values, column,
+                        Integer, Float)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+import os
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from . import models, schemas, security, cache, audit, alerts
 
 
 # --- ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ---
 def create_activity_log(db: Session, user_id: int, action: str, details: str = None):
-    """Создает запись в журнале активности."""
-    db_log = models.ActivityLog(user_id=user_id, action=action, details=details)
-    db.add(db_log)
+    """Создает запись в журнале активности (пишется после commit, см. audit)."""
+    audit.record(db, user_id=user_id, action=action, details=details)
+
+
+def apply_stock_delta(db: Session, material_id: int, delta: float):
+    """Атомарно изменяет денормализованный остаток материала в текущей транзакции БД."""
+    apply_stock_deltas(db, {material_id: delta})
+
+
+def apply_stock_deltas(db: Session, deltas: dict[int, float], alert: bool = False):
+    """То же для нескольких материалов одним INSERT ... ON CONFLICT (в порядке id, чтобы не ловить deadlock).
+
+    При alert=True в том же запросе читаются новые остатки материалов с min_quantity > 0,
+    и пересечения порога уходят в alerts.notify (доставятся после commit).
+    """
+    if not deltas:
+        return
+    stmt = pg_insert(models.StockBalance).values(
+        [{"material_id": material_id, "quantity": deltas[material_id]} for material_id in sorted(deltas)])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[models.StockBalance.material_id],
+        set_={"quantity": models.StockBalance.quantity + stmt.excluded.quantity, "updated_at": func.now()}
+    )
+    if not alert:
+        db.execute(stmt)
+        return
+    upserted = stmt.returning(models.StockBalance.material_id, models.StockBalance.quantity).cte("upserted")
+    rows = db.execute(
+        select(upserted.c.material_id, upserted.c.quantity, models.Material.name, models.Material.unit,
+               models.Material.min_quantity)
+        .join(models.Material, models.Material.id == upserted.c.material_id)
+        .where(models.Material.min_quantity > 0)
+    ).all()
+    alerts.notify(db, alerts.stock_crossings(rows, deltas))
+
+
+def get_stock_quantity(db: Session, material_id: int) -> float:
+    return db.execute(select(models.StockBalance.quantity).filter(
+        models.StockBalance.material_id == material_id)).scalar() or 0
 
 
 def get_material_with_total(db: Session, db_material: models.Material):
-    """Возвращает схему материала с посчитанным общим количеством."""
-    total_quantity = db.query(func.sum(models.Batch.current_quantity)).filter(
-        models.Batch.material_id == db_material.id).scalar() or 0
-    material_data = schemas.Material.from_orm(db_material)
-    material_data.total_quantity = total_quantity
+    """Возвращает схему материала с общим количеством из таблицы остатков."""
+    material_data = schemas.Material.model_validate(db_material)
+    material_data.total_quantity = get_stock_quantity(db, db_material.id)
     return material_data
 
 
+def reconcile_stock_balances(db: Session, apply: bool = False):
+    """Сверяет остатки с журналом проводок; при apply=True перестраивает таблицу остатков.
+
+    Проводки до границы архива в БД уже отсутствуют: их заменяет контрольная точка на этой
+    границе (сохраняется app.partitions перед удалением секций). Более поздние точки не
+    используются - сверка проверяет остатки по самим проводкам. Без точки на границе сверка
+    невозможна (ValueError): иначе архивные проводки посчитались бы нулем.
+    Возвращает список расхождений: material_id, name, balance, ledger, drift.
+    """
+    boundary = get_archive_boundary(db, "transactions")
+    if boundary is not None and db.scalar(
+            select(func.count()).where(models.BalanceCheckpoint.as_of == boundary)) == 0:
+        raise ValueError(f"Нет контрольной точки на границе архива проводок {boundary.isoformat()}")
+    ledger = select(models.Transaction.material_id, func.sum(models.Transaction.delta).label("ledger")) \
+        .group_by(models.Transaction.material_id)
+    opening = None
+    if boundary is not None:
+        ledger = ledger.where(models.Transaction.created_at >= boundary)
+        opening = select(models.BalanceCheckpoint.material_id, models.BalanceCheckpoint.quantity) \
+            .where(models.BalanceCheckpoint.as_of == boundary).subquery()
+    ledger = ledger.subquery()
+    total = func.coalesce(ledger.c.ledger, 0) + (func.coalesce(opening.c.quantity, 0) if opening is not None else 0)
+    stmt = select(models.Material.id, models.Material.name,
+                  func.coalesce(models.StockBalance.quantity, 0).label("balance"), total.label("ledger")) \
+        .outerjoin(models.StockBalance, models.StockBalance.material_id == models.Material.id) \
+        .outerjoin(ledger, ledger.c.material_id == models.Material.id)
+    if opening is not None:
+        stmt = stmt.outerjoin(opening, opening.c.material_id == models.Material.id)
+    rows = db.execute(stmt.order_by(models.Material.id)).mappings().all()
+
+    drift = [
+        {**row, "drift": row["balance"] - row["ledger"]}
+        for row in rows if abs(row["balance"] - row["ledger"]) > 1e-9
+    ]
+
+    if apply and drift:
+        stmt = pg_insert(models.StockBalance).values(
+            [{"material_id": row["id"], "quantity": row["ledger"]} for row in drift])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[models.StockBalance.material_id],
+            set_={"quantity": stmt.excluded.quantity, "updated_at": func.now()}
+        )
+        db.execute(stmt)
+        db.commit()
+    return drift
+
+
+def get_activity_logs(db: Session, user_id: int = None, action: str = None, date_from: datetime = None,
+                      date_to: datetime = None, limit: int = 100, before_created_at: datetime = None,
+                      before_id: int = None):
+    """Журнал активности, новые записи первыми; следующая страница - before_* от последней записи."""
+    stmt = select(models.ActivityLog).order_by(models.ActivityLog.created_at.desc(), models.ActivityLog.id.desc())
+    if user_id is not None:
+        stmt = stmt.where(models.ActivityLog.user_id == user_id)
+    if action:
+        stmt = stmt.where(models.ActivityLog.action == action)
+    if date_from is not None:
+        stmt = stmt.where(models.ActivityLog.created_at >= date_from)
+    if date_to is not None:
+        stmt = stmt.where(models.ActivityLog.created_at < date_to)
+    if before_created_at is not None and before_id is not None:
+        # created_at <= ... дублирует сравнение кортежей ради отсечения секций
+        stmt = stmt.where(models.ActivityLog.created_at <= before_created_at,
+                          tuple_(models.ActivityLog.created_at, models.ActivityLog.id)
+                          < tuple_(before_created_at, before_id))
+    return db.execute(stmt.limit(limit)).scalars().all()
+
+
 # --- CRUD ОПЕРАЦИИ ---
 def get_user(db: Session, user_id: int):
     return db.get(models.User, user_id)
@@ -33,8 +139,9 @@ def get_user_by_email(db: Session, email: str):
     return db.execute(select(models.User).filter(models.User.email == email)).scalar_one_or_none()
 
 
-def create_user(db: Session, user: schemas.UserCreate):
-    hashed_password = security.get_password_hash(user.password)
+def create_user(db: Session, user: schemas.UserCreate, hashed_password: str = None):
+    if hashed_password is None:
+        hashed_password = security.get_password_hash(user.password)
     db_user = models.User(
         email=user.email,
         full_name=user.full_name,
@@ -52,6 +159,11 @@ def create_user(db: Session, user: schemas.UserCreate):
     return db_user
 
 
+def update_user_password_hash(db: Session, db_user: models.User, hashed_password: str):
+    db_user.hashed_password = hashed_password
+    db.commit()
+
+
 def authenticate_user(db: Session, email: str, password: str):
     user = get_user_by_email(db, email)
     if not user:
@@ -64,15 +176,111 @@ def authenticate_user(db: Session, email: str, password: str):
     return user
 
 
-def get_materials(db: Session, skip: int = 0, limit: int = 100, q: str = None):
-    stmt = select(models.Material).order_by(models.Material.name)
+# Порог word_similarity для нечеткого поиска по имени. Запрос сравнивается с самым похожим
+# фрагментом имени, а не со всей строкой: "paracetamol" и "Парацетамол табл. 200 мг" дают 0.56,
+# "lidocaine" и "Лидокаин 2% 2 мл" - 0.4, тогда как порог pg_trgm по умолчанию - 0.6
+MATERIAL_SEARCH_THRESHOLD = float(os.getenv("MATERIAL_SEARCH_THRESHOLD", "0.35"))
+
+
+def set_search_threshold(db: Session):
+    """Порог оператора <% (pg_trgm.word_similarity_threshold) до конца текущей транзакции."""
+    db.execute(select(func.set_config("pg_trgm.word_similarity_threshold", str(MATERIAL_SEARCH_THRESHOLD), True)))
+
+
+def material_search_condition(q: str):
+    """Условие поиска по имени без учета регистра и алфавита (кириллица/латиница).
+
+    Использует GIN-индекс ix_materials_name_trgm по clinic_translit(name): подстрока
+    ищется через ILIKE, опечатки и другое написание - оператором <% (word_similarity:
+    запрос против любого фрагмента имени, поэтому дозировка и форма выпуска в имени
+    не мешают). Порог задает set_search_threshold в той же транзакции.
+    """
+    escaped = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    key = func.clinic_translit(models.Material.name)
+    needle = func.clinic_translit(escaped)
+    return or_(key.ilike(func.concat("%", needle, "%")), func.clinic_translit(q).op("<%")(key))
+
+
+def suggest_materials(db: Session, q: str, limit: int = 10):
+    """Подсказки для поиска по мере ввода: только id, имя, единица и остаток, по убыванию сходства."""
+    key = func.clinic_translit(models.Material.name)
+    set_search_threshold(db)
+    stmt = select(
+        models.Material.id, models.Material.name, models.Material.unit,
+        func.coalesce(models.StockBalance.quantity, 0).label("total_quantity")
+    ).outerjoin(models.StockBalance, models.StockBalance.material_id == models.Material.id) \
+        .where(material_search_condition(q)) \
+        .order_by(func.word_similarity(func.clinic_translit(q), key).desc(), models.Material.name) \
+        .limit(limit)
+    return db.execute(stmt).mappings().all()
+
+
+# Поля, доступные для ?fields= в списках: имя поля -> SQL-выражение.
+# В SELECT попадают только запрошенные колонки, строки отдаются словарями без Pydantic.
+MATERIAL_FIELDS = {
+    "id": models.Material.id,
+    "name": models.Material.name,
+    "unit": models.Material.unit,
+    "min_quantity": models.Material.min_quantity,
+    "is_narcotic": models.Material.is_narcotic,
+    "supplier_id": models.Material.supplier_id,
+    "total_quantity": func.coalesce(models.StockBalance.quantity, 0),
+}
+
+BATCH_FIELDS = {
+    "id": models.Batch.id,
+    "initial_quantity": models.Batch.initial_quantity,
+    "current_quantity": models.Batch.current_quantity,
+    "expiration_date": models.Batch.expiration_date,
+    "created_at": models.Batch.created_at,
+}
+
+
+def project_fields(field_map: dict, fields: list[str] = None):
+    """Колонки для SELECT с метками по именам полей; без fields — все поля."""
+    return [field_map[name].label(name) for name in (fields or field_map)]
+
+
+def load_children(db: Session, parent_key, parent_ids: list[int], field_map: dict, fields: list[str] = None,
+                  order_by=()):
+    """Одной выборкой загружает вложенные записи для страницы родителей: {parent_id: [dict, ...]}."""
+    grouped = {parent_id: [] for parent_id in parent_ids}
+    if not parent_ids:
+        return grouped
+    stmt = select(parent_key.label("_parent_id"), *project_fields(field_map, fields)) \
+        .where(parent_key.in_(parent_ids)).order_by(parent_key, *order_by)
+    for row in db.execute(stmt).mappings():
+        item = dict(row)
+        grouped[item.pop("_parent_id")].append(item)
+    return grouped
+
+
+def get_materials(db: Session, limit: int = 100, q: str = None, after_name: str = None, after_id: int = None,
+                  fields: list[str] = None, include_batches: bool = False, batch_fields: list[str] = None):
+    """Список материалов с остатками: одна выборка + (опционально) одна выборка партий.
+
+    Выбираются только колонки из fields (см. MATERIAL_FIELDS / BATCH_FIELDS).
+    Пагинация по ключу (name, id): следующая страница запрашивается с after_name/after_id
+    последнего элемента предыдущей.
+    """
+    stmt = select(models.Material.id.label("_id"), *project_fields(MATERIAL_FIELDS, fields)) \
+        .order_by(models.Material.name, models.Material.id)
+    if fields is None or "total_quantity" in fields:
+        stmt = stmt.outerjoin(models.StockBalance, models.StockBalance.material_id == models.Material.id)
     if q:
-        stmt = stmt.filter(models.Material.name.ilike(f"%{q}%"))
-
-    results = db.execute(stmt.offset(skip).limit(limit)).scalars().all()
+        set_search_threshold(db)
+        stmt = stmt.filter(material_search_condition(q))
+    if after_name is not None and after_id is not None:
+        stmt = stmt.filter(tuple_(models.Material.name, models.Material.id) > tuple_(after_name, after_id))
 
-    materials_with_totals = [get_material_with_total(db, material) for material in results]
-    return materials_with_totals
+    materials = [dict(row) for row in db.execute(stmt.limit(limit)).mappings()]
+    ids = [material.pop("_id") for material in materials]
+    if include_batches:
+        batches = load_children(db, models.Batch.material_id, ids, BATCH_FIELDS, batch_fields,
+                                order_by=(models.Batch.id,))
+        for material_id, material in zip(ids, materials):
+            material["batches"] = batches[material_id]
+    return materials
 
 
 def create_material(db: Session, material: schemas.MaterialCreate, user_id: int):
@@ -82,8 +290,8 @@ def create_material(db: Session, material: schemas.MaterialCreate, user_id: int)
         supplier_id=material.supplier_id
     )
     db.add(db_material)
-    db.commit()
-    db.refresh(db_material)
+    db.flush()
+    apply_stock_delta(db, db_material.id, 0)
 
     if material.initial_quantity > 0:
         batch = models.Batch(
@@ -98,9 +306,11 @@ def create_material(db: Session, material: schemas.MaterialCreate, user_id: int)
             note="Initial stock", user_id=user_id, batch_id=batch.id
         )
         db.add(transaction)
+        apply_stock_delta(db, db_material.id, material.initial_quantity)
 
     create_activity_log(db, user_id=user_id, action="Создание материала", details=f"Создан: {db_material.name}")
     db.commit()
+    cache.invalidate_dashboard()
     db.refresh(db_material)
 
     return get_material_with_total(db, db_material)
@@ -112,6 +322,7 @@ def delete_material(db: Session, material_id: int, user_id: int):
         create_activity_log(db, user_id=user_id, action="Удаление материала", details=f"Удален: {db_material.name}")
         db.delete(db_material)
         db.commit()
+        cache.invalidate_dashboard()
     return db_material
 
 
@@ -124,39 +335,322 @@ def update_material(db: Session, material_id: int, material: schemas.MaterialCre
         db.add(db_material)
         create_activity_log(db, user_id=user_id, action="Изменение материала", details=f"Изменен: {db_material.name}")
         db.commit()
+        cache.invalidate_dashboard()
         db.refresh(db_material)
-    return get_material_with_total(db, db_material)
+        return get_material_with_total(db, db_material)
+    return None
+
+
+def change_batch_quantity(db: Session, batch_id: int, material_id: int, delta: float) -> bool:
+    """Атомарно меняет остаток партии, не допуская ухода в минус.
+
+    Проверка и изменение выполняются одним UPDATE, поэтому параллельные списания
+    из одной партии не могут пройти проверку одновременно и потерять обновление.
+    """
+    result = db.execute(
+        update(models.Batch)
+        .where(models.Batch.id == batch_id, models.Batch.material_id == material_id,
+               models.Batch.current_quantity + delta >= 0)
+        .values(current_quantity=models.Batch.current_quantity + delta)
+        .returning(models.Batch.id)
+        .execution_options(synchronize_session=False)
+    )
+    return result.first() is not None
+
+
+def split_fefo(available: list[tuple[int, float]], quantity: float):
+    """Раскладывает списание quantity по партиям, уже упорядоченным по FEFO.
+
+    Возвращает список (batch_id, delta) или None, если остатка не хватает.
+    """
+    allocations = []
+    remaining = quantity
+    for batch_id, batch_quantity in available:
+        if remaining <= 0:
+            break
+        if batch_quantity <= 0:
+            continue
+        taken = min(batch_quantity, remaining)
+        allocations.append((batch_id, -taken))
+        remaining -= taken
+    if remaining > 1e-9:
+        return None
+    return allocations
+
+
+def batch_not_expired():
+    """Условие для автосписания: у партии нет срока годности или он еще не истек."""
+    return or_(models.Batch.expiration_date.is_(None), models.Batch.expiration_date >= func.now())
+
+
+def fefo_key(batch):
+    """Порядок FEFO: раньше истекающие партии первыми, партии без срока годности - последними."""
+    return batch.expiration_date is None, batch.expiration_date or datetime.min, batch.id
+
+
+def allocate_batches_fefo(db: Session, material_id: int, quantity: float):
+    """Подбирает партии для списания quantity по принципу FEFO (first expired, first out).
+
+    Сначала партии блокируются FOR UPDATE SKIP LOCKED, чтобы параллельные списания разбирали
+    разные партии, не дожидаясь друг друга. Если незаблокированных партий не хватило, попытка
+    откатывается к точке сохранения (ее блокировки снимаются) и партии блокируются с ожиданием
+    в порядке id, как в пакетном списании: None означает реальную нехватку остатка, а не занятые
+    партии. Просроченные партии не списываются.
+    """
+    query = select(models.Batch.id, models.Batch.current_quantity, models.Batch.expiration_date) \
+        .where(models.Batch.material_id == material_id, models.Batch.current_quantity > 0, batch_not_expired())
+
+    savepoint = db.begin_nested()
+    batches = db.execute(
+        query.order_by(models.Batch.expiration_date.asc().nulls_last(), models.Batch.id)
+        .with_for_update(skip_locked=True)
+    ).all()
+    allocations = split_fefo([(batch.id, batch.current_quantity) for batch in batches], quantity)
+    if allocations is not None:
+        savepoint.commit()
+        return allocations
+    savepoint.rollback()
+
+    batches = db.execute(query.order_by(models.Batch.id).with_for_update()).all()
+    return split_fefo([(batch.id, batch.current_quantity) for batch in sorted(batches, key=fefo_key)], quantity)
 
 
 def create_transaction(db: Session, trans_data: schemas.TransactionCreate, user_id: int):
-    batch = db.get(models.Batch, trans_data.batch_id)
-    if not batch or batch.current_quantity < abs(trans_data.delta):
+    """Проводит операцию по партии; при списании без batch_id подбирает партии по FEFO.
+
+    Возвращает список созданных проводок (по одной на партию) или None.
+    """
+    if trans_data.batch_id is not None:
+        allocations = [(trans_data.batch_id, trans_data.delta)]
+    elif trans_data.delta < 0:
+        allocations = allocate_batches_fefo(db, trans_data.material_id, -trans_data.delta)
+    else:
+        allocations = None
+
+    if not allocations or not all(
+            change_batch_quantity(db, batch_id, trans_data.material_id, delta) for batch_id, delta in allocations):
+        db.rollback()
         return None
 
-    batch.current_quantity += trans_data.delta
-
-    db_transaction = models.Transaction(
-        material_id=trans_data.material_id, delta=trans_data.delta,
-        note=trans_data.note, batch_id=trans_data.batch_id, user_id=user_id
-    )
-    db.add(db_transaction)
+    db_transactions = [
+        models.Transaction(
+            material_id=trans_data.material_id, delta=delta,
+            note=trans_data.note, batch_id=batch_id, user_id=user_id
+        ) for batch_id, delta in allocations
+    ]
+    db.add_all(db_transactions)
     db.flush()
+    apply_stock_deltas(db, {trans_data.material_id: trans_data.delta}, alert=True)
 
     if trans_data.narcotic_log:
-        narcotic_log = models.NarcoticLog(
-            transaction_id=db_transaction.id,
-            patient_info=trans_data.narcotic_log.patient_info,
-            reason=trans_data.narcotic_log.reason
-        )
-        db.add(narcotic_log)
-
-    action_details = f"{abs(trans_data.delta)} {batch.material.unit.value} материала '{batch.material.name}'"
+        # Запись журнала нужна для каждой проводки, иначе журнал покажет лишь часть списания
+        db.add_all([
+            models.NarcoticLog(
+                transaction_id=db_transaction.id, material_id=db_transaction.material_id,
+                user_id=db_transaction.user_id, delta=db_transaction.delta,
+                patient_info=trans_data.narcotic_log.patient_info,
+                reason=trans_data.narcotic_log.reason
+            ) for db_transaction in db_transactions
+        ])
+
+    material = db.get(models.Material, trans_data.material_id)
+    action_details = f"{abs(trans_data.delta)} {material.unit.value} материала '{material.name}'"
     action_type = "Списание материала" if trans_data.delta < 0 else "Поступление материала"
     create_activity_log(db, user_id=user_id, action=action_type, details=action_details)
 
     db.commit()
-    db.refresh(db_transaction)
-    return db_transaction
+    cache.invalidate_dashboard()
+    for db_transaction in db_transactions:
+        db.refresh(db_transaction)
+    return db_transactions
+
+
+def create_transactions_bulk(db: Session, lines: list[schemas.TransactionCreate], user_id: int):
+    """Проводит пакет операций одной транзакцией БД и возвращает результат по каждой строке.
+
+    Строки с ошибками пропускаются, остальные проводятся. Все затронутые партии
+    блокируются одним SELECT ... FOR UPDATE в порядке id, поэтому параллельные пакеты
+    не взаимоблокируются; проводки, записи журналов и остатки пишутся массовыми INSERT/UPDATE.
+    """
+    results = [{"index": i, "ok": False, "transaction_ids": [], "error": None} for i in range(len(lines))]
+    materials = {
+        material.id: material for material in db.execute(
+            select(models.Material).where(models.Material.id.in_({line.material_id for line in lines}))).scalars()
+    }
+
+    valid = []
+    for i, line in enumerate(lines):
+        material = materials.get(line.material_id)
+        if not material:
+            results[i]["error"] = "Material not found"
+        elif material.is_narcotic and line.delta < 0 and not line.narcotic_log:
+            results[i]["error"] = "Narcotic log is required for this transaction"
+        elif line.batch_id is None and line.delta >= 0:
+            results[i]["error"] = "Batch is required for this transaction"
+        else:
+            valid.append(i)
+
+    batch_ids = {lines[i].batch_id for i in valid if lines[i].batch_id is not None}
+    fefo_material_ids = {lines[i].material_id for i in valid if lines[i].batch_id is None}
+    conditions = []
+    if batch_ids:
+        conditions.append(models.Batch.id.in_(batch_ids))
+    if fefo_material_ids:
+        conditions.append(and_(models.Batch.material_id.in_(fefo_material_ids), models.Batch.current_quantity > 0,
+                               batch_not_expired()))
+
+    batches, fefo_order = {}, {}
+    if conditions:
+        rows = db.execute(
+            select(models.Batch.id, models.Batch.material_id, models.Batch.current_quantity,
+                   models.Batch.expiration_date, batch_not_expired().label("usable"))
+            .where(or_(*conditions)).order_by(models.Batch.id).with_for_update()
+        ).all()
+        batches = {row.id: {"material_id": row.material_id, "quantity": row.current_quantity} for row in rows}
+        # Партии, выбранные по batch_id, попадают в выборку и просроченными - в FEFO их не берем
+        for row in sorted(rows, key=fefo_key):
+            if row.usable and row.material_id in fefo_material_ids:
+                fefo_order.setdefault(row.material_id, []).append(row.id)
+
+    planned = []
+    for i in valid:
+        line = lines[i]
+        if line.batch_id is not None:
+            batch = batches.get(line.batch_id)
+            if not batch or batch["material_id"] != line.material_id:
+                results[i]["error"] = "Batch not found"
+                continue
+            if batch["quantity"] + line.delta < 0:
+                results[i]["error"] = "Insufficient quantity in batch"
+                continue
+            allocations = [(line.batch_id, line.delta)]
+        else:
+            allocations = split_fefo(
+                [(batch_id, batches[batch_id]["quantity"]) for batch_id in fefo_order.get(line.material_id, [])],
+                -line.delta)
+            if allocations is None:
+                results[i]["error"] = "Insufficient quantity in stock"
+                continue
+        for batch_id, delta in allocations:
+            batches[batch_id]["quantity"] += delta
+            planned.append((i, batch_id, delta))
+        results[i]["ok"] = True
+
+    if not planned:
+        db.rollback()
+        return results
+
+    batch_deltas, material_deltas = {}, {}
+    for i, batch_id, delta in planned:
+        batch_deltas[batch_id] = batch_deltas.get(batch_id, 0) + delta
+        material_deltas[lines[i].material_id] = material_deltas.get(lines[i].material_id, 0) + delta
+
+    deltas = values(column("id", Integer), column("delta", Float), name="batch_deltas").data(
+        list(batch_deltas.items()))
+    db.execute(
+        update(models.Batch).where(models.Batch.id == deltas.c.id)
+        .values(current_quantity=models.Batch.current_quantity + deltas.c.delta)
+        .execution_options(synchronize_session=False)
+    )
+    # Порядок блокировок как в create_transaction: партии -> проводки (триггер consumption_daily)
+    # -> stock_balances; иначе пакет и одиночное списание по тому же материалу взаимоблокируются
+    transaction_ids = db.execute(
+        insert(models.Transaction).returning(models.Transaction.id, sort_by_parameter_order=True),
+        [{"material_id": lines[i].material_id, "delta": delta, "note": lines[i].note, "batch_id": batch_id,
+          "user_id": user_id} for i, batch_id, delta in planned]
+    ).scalars().all()
+    apply_stock_deltas(db, material_deltas, alert=True)
+
+    narcotic_logs = []
+    for (i, _, delta), transaction_id in zip(planned, transaction_ids):
+        results[i]["transaction_ids"].append(transaction_id)
+        if lines[i].narcotic_log:
+            narcotic_logs.append({"transaction_id": transaction_id, "material_id": lines[i].material_id,
+                                  "user_id": user_id, "delta": delta, **lines[i].narcotic_log.model_dump()})
+    if narcotic_logs:
+        db.execute(insert(models.NarcoticLog), narcotic_logs)
+
+    for result in results:
+        if not result["ok"]:
+            continue
+        line = lines[result["index"]]
+        material = materials[line.material_id]
+        create_activity_log(
+            db, user_id=user_id, action="Списание материала" if line.delta < 0 else "Поступление материала",
+            details=f"{abs(line.delta)} {material.unit.value} материала '{material.name}'")
+
+    db.commit()
+    cache.invalidate_dashboard()
+    return results
+
+
+# Свойства материала, которые импорт обновляет у существующих материалов
+IMPORT_UPDATABLE_FIELDS = {"min_quantity", "is_narcotic", "supplier_id"}
+
+
+def check_import_chunk(db: Session, rows: list[schemas.MaterialCreate]):
+    """Ошибки строк импорта, которые видны только по данным БД: несуществующий поставщик
+    и смена единицы измерения существующего материала. Возвращает {индекс строки: сообщение}."""
+    supplier_ids = {row.supplier_id for row in rows if row.supplier_id is not None}
+    known_suppliers = set(db.execute(
+        select(models.Supplier.id).where(models.Supplier.id.in_(supplier_ids))).scalars()) if supplier_ids else set()
+    units = dict(db.execute(select(models.Material.name, models.Material.unit)
+                            .where(models.Material.name.in_({row.name for row in rows}))).all())
+    errors = {}
+    for i, row in enumerate(rows):
+        if row.supplier_id is not None and row.supplier_id not in known_suppliers:
+            errors[i] = f"supplier_id: Supplier {row.supplier_id} not found"
+        elif row.name in units and units[row.name] != row.unit:
+            errors[i] = f"unit: Material already exists with unit '{units[row.name].value}'"
+    return errors
+
+
+def import_materials_chunk(db: Session, rows: list[schemas.MaterialCreate], user_id: int):
+    """Загружает пачку проверенных строк импорта: upsert материалов по имени, партии и проводки
+    начальных остатков - массовыми INSERT в одной транзакции.
+
+    Возвращает (число созданных материалов, число обновленных, число партий).
+    """
+    # Повтор имени внутри пачки: свойства материала берутся из последней строки
+    materials = {row.name: row for row in rows}
+    existing = set(db.execute(select(models.Material.name).where(models.Material.name.in_(materials))).scalars())
+    # Существующему материалу обновляются только колонки, заполненные в строке: пустая ячейка
+    # не сбрасывает is_narcotic, min_quantity и поставщика к значениям по умолчанию.
+    # Строки с одинаковым набором колонок загружаются одним запросом.
+    groups = defaultdict(list)
+    for row in materials.values():
+        groups[frozenset(row.model_fields_set & IMPORT_UPDATABLE_FIELDS)].append(row)
+    material_ids = {}
+    for updated, group in groups.items():
+        stmt = pg_insert(models.Material).values([
+            row.model_dump(include={"name", "unit", *IMPORT_UPDATABLE_FIELDS}) for row in group
+        ])
+        # Единица измерения существующего материала не меняется: в ней уже учтены партии и проводки.
+        # Без обновляемых колонок имя присваивается само себе, чтобы RETURNING вернул id
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[models.Material.name],
+            set_={key: stmt.excluded[key] for key in sorted(updated or {"name"})}
+        )
+        material_ids.update(db.execute(stmt.returning(models.Material.name, models.Material.id)).all())
+
+    stocked = [row for row in rows if row.initial_quantity > 0]
+    deltas = {material_id: 0.0 for material_id in material_ids.values()}
+    if stocked:
+        batch_ids = db.execute(
+            insert(models.Batch).returning(models.Batch.id, sort_by_parameter_order=True),
+            [{"material_id": material_ids[row.name], "initial_quantity": row.initial_quantity,
+              "current_quantity": row.initial_quantity, "expiration_date": row.expiration_date} for row in stocked]
+        ).scalars().all()
+        db.execute(insert(models.Transaction), [
+            {"material_id": material_ids[row.name], "delta": row.initial_quantity, "note": "Initial stock",
+             "user_id": user_id, "batch_id": batch_id} for row, batch_id in zip(stocked, batch_ids)
+        ])
+        for row in stocked:
+            deltas[material_ids[row.name]] += row.initial_quantity
+    apply_stock_deltas(db, deltas)
+
+    db.commit()
+    return len(materials) - len(existing), len(existing), len(stocked)
 
 
 def create_purchase_request(db: Session, request: schemas.PurchaseRequestCreate, user_id: int):
@@ -172,74 +666,147 @@ def create_purchase_request(db: Session, request: schemas.PurchaseRequestCreate,
 
     create_activity_log(db, user_id, "Создание заявки", f"Создана заявка #{db_request.id}")
     db.commit()
-    db.refresh(db_request)
-    return db_request
-
-
-def get_purchase_requests(db: Session):
-    return db.query(models.PurchaseRequest).order_by(models.PurchaseRequest.created_at.desc()).all()
+    return get_purchase_request(db, db_request.id)
+
+
+def get_purchase_request(db: Session, request_id: int):
+    """Заявка вместе с позициями (загружаются сразу, чтобы объект сериализовался вне сессии)."""
+    return db.execute(
+        select(models.PurchaseRequest).options(selectinload(models.PurchaseRequest.items))
+        .where(models.PurchaseRequest.id == request_id).execution_options(populate_existing=True)
+    ).scalar_one()
+
+
+PURCHASE_REQUEST_FIELDS = {
+    "id": models.PurchaseRequest.id,
+    "requester_id": models.PurchaseRequest.requester_id,
+    "status": models.PurchaseRequest.status,
+    "created_at": models.PurchaseRequest.created_at,
+    "item_count": select(func.count(models.PurchaseRequestItem.id))
+    .where(models.PurchaseRequestItem.request_id == models.PurchaseRequest.id)
+    .correlate(models.PurchaseRequest).scalar_subquery(),
+}
+
+PURCHASE_REQUEST_ITEM_FIELDS = {
+    "id": models.PurchaseRequestItem.id,
+    "material_name": models.PurchaseRequestItem.material_name,
+    "quantity": models.PurchaseRequestItem.quantity,
+    "unit": models.PurchaseRequestItem.unit,
+    "expiration_date": models.PurchaseRequestItem.expiration_date,
+}
+
+
+def get_purchase_requests(db: Session, fields: list[str] = None, include_items: bool = False,
+                          item_fields: list[str] = None):
+    """Список заявок (новые сверху) с проекцией полей; позиции — отдельной выборкой по include_items."""
+    stmt = select(models.PurchaseRequest.id.label("_id"), *project_fields(PURCHASE_REQUEST_FIELDS, fields)) \
+        .order_by(models.PurchaseRequest.created_at.desc())
+    requests = [dict(row) for row in db.execute(stmt).mappings()]
+    ids = [request.pop("_id") for request in requests]
+    if include_items:
+        items = load_children(db, models.PurchaseRequestItem.request_id, ids, PURCHASE_REQUEST_ITEM_FIELDS,
+                              item_fields, order_by=(models.PurchaseRequestItem.id,))
+        for request_id, request in zip(ids, requests):
+            request["items"] = items[request_id]
+    return requests
 
 
 def approve_purchase_request(db: Session, request_id: int, user_id: int):
-    db_request = db.get(models.PurchaseRequest, request_id)
+    """Подтверждает заявку одной транзакцией БД набором массовых операций.
+
+    Строка заявки блокируется FOR UPDATE, поэтому двойное подтверждение невозможно.
+    """
+    db_request = db.execute(
+        select(models.PurchaseRequest).where(models.PurchaseRequest.id == request_id).with_for_update()
+    ).scalar_one_or_none()
     if not db_request or db_request.status != "pending":
+        db.rollback()
         return None
 
     db_request.status = "approved"
     create_activity_log(db, user_id, "Подтверждение заявки", f"Подтверждена заявка #{db_request.id}")
 
-    for item in db_request.items:
-        material = db.execute(
-            select(models.Material).filter(models.Material.name == item.material_name)).scalar_one_or_none()
-        if not material:
-            material = models.Material(name=item.material_name, unit=item.unit)
-            db.add(material)
-            db.commit()
-            db.refresh(material)
-
-        batch = models.Batch(
-            material_id=material.id, initial_quantity=item.quantity,
-            current_quantity=item.quantity, expiration_date=item.expiration_date
-        )
-        db.add(batch)
-        db.flush()
-
-        transaction = models.Transaction(
-            material_id=material.id, delta=item.quantity,
-            note=f"Поступление по заявке #{db_request.id}", user_id=user_id,
-            batch_id=batch.id
-        )
-        db.add(transaction)
+    items = db_request.items
+    units = {}
+    for item in items:
+        units.setdefault(item.material_name, item.unit)
+
+    material_ids = dict(db.execute(
+        select(models.Material.name, models.Material.id).where(models.Material.name.in_(units))).all())
+    missing = [name for name in units if name not in material_ids]
+    if missing:
+        inserted = db.execute(
+            pg_insert(models.Material).values([{"name": name, "unit": units[name]} for name in missing])
+            .on_conflict_do_nothing(index_elements=[models.Material.name])
+            .returning(models.Material.name, models.Material.id)
+        ).all()
+        material_ids.update(dict(inserted))
+        if len(inserted) < len(missing):
+            # Часть материалов успела создать параллельная транзакция
+            material_ids.update(dict(db.execute(
+                select(models.Material.name, models.Material.id)
+                .where(models.Material.name.in_([name for name in missing if name not in material_ids]))).all()))
+
+    if items:
+        batch_ids = db.execute(
+            insert(models.Batch).returning(models.Batch.id, sort_by_parameter_order=True),
+            [{"material_id": material_ids[item.material_name], "initial_quantity": item.quantity,
+              "current_quantity": item.quantity, "expiration_date": item.expiration_date} for item in items]
+        ).scalars().all()
+
+        # Партия, поступившая уже с коротким сроком годности, сразу попадает в оповещения
+        threshold = alerts.expiry_threshold()
+        alerts.notify(db, [
+            alerts.expiring_batch_event(batch_id, material_ids[item.material_name], item.material_name,
+                                        item.quantity, item.expiration_date)
+            for item, batch_id in zip(items, batch_ids)
+            if item.expiration_date is not None and item.expiration_date <= threshold
+        ])
+
+        note = f"Поступление по заявке #{db_request.id}"
+        db.execute(insert(models.Transaction), [
+            {"material_id": material_ids[item.material_name], "delta": item.quantity, "note": note,
+             "user_id": user_id, "batch_id": batch_id} for item, batch_id in zip(items, batch_ids)
+        ])
+
+        material_deltas = {}
+        for item in items:
+            material_id = material_ids[item.material_name]
+            material_deltas[material_id] = material_deltas.get(material_id, 0) + item.quantity
+        apply_stock_deltas(db, material_deltas, alert=True)
 
     db.commit()
-    db.refresh(db_request)
-    return db_request
+    cache.invalidate_dashboard()
+    return get_purchase_request(db, db_request.id)
 
 
-def get_dashboard_stats(db: Session):
+def get_dashboard_stats(db: Session, expiring_days: int = 30, expiring_limit: int = 100):
     low_stock_query = text("""
-        SELECT m.id, m.name, m.unit, m.min_quantity, SUM(b.current_quantity) as total_quantity
-        FROM materials m JOIN batches b ON m.id = b.material_id
-        GROUP BY m.id
-        HAVING SUM(b.current_quantity) < m.min_quantity AND m.min_quantity > 0
+        SELECT m.id, m.name, m.unit, m.min_quantity, sb.quantity as total_quantity
+        FROM materials m JOIN stock_balances sb ON m.id = sb.material_id
+        WHERE sb.quantity < m.min_quantity AND m.min_quantity > 0
     """)
     low_stock_results = db.execute(low_stock_query).mappings().all()
 
-    expiring_soon_date = datetime.utcnow() + timedelta(days=30)
-    expiring_soon_batches_orm = db.query(models.Batch).join(models.Material).filter(
-        models.Batch.expiration_date != None).filter(models.Batch.expiration_date <= expiring_soon_date).filter(
-        models.Batch.current_quantity > 0).all()
+    expiring_soon_date = datetime.utcnow() + timedelta(days=expiring_days)
+    expiring_soon_rows = db.execute(
+        select(models.Batch.id, models.Material.name, models.Batch.current_quantity, models.Batch.expiration_date)
+        .join(models.Material, models.Batch.material_id == models.Material.id)
+        .where(models.Batch.expiration_date <= expiring_soon_date, models.Batch.current_quantity > 0)
+        .order_by(models.Batch.expiration_date, models.Batch.id)
+        .limit(expiring_limit)
+    ).all()
 
     expiring_soon_batches = [
-        {"id": b.id, "material": {"name": b.material.name}, "current_quantity": b.current_quantity,
-         "expiration_date": b.expiration_date} for b in expiring_soon_batches_orm
+        {"id": row.id, "material": {"name": row.name}, "current_quantity": row.current_quantity,
+         "expiration_date": row.expiration_date} for row in expiring_soon_rows
     ]
 
     distribution_query = text("""
-        SELECT m.name, SUM(b.current_quantity) as total_quantity
-        FROM materials m JOIN batches b ON m.id = b.material_id
-        WHERE b.current_quantity > 0
-        GROUP BY m.name ORDER BY total_quantity DESC LIMIT 10
+        SELECT m.name, sb.quantity as total_quantity
+        FROM materials m JOIN stock_balances sb ON m.id = sb.material_id
+        WHERE sb.quantity > 0
+        ORDER BY sb.quantity DESC LIMIT 10
     """)
     material_distribution_results = db.execute(distribution_query).mappings().all()
 
@@ -250,17 +817,176 @@ def get_dashboard_stats(db: Session):
     }
 
 
-def get_narcotic_logs(db: Session):
-    logs = db.query(
-        models.NarcoticLog.id, models.Transaction.created_at, models.Transaction.delta,
-        models.NarcoticLog.patient_info, models.NarcoticLog.reason, models.User, models.Material
-    ).join(models.Transaction, models.NarcoticLog.transaction_id == models.Transaction.id) \
-        .join(models.User, models.Transaction.user_id == models.User.id) \
-        .join(models.Material, models.Transaction.material_id == models.Material.id) \
-        .order_by(models.Transaction.created_at.desc()).all()
+def get_consumption_report(db: Session, material_id: int = None, date_from: date = None, date_to: date = None,
+                           window: int = 7):
+    """Динамика расхода по дневной свертке consumption_daily (сырой журнал проводок не читается).
+
+    Без material_id ряды суммируются по всем материалам, прогноз исчерпания не считается.
+    """
+    date_to = date_to or datetime.utcnow().date()
+    date_from = date_from or date_to - timedelta(days=90)
+    # Дни до начала периода нужны, чтобы скользящее среднее было полным с первой точки
+    seed_from = date_from - timedelta(days=window - 1)
+
+    rollup = models.ConsumptionDaily
+    stmt = select(rollup.day, func.sum(rollup.received), func.sum(rollup.written_off), func.sum(rollup.expired)) \
+        .where(rollup.day >= seed_from, rollup.day <= date_to).group_by(rollup.day)
+    if material_id is not None:
+        stmt = stmt.where(rollup.material_id == material_id)
+    by_day = {day: (received, written_off, expired) for day, received, written_off, expired in db.execute(stmt)}
+
+    series, recent = [], []
+    day = seed_from
+    while day <= date_to:
+        received, written_off, expired = by_day.get(day, (0.0, 0.0, 0.0))
+        recent.append(written_off)
+        if len(recent) > window:
+            recent.pop(0)
+        if day >= date_from:
+            series.append({"day": day, "received": received, "written_off": written_off, "expired": expired,
+                           "moving_average": sum(recent) / window})
+        day += timedelta(days=1)
+
+    average = sum(recent) / window
+    current_quantity = days_until_stockout = None
+    if material_id is not None:
+        current_quantity = get_stock_quantity(db, material_id)
+        if average > 0:
+            days_until_stockout = current_quantity / average
+
+    return {"material_id": material_id, "date_from": date_from, "date_to": date_to, "window": window,
+            "series": series, "average_daily_consumption": average, "current_quantity": current_quantity,
+            "days_until_stockout": days_until_stockout}
+
+
+STOCK_AS_OF_QUERY = """
+    SELECT m.id AS material_id, m.name, m.unit,
+           COALESCE(cp.quantity, 0) + COALESCE((
+               SELECT SUM(t.delta) FROM transactions t
+               WHERE t.material_id = m.id AND t.created_at >= COALESCE(cp.as_of, '-infinity') AND t.created_at < :at
+           ), 0) AS quantity
+    FROM materials m
+    LEFT JOIN LATERAL (
+        SELECT c.as_of, c.quantity FROM balance_checkpoints c
+        WHERE c.material_id = m.id AND c.as_of <= :at ORDER BY c.as_of DESC LIMIT 1
+    ) cp ON true
+"""
+
+
+def get_archive_boundary(db: Session, table_name: str):
+    """Момент, до которого записи таблицы выгружены в архив (None, если архива нет)."""
+    return db.execute(select(func.max(models.ArchivedPartition.range_to))
+                      .where(models.ArchivedPartition.table_name == table_name)).scalar()
+
+
+def get_stock_as_of(db: Session, at: datetime, material_id: int = None):
+    """Остатки на момент at: ближайшая контрольная точка + проводки после нее."""
+    query = STOCK_AS_OF_QUERY + (" WHERE m.id = :material_id" if material_id is not None else "") + " ORDER BY m.name"
+    return db.execute(text(query), {"at": at, "material_id": material_id}).mappings().all()
+
+
+def create_balance_checkpoints(db: Session, at: datetime):
+    """Сохраняет контрольные точки остатков всех материалов на момент at."""
+    result = db.execute(text(f"""
+        INSERT INTO balance_checkpoints (material_id, as_of, quantity)
+        SELECT material_id, :at, quantity FROM ({STOCK_AS_OF_QUERY}) balances
+        ON CONFLICT (material_id, as_of) DO NOTHING
+    """), {"at": at})
+    db.commit()
+    return result.rowcount
+
+
+def get_material_ledger(db: Session, material_id: int, limit: int = 100, date_from: datetime = None,
+                        after_created_at: datetime = None, after_id: int = None):
+    """Проводки материала по возрастанию времени с остатком после каждой.
+
+    Остаток на начало страницы берется из get_stock_as_of, дальше - оконная сумма по странице.
+    Без date_from журнал начинается с границы архива: более ранние проводки выгружены из БД.
+    """
+    transaction = models.Transaction
+    stmt = select(
+        transaction.id, transaction.created_at, transaction.delta, transaction.note, transaction.batch_id,
+        transaction.user_id,
+        func.sum(transaction.delta).over(order_by=(transaction.created_at, transaction.id)).label("running")
+    ).where(transaction.material_id == material_id).order_by(transaction.created_at, transaction.id)
+
+    opening = 0.0
+    if after_created_at is None and date_from is None:
+        date_from = get_archive_boundary(db, "transactions")
+    if after_created_at is not None and after_id is not None:
+        stmt = stmt.where(transaction.created_at >= after_created_at,
+                          tuple_(transaction.created_at, transaction.id) > tuple_(after_created_at, after_id))
+        opening = get_stock_as_of(db, after_created_at, material_id)[0]["quantity"] + (db.execute(
+            select(func.coalesce(func.sum(transaction.delta), 0)).where(
+                transaction.material_id == material_id, transaction.created_at == after_created_at,
+                transaction.id <= after_id)).scalar())
+    elif date_from is not None:
+        stmt = stmt.where(transaction.created_at >= date_from)
+        opening = get_stock_as_of(db, date_from, material_id)[0]["quantity"]
+
+    return [
+        {"id": row.id, "created_at": row.created_at, "delta": row.delta, "note": row.note,
+         "batch_id": row.batch_id, "user_id": row.user_id, "balance": opening + row.running}
+        for row in db.execute(stmt.limit(limit))
+    ]
+
+
+def inventory_snapshot_query():
+    """Снимок склада: материал с остатком и непустые партии (по строке на партию)."""
+    return select(
+        models.Material.id.label("material_id"), models.Material.name, models.Material.unit,
+        models.Material.min_quantity, models.Material.is_narcotic,
+        func.coalesce(models.StockBalance.quantity, 0).label("total_quantity"),
+        models.Batch.id.label("batch_id"), models.Batch.current_quantity.label("batch_quantity"),
+        models.Batch.expiration_date
+    ).outerjoin(models.StockBalance, models.StockBalance.material_id == models.Material.id) \
+        .outerjoin(models.Batch, and_(models.Batch.material_id == models.Material.id,
+                                      models.Batch.current_quantity > 0)) \
+        .order_by(models.Material.name, models.Material.id, models.Batch.expiration_date.asc().nulls_last(),
+                  models.Batch.id)
+
+
+def narcotic_logs_query(date_from: datetime = None, date_to: datetime = None, material_id: int = None,
+                        user_id: int = None):
+    """Плоская выборка журнала НС (без загрузки ORM-объектов), новые записи первыми.
+
+    Читает только narcotic_logs (без transactions), поэтому журнал доступен и после
+    архивирования старых секций проводок; фильтр по датам отсекает лишние секции.
+    """
+    log = models.NarcoticLog
+    stmt = select(
+        log.id, log.transaction_id, log.created_at, log.delta, log.patient_info, log.reason,
+        models.User.email.label("user_email"), models.User.full_name.label("user_full_name"),
+        models.Material.name.label("material_name"), models.Material.unit.label("material_unit")
+    ).join(models.User, log.user_id == models.User.id) \
+        .join(models.Material, log.material_id == models.Material.id) \
+        .order_by(log.created_at.desc(), log.transaction_id.desc())
+    if date_from is not None:
+        stmt = stmt.where(log.created_at >= date_from)
+    if date_to is not None:
+        stmt = stmt.where(log.created_at < date_to)
+    if material_id is not None:
+        stmt = stmt.where(log.material_id == material_id)
+    if user_id is not None:
+        stmt = stmt.where(log.user_id == user_id)
+    return stmt
+
+
+def get_narcotic_logs(db: Session, limit: int = 100, before_created_at: datetime = None,
+                      before_transaction_id: int = None, **filters):
+    """Страница журнала НС; следующая страница - before_* от последней записи."""
+    stmt = narcotic_logs_query(**filters)
+    if before_created_at is not None and before_transaction_id is not None:
+        # Отдельное условие на created_at нужно для отсечения секций: по сравнению кортежей
+        # планировщик их не отсекает
+        stmt = stmt.where(models.NarcoticLog.created_at <= before_created_at,
+                          tuple_(models.NarcoticLog.created_at, models.NarcoticLog.transaction_id)
+                          < tuple_(before_created_at, before_transaction_id))
 
     result = []
-    for log in logs:
-        result.append({"id": log[0], "created_at": log[1], "delta": log[2], "patient_info": log[3], "reason": log[4],
-                       "user": log[5], "material": log[6]})
-    return result
\ No newline at end of file
+    for log in db.execute(stmt.limit(limit)).mappings():
+        result.append({"id": log["id"], "transaction_id": log["transaction_id"], "created_at": log["created_at"],
+                       "delta": log["delta"], "patient_info": log["patient_info"], "reason": log["reason"],
+                       "user": {"email": log["user_email"], "full_name": log["user_full_name"]},
+                       "material": {"name": log["material_name"], "unit": log["material_unit"]}})
+    return result
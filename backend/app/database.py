@@ -1,38 +1,162 @@
 # backend/app/database.py
 
 import os
+import threading
 import time
-from sqlalchemy import create_engine, MetaData
+from contextvars import ContextVar
+from sqlalchemy import create_engine, event, MetaData
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 
 # Получаем URL базы данных из .env
 DATABASE_URL = os.getenv("DATABASE_URL", "postgresql+psycopg2://clinic:clinicpass@db:5432/clinic_db")
+# Асинхронный драйвер для API; синхронный engine остается для скриптов
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", DATABASE_URL.replace("+psycopg2", "+asyncpg"))
 
-# Инициализация engine с повторными попытками подключения
-engine = None
-for attempt in range(20):
-    try:
-        engine = create_engine(DATABASE_URL, future=True)
-        conn = engine.connect()
-        conn.close()
-        print(f"[INFO] Connected to database on attempt {attempt+1}")
-        break
-    except Exception as e:
-        print(f"[WARN] Database not ready (attempt {attempt+1}): {e}")
-        time.sleep(1)
-else:
-    raise Exception("Cannot connect to database after 20 attempts")
-
-# Создание сессии и метаданных
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
+# Настройки пула соединений (на каждый процесс-воркер)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+# Ограничение времени выполнения запроса, мс (0 - без ограничения)
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+# За PgBouncer в режиме transaction pooling: пул держит PgBouncer, подготовленные выражения отключены
+DB_PGBOUNCER = os.getenv("DB_PGBOUNCER", "false").lower() == "true"
+
+# Engine создаются при первом обращении, а не при импорте: форк воркера не открывает соединений
+_engine = None
+_async_engine = None
+_engine_lock = threading.Lock()
+
+
+# SQL-статистика текущего HTTP-запроса (заводится middleware в main.py): число запросов,
+# суммарное время и сводка по тексту выражения. Изменяемый dict виден и из run_sync,
+# и из threadpool: в копию контекста попадает ссылка, а не значение.
+_query_stats = ContextVar("query_stats", default=None)
+
+
+def start_query_stats():
+    stats = {"queries": 0, "duration": 0.0, "statements": {}}
+    _query_stats.set(stats)
+    return stats
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _query_stats.get() is not None:
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _query_stats.get()
+    if stats is None or not conn.info.get("query_started"):
+        return
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    stats["queries"] += 1
+    stats["duration"] += elapsed
+    # Одинаковый текст с разными параметрами - одна запись: так видно N+1
+    entry = stats["statements"].setdefault(statement, [0, 0.0])
+    entry[0] += 1
+    entry[1] += elapsed
+
+
+def _discard_query_start(context):
+    # Упавший запрос не доходит до after_cursor_execute; снимаем его отметку времени
+    if context.connection is not None and context.connection.info.get("query_started"):
+        context.connection.info["query_started"].pop()
+
+
+def _instrument(engine):
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _discard_query_start)
+
+
+def _pool_kwargs():
+    if DB_PGBOUNCER:
+        return {"poolclass": NullPool}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+def get_engine():
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            connect_args = {}
+            if DB_STATEMENT_TIMEOUT_MS:
+                connect_args["options"] = f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
+            _engine = create_engine(DATABASE_URL, future=True, connect_args=connect_args, **_pool_kwargs())
+            _instrument(_engine)
+        return _engine
+
+
+def get_async_engine():
+    global _async_engine
+    with _engine_lock:
+        if _async_engine is None:
+            connect_args = {}
+            if DB_STATEMENT_TIMEOUT_MS:
+                connect_args["server_settings"] = {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}
+            if DB_PGBOUNCER:
+                connect_args["statement_cache_size"] = 0
+                connect_args["prepared_statement_cache_size"] = 0
+            _async_engine = create_async_engine(ASYNC_DATABASE_URL, connect_args=connect_args, **_pool_kwargs())
+            _instrument(_async_engine.sync_engine)
+        return _async_engine
+
+
+def pool_stats():
+    """Состояние пулов соединений уже созданных engine."""
+    stats = {}
+    for name, engine in (("sync", _engine), ("async", _async_engine and _async_engine.sync_engine)):
+        if engine is None:
+            continue
+        pool = engine.pool
+        if DB_PGBOUNCER:
+            stats[name] = {"pool": "pgbouncer"}
+            continue
+        stats[name] = {
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "max_overflow": DB_MAX_OVERFLOW,
+        }
+    return stats
+
+
+# Создание сессии и метаданных (engine привязывается при открытии сессии)
+SessionLocal = sessionmaker(autoflush=False, autocommit=False, future=True)
 metadata = MetaData()
 Base = declarative_base()
 
+
+def open_session():
+    return SessionLocal(bind=get_engine())
+
+
 # Dependency
 def get_db():
-    db = SessionLocal()
+    db = open_session()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+# Асинхронный слой: сессии не истекают после commit, чтобы возвращаемые объекты
+# можно было сериализовать без повторной ленивой загрузки вне greenlet-контекста
+AsyncSessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False)
+
+
+async def get_async_db():
+    async with AsyncSessionLocal(bind=get_async_engine()) as db:
+        yield db
@@ -0,0 +1,152 @@
+"""Потоковый импорт материалов и начальных остатков из CSV/XLSX.
+
+Файл читается построчно, строки проверяются схемой MaterialCreate и загружаются пачками
+по IMPORT_CHUNK_SIZE (crud.import_materials_chunk), поэтому память не зависит от размера
+файла. Ошибочные строки пропускаются и попадают в отчет: ошибки схемы, несуществующий
+поставщик, смена единицы измерения существующего материала, а если пачку не удалось
+записать - все ее строки. Уже загруженные пачки при этом остаются.
+
+Колонки: name, unit, min_quantity, is_narcotic, supplier_id, initial_quantity, expiration_date.
+
+Запуск из консоли:
+    python -m app.importer materials.csv --user-id 1
+"""
+import argparse
+import codecs
+import csv
+import json
+import os
+import sys
+import zipfile
+
+from pydantic import ValidationError
+from sqlalchemy.exc import SQLAlchemyError
+
+from . import crud, schemas, cache
+from .database import open_session
+
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "1000"))
+# Сколько ошибок возвращать в отчете (остальные только считаются)
+IMPORT_MAX_REPORTED_ERRORS = int(os.getenv("IMPORT_MAX_REPORTED_ERRORS", "1000"))
+
+
+class ImportFormatError(Exception):
+    """Файл не удается прочитать как CSV/XLSX."""
+
+
+def detect_format(filename: str) -> str:
+    extension = os.path.splitext(filename or "")[1].lower()
+    if extension == ".xlsx":
+        return "xlsx"
+    if extension in (".csv", ".txt", ""):
+        return "csv"
+    raise ImportFormatError(f"Unsupported file type: {extension}")
+
+
+def _iter_csv(binary_file):
+    reader = csv.DictReader(codecs.getreader("utf-8-sig")(binary_file))
+    for line_number, row in enumerate(reader, start=2):
+        yield line_number, row
+
+
+def _iter_xlsx(binary_file):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ImportFormatError("XLSX import requires openpyxl")
+    sheet = load_workbook(binary_file, read_only=True, data_only=True).active
+    rows = sheet.iter_rows(values_only=True)
+    header = [str(cell).strip() if cell is not None else "" for cell in next(rows, ())]
+    for line_number, values in enumerate(rows, start=2):
+        yield line_number, dict(zip(header, values))
+
+
+def iter_rows(binary_file, format: str):
+    return _iter_xlsx(binary_file) if format == "xlsx" else _iter_csv(binary_file)
+
+
+def import_materials(binary_file, format: str, user_id: int):
+    report = {"rows": 0, "created": 0, "updated": 0, "batches": 0, "error_count": 0, "errors": []}
+
+    def add_error(line_number, message):
+        report["error_count"] += 1
+        if len(report["errors"]) < IMPORT_MAX_REPORTED_ERRORS:
+            report["errors"].append({"row": line_number, "error": message})
+
+    def load(chunk):
+        line_numbers, rows = zip(*chunk)
+        errors = crud.check_import_chunk(db, rows)
+        for i, message in errors.items():
+            add_error(line_numbers[i], message)
+        valid = [row for i, row in enumerate(rows) if i not in errors]
+        if not valid:
+            return
+        try:
+            created, updated, batches = crud.import_materials_chunk(db, valid, user_id)
+        except SQLAlchemyError as e:
+            db.rollback()
+            message = f"Chunk not loaded: {getattr(e, 'orig', None) or e}".strip()
+            for i, line_number in enumerate(line_numbers):
+                if i not in errors:
+                    add_error(line_number, message)
+            return
+        report["created"] += created
+        report["updated"] += updated
+        report["batches"] += batches
+
+    db = open_session()
+    try:
+        try:
+            chunk = []
+            for line_number, raw in iter_rows(binary_file, format):
+                report["rows"] += 1
+                # Пустые ячейки означают значение по умолчанию
+                data = {key.strip(): value for key, value in raw.items() if key and value not in (None, "")}
+                try:
+                    chunk.append((line_number, schemas.MaterialCreate.model_validate(data)))
+                except ValidationError as e:
+                    add_error(line_number, "; ".join(
+                        f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()))
+                    continue
+                if len(chunk) >= IMPORT_CHUNK_SIZE:
+                    load(chunk)
+                    chunk = []
+            if chunk:
+                load(chunk)
+        except (csv.Error, UnicodeDecodeError, zipfile.BadZipFile) as e:
+            db.rollback()
+            if not report["rows"]:
+                raise ImportFormatError(str(e))
+            # Файл испорчен посередине: загруженные пачки уже записаны, остаток файла - одна ошибка
+            add_error(report["rows"] + 2, f"File read error: {e}")
+        crud.create_activity_log(
+            db, user_id=user_id, action="Импорт материалов",
+            details=f"Строк: {report['rows']}, создано: {report['created']}, обновлено: {report['updated']}, "
+                    f"ошибок: {report['error_count']}")
+        db.commit()
+    finally:
+        db.close()
+        # min_quantity обновленных материалов тоже влияет на дашборд (нехватка)
+        if report["created"] or report["updated"] or report["batches"]:
+            cache.invalidate_dashboard()
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Импорт материалов из CSV/XLSX")
+    parser.add_argument("path")
+    parser.add_argument("--user-id", type=int, required=True, help="пользователь, от имени которого вносятся остатки")
+    args = parser.parse_args(argv)
+
+    try:
+        with open(args.path, "rb") as binary_file:
+            report = import_materials(binary_file, detect_format(args.path), args.user_id)
+    except ImportFormatError as e:
+        print(f"[ERROR] {e}")
+        return 1
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0 if not report["error_count"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,19 @@
-from fastapi import FastAPI, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import FastAPI, Depends, File, HTTPException, Query, Request, Response, UploadFile, status
+from starlette.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+import asyncio
+import time
 from typing import List
-from . import models, schemas, crud, auth, security
-from .database import engine, Base, get_db
+from datetime import date, datetime
+from . import models, schemas, crud, auth, security, cache, exports, audit, importer, metrics, alerts
+from .database import AsyncSessionLocal, get_async_db, get_async_engine, pool_stats, start_query_stats
+from .responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError
 from pydantic import ValidationError
 
-Base.metadata.create_all(bind=engine)
 app = FastAPI(title="Clinic Materials API")
 
 origins = ["http://localhost", "http://localhost:5173"]
@@ -22,10 +27,44 @@ app.add_middleware(
 
 app.include_router(auth.router, tags=["auth"])
 
+
+@app.middleware("http")
+async def instrument_request(request: Request, call_next):
+    """SQL-статистика и время обработки: заголовки Server-Timing / X-DB-Queries, метрики, журнал медленных."""
+    stats = start_query_stats()
+    started = time.perf_counter()
+    response = await call_next(request)
+    duration = time.perf_counter() - started
+    response.headers["Server-Timing"] = metrics.server_timing(duration, stats)
+    response.headers["X-DB-Queries"] = str(stats["queries"])
+    # Метка - шаблон маршрута, а не путь: /materials/{material_id}, а не /materials/42
+    route = request.scope.get("route")
+    metrics.observe_request(request.method, route.path if route else "unmatched", response.status_code,
+                            duration, stats)
+    return response
+
+
+@app.on_event("startup")
+def start_audit_writer():
+    # Переносит и записи, оставшиеся в outbox после аварийной остановки
+    if audit.AUDIT_MODE != "sync":
+        audit.writer.start()
+
+
+@app.on_event("shutdown")
+def flush_audit_log():
+    audit.writer.stop()
+
+
+@app.on_event("shutdown")
+async def stop_alert_listener():
+    await alerts.broadcaster.stop()
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def authenticate(token: str, db: AsyncSession, token_type: str | None = None):
+    """Пользователь по JWT; token_type - тип токена (None - access, "stream" - билет потока)."""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -34,19 +73,29 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     try:
         payload = security.jwt.decode(token, security.SECRET_KEY, algorithms=[security.ALGORITHM])
         email: str = payload.get("sub")
-        if email is None:
+        if email is None or payload.get("type") != token_type:
             raise credentials_exception
         token_data = schemas.TokenData(email=email)
     except (JWTError, ValidationError):
         raise credentials_exception
-    user = crud.get_user_by_email(db, email=token_data.email)
-    if user is None:
+    principal = cache.principals.get(token_data.email)
+    if principal is None:
+        user = await db.run_sync(crud.get_user_by_email, email=token_data.email)
+        if user is None:
+            raise credentials_exception
+        principal = schemas.Principal.model_validate(user)
+        cache.principals.set(token_data.email, principal)
+    if not principal.is_active:
         raise credentials_exception
-    return user
+    return principal
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
+    return await authenticate(token, db)
 
 
 def require_roles(allowed_roles: List[models.UserRole]):
-    def role_checker(current_user: models.User = Depends(get_current_user)):
+    async def role_checker(current_user: schemas.Principal = Depends(get_current_user)):
         if current_user.role not in allowed_roles:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
@@ -57,135 +106,362 @@ def require_roles(allowed_roles: List[models.UserRole]):
     return role_checker
 
 
+def parse_fieldset(fields: str | None, include: str | None, field_map: dict, relations: dict[str, dict]):
+    """Разбирает ?fields=a,b,rel.c и ?include=rel.
+
+    Возвращает (поля верхнего уровня или None = все, {связь: её поля или None}).
+    Поле вида rel.c само подключает связь rel.
+    """
+    def split(value):
+        return [name.strip() for name in (value or "").split(",") if name.strip()]
+
+    included = {}
+    for name in split(include):
+        if name not in relations:
+            raise HTTPException(status_code=400, detail=f"Unknown include: {name}")
+        included.setdefault(name, None)
+    selected = []
+    for name in split(fields):
+        relation, _, sub_field = name.partition(".")
+        if sub_field and relation in relations and sub_field in relations[relation]:
+            included[relation] = (included.get(relation) or []) + [sub_field]
+        elif not sub_field and name in field_map:
+            selected.append(name)
+        else:
+            raise HTTPException(status_code=400, detail=f"Unknown field: {name}")
+    return selected or None, included
+
+
 @app.get("/users/me/", response_model=schemas.User)
 async def read_users_me(current_user: schemas.User = Depends(get_current_user)):
     return current_user
 
 
+def activity_filters(
+        action: str | None = None, date_from: datetime | None = None, date_to: datetime | None = None,
+        limit: int = Query(100, ge=1, le=1000),
+        before_created_at: datetime | None = None, before_id: int | None = None
+):
+    return {"action": action, "date_from": date_from, "date_to": date_to, "limit": limit,
+            "before_created_at": before_created_at, "before_id": before_id}
+
+
 @app.get("/users/me/activity", response_model=list[schemas.ActivityLog])
-def read_user_activity(db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
-    return db.query(models.ActivityLog).filter(models.ActivityLog.user_id == current_user.id).order_by(
-        models.ActivityLog.created_at.desc()).all()
+async def read_user_activity(
+        filters: dict = Depends(activity_filters),
+        db: AsyncSession = Depends(get_async_db), current_user: schemas.User = Depends(get_current_user)
+):
+    return await db.run_sync(crud.get_activity_logs, user_id=current_user.id, **filters)
+
+
+@app.get("/activity", response_model=list[schemas.ActivityLog])
+async def read_activity_feed(
+        user_id: int | None = None, filters: dict = Depends(activity_filters),
+        db: AsyncSession = Depends(get_async_db),
+        current_user: schemas.User = Depends(require_roles([models.UserRole.admin, models.UserRole.head_nurse]))
+):
+    return await db.run_sync(crud.get_activity_logs, user_id=user_id, **filters)
 
 
 @app.get("/users/", response_model=list[schemas.User])
-def list_users(
-        db: Session = Depends(get_db),
+async def list_users(
+        db: AsyncSession = Depends(get_async_db),
         current_user: schemas.User = Depends(require_roles([models.UserRole.admin, models.UserRole.head_nurse]))
 ):
-    return crud.get_users(db)
+    return await db.run_sync(crud.get_users)
 
 
 @app.get("/users/{user_id}", response_model=schemas.User)
-def read_user(
+async def read_user(
         user_id: int,
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_async_db),
         current_user: schemas.User = Depends(require_roles([models.UserRole.admin, models.UserRole.head_nurse]))
 ):
-    db_user = crud.get_user(db, user_id=user_id)
+    db_user = await db.run_sync(crud.get_user, user_id=user_id)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return db_user
 
 
 @app.get("/users/{user_id}/activity", response_model=list[schemas.ActivityLog])
-def read_specific_user_activity(
-        user_id: int,
-        db: Session = Depends(get_db),
+async def read_specific_user_activity(
+        user_id: int, filters: dict = Depends(activity_filters),
+        db: AsyncSession = Depends(get_async_db),
         current_user: schemas.User = Depends(require_roles([models.UserRole.admin, models.UserRole.head_nurse]))
 ):
-    return db.query(models.ActivityLog).filter(models.ActivityLog.user_id == user_id).order_by(
-        models.ActivityLog.created_at.desc()).all()
+    return await db.run_sync(crud.get_activity_logs, user_id=user_id, **filters)
 
 
 @app.post("/requests/", response_model=schemas.PurchaseRequest)
-def create_request(
-        request: schemas.PurchaseRequestCreate, db: Session = Depends(get_db),
+async def create_request(
+        request: schemas.PurchaseRequestCreate, db: AsyncSession = Depends(get_async_db),
         current_user: schemas.User = Depends(require_roles([models.UserRole.admin, models.UserRole.head_nurse]))
 ):
-    return crud.create_purchase_request(db=db, request=request, user_id=current_user.id)
+    return await db.run_sync(crud.create_purchase_request, request=request, user_id=current_user.id)
 
 
-@app.get("/requests/", response_model=list[schemas.PurchaseRequest])
-def list_requests(db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
-    return crud.get_purchase_requests(db)
+@app.get("/requests/", response_model=None, response_class=ORJSONResponse, responses={200: {
+    "model": list[schemas.PurchaseRequestSparse],
+    "description": "Заявки; при ?fields= только перечисленные поля, items - только при ?include=items"}})
+async def list_requests(
+        fields: str | None = None, include: str | None = None,
+        db: AsyncSession = Depends(get_async_db), current_user: schemas.User = Depends(get_current_user)
+):
+    selected, included = parse_fieldset(fields, include, crud.PURCHASE_REQUEST_FIELDS,
+                                        {"items": crud.PURCHASE_REQUEST_ITEM_FIELDS})
+    requests = await db.run_sync(crud.get_purchase_requests, fields=selected, include_items="items" in included,
+                                 item_fields=included.get("items"))
+    return ORJSONResponse(requests)
 
 
 @app.post("/requests/{request_id}/approve", response_model=schemas.PurchaseRequest)
-def approve_request(
-        request_id: int, db: Session = Depends(get_db),
+async def approve_request(
+        request_id: int, db: AsyncSession = Depends(get_async_db),
         current_user: schemas.User = Depends(require_roles([models.UserRole.admin]))
 ):
-    approved_request = crud.approve_purchase_request(db, request_id=request_id, user_id=current_user.id)
+    approved_request = await db.run_sync(
+        crud.approve_purchase_request, request_id=request_id, user_id=current_user.id)
     if not approved_request:
         raise HTTPException(status_code=404, detail="Request not found or already processed")
     return approved_request
 
 
 @app.get("/narcotic-logs/", response_model=list[schemas.NarcoticLogEntry])
-def list_narcotic_logs(
-        db: Session = Depends(get_db),
+async def list_narcotic_logs(
+        date_from: datetime | None = None, date_to: datetime | None = None,
+        material_id: int | None = None, user_id: int | None = None,
+        limit: int = Query(100, ge=1, le=1000),
+        before_created_at: datetime | None = None, before_transaction_id: int | None = None,
+        db: AsyncSession = Depends(get_async_db),
         current_user: schemas.User = Depends(require_roles([models.UserRole.admin, models.UserRole.head_nurse]))
 ):
-    return crud.get_narcotic_logs(db)
+    return await db.run_sync(
+        crud.get_narcotic_logs, limit=limit, before_created_at=before_created_at,
+        before_transaction_id=before_transaction_id, date_from=date_from, date_to=date_to,
+        material_id=material_id, user_id=user_id)
+
+
+@app.get("/narcotic-logs/export")
+async def export_narcotic_logs(
+        format: str = Query("csv", pattern="^(csv|ndjson)$"),
+        date_from: datetime | None = None, date_to: datetime | None = None,
+        material_id: int | None = None, user_id: int | None = None,
+        current_user: schemas.User = Depends(require_roles([models.UserRole.admin, models.UserRole.head_nurse]))
+):
+    stmt = crud.narcotic_logs_query(date_from=date_from, date_to=date_to, material_id=material_id, user_id=user_id)
+    return exports.streaming_response(stmt, format, "narcotic_journal")
+
+
+@app.get("/exports/inventory")
+async def export_inventory(
+        format: str = Query("csv", pattern="^(csv|ndjson|parquet)$"),
+        current_user: schemas.User = Depends(get_current_user)
+):
+    try:
+        return exports.streaming_response(crud.inventory_snapshot_query(), format, "inventory",
+                                          parquet_columns=exports.INVENTORY_PARQUET_COLUMNS)
+    except exports.ExportFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 @app.get("/dashboard/stats")
-def get_dashboard_stats(db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
-    return crud.get_dashboard_stats(db)
+async def get_dashboard_stats(
+        request: Request, expiring_days: int = Query(30, ge=1, le=365), expiring_limit: int = Query(100, ge=1, le=1000),
+        current_user: schemas.User = Depends(get_current_user)
+):
+    async def compute():
+        # Своя сессия: общее вычисление при промахе может пережить запрос, который его начал
+        async with AsyncSessionLocal(bind=get_async_engine()) as db:
+            return await db.run_sync(crud.get_dashboard_stats, expiring_days=expiring_days,
+                                     expiring_limit=expiring_limit)
+
+    entry = await cache.get_dashboard_stats(compute, params=(expiring_days, expiring_limit))
+    headers = {"ETag": entry["etag"], "Cache-Control": "private, no-cache"}
+    if request.headers.get("if-none-match") == entry["etag"]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return JSONResponse(entry["stats"], headers=headers)
+
+
+# Интервал комментариев-пингов в потоке оповещений: не дают прокси закрыть простаивающее соединение
+ALERT_HEARTBEAT_SECONDS = 15
+# Поток закрывается по истечении срока access-токена: клиент переподключается с новым билетом,
+# поэтому отключенный пользователь не продолжает получать события
+ALERT_STREAM_MAX_SECONDS = security.ACCESS_TOKEN_EXPIRE_MINUTES * 60
+
+
+@app.post("/alerts/ticket", response_model=schemas.StreamTicket)
+async def create_alert_ticket(current_user: schemas.User = Depends(get_current_user)):
+    """Короткоживущий билет для /alerts/stream: EventSource не умеет передавать заголовки."""
+    return {"ticket": security.create_stream_ticket({"sub": current_user.email}),
+            "expires_in": security.STREAM_TICKET_EXPIRE_SECONDS}
+
+
+@app.get("/alerts/stream")
+async def stream_alerts(ticket: str = Query(...), db: AsyncSession = Depends(get_async_db)):
+    """Server-sent events: оповещения о нехватке и истекающих партиях (см. alerts).
+
+    Вход - по билету из POST /alerts/ticket; access-токен в URL не передается.
+    """
+    await authenticate(ticket, db, token_type="stream")
+    # Поток может жить часами: соединение с БД ему не нужно
+    await db.close()
+
+    async def events():
+        queue = alerts.broadcaster.subscribe()
+        deadline = time.monotonic() + ALERT_STREAM_MAX_SECONDS
+        try:
+            yield "retry: 5000\n\n"
+            while time.monotonic() < deadline:
+                try:
+                    payload = await asyncio.wait_for(queue.get(), timeout=ALERT_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                yield f"event: alert\ndata: {payload}\n\n"
+        finally:
+            alerts.broadcaster.unsubscribe(queue)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.get("/reports/consumption", response_model=schemas.ConsumptionReport)
+async def get_consumption_report(
+        material_id: int | None = None, date_from: date | None = None, date_to: date | None = None,
+        window: int = Query(7, ge=1, le=90),
+        db: AsyncSession = Depends(get_async_db), current_user: schemas.User = Depends(get_current_user)
+):
+    if date_from and date_to and date_from > date_to:
+        raise HTTPException(status_code=400, detail="date_from must not be after date_to")
+    return await db.run_sync(crud.get_consumption_report, material_id=material_id, date_from=date_from,
+                             date_to=date_to, window=window)
 
 
 @app.post("/materials/", response_model=schemas.Material)
-def create_material(
-        material: schemas.MaterialCreate, db: Session = Depends(get_db),
+async def create_material(
+        material: schemas.MaterialCreate, db: AsyncSession = Depends(get_async_db),
         current_user: schemas.User = Depends(get_current_user)
 ):
-    return crud.create_material(db=db, material=material, user_id=current_user.id)
+    return await db.run_sync(crud.create_material, material=material, user_id=current_user.id)
 
 
-@app.get("/materials/", response_model=list[schemas.Material])
-def list_materials(
-        skip: int = 0, limit: int = 100, q: str | None = None, db: Session = Depends(get_db),
+@app.get("/materials/", response_model=None, response_class=ORJSONResponse, responses={200: {
+    "model": list[schemas.MaterialSparse],
+    "description": "Материалы; при ?fields= только перечисленные поля, batches - только при ?include=batches"}})
+async def list_materials(
+        limit: int = Query(100, ge=1, le=500), q: str | None = None,
+        after_name: str | None = None, after_id: int | None = None,
+        fields: str | None = None, include: str | None = None,
+        db: AsyncSession = Depends(get_async_db), current_user: schemas.User = Depends(get_current_user)
+):
+    selected, included = parse_fieldset(fields, include, crud.MATERIAL_FIELDS, {"batches": crud.BATCH_FIELDS})
+    materials = await db.run_sync(crud.get_materials, limit=limit, q=q, after_name=after_name, after_id=after_id,
+                                  fields=selected, include_batches="batches" in included,
+                                  batch_fields=included.get("batches"))
+    return ORJSONResponse(materials)
+
+
+@app.get("/materials/suggest", response_model=list[schemas.MaterialSuggestion])
+async def suggest_materials(
+        q: str = Query(..., min_length=1), limit: int = Query(10, ge=1, le=50),
+        db: AsyncSession = Depends(get_async_db), current_user: schemas.User = Depends(get_current_user)
+):
+    return await db.run_sync(crud.suggest_materials, q=q, limit=limit)
+
+
+@app.post("/materials/import", response_model=schemas.MaterialImportReport)
+async def import_materials(
+        file: UploadFile = File(...),
+        current_user: schemas.User = Depends(require_roles([models.UserRole.admin, models.UserRole.head_nurse]))
+):
+    try:
+        file_format = importer.detect_format(file.filename)
+        # Импорт идет синхронной сессией в пуле потоков, чтобы чтение файла не блокировало event loop
+        return await run_in_threadpool(importer.import_materials, file.file, file_format, current_user.id)
+    except importer.ImportFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/materials/stock-as-of", response_model=list[schemas.StockAsOf])
+async def read_stock_as_of(
+        at: datetime, material_id: int | None = None, db: AsyncSession = Depends(get_async_db),
         current_user: schemas.User = Depends(get_current_user)
 ):
-    return crud.get_materials(db, skip=skip, limit=limit, q=q)
+    return await db.run_sync(crud.get_stock_as_of, at=at, material_id=material_id)
+
+
+@app.get("/materials/{material_id}/ledger", response_model=list[schemas.LedgerEntry])
+async def read_material_ledger(
+        material_id: int, limit: int = Query(100, ge=1, le=1000), date_from: datetime | None = None,
+        after_created_at: datetime | None = None, after_id: int | None = None,
+        db: AsyncSession = Depends(get_async_db), current_user: schemas.User = Depends(get_current_user)
+):
+    if await db.get(models.Material, material_id) is None:
+        raise HTTPException(status_code=404, detail="Material not found")
+    return await db.run_sync(crud.get_material_ledger, material_id=material_id, limit=limit, date_from=date_from,
+                             after_created_at=after_created_at, after_id=after_id)
 
 
 @app.put("/materials/{material_id}", response_model=schemas.Material)
-def update_material(
-        material_id: int, material: schemas.MaterialCreate, db: Session = Depends(get_db),
+async def update_material(
+        material_id: int, material: schemas.MaterialCreate, db: AsyncSession = Depends(get_async_db),
         current_user: schemas.User = Depends(get_current_user)
 ):
-    updated_material = crud.update_material(db, material_id=material_id, material=material, user_id=current_user.id)
+    updated_material = await db.run_sync(
+        crud.update_material, material_id=material_id, material=material, user_id=current_user.id)
     if updated_material is None:
         raise HTTPException(status_code=404, detail="Material not found")
     return updated_material
 
 
 @app.delete("/materials/{material_id}")
-def delete_material(
-        material_id: int, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_user)
+async def delete_material(
+        material_id: int, db: AsyncSession = Depends(get_async_db), current_user: schemas.User = Depends(get_current_user)
 ):
-    deleted_material = crud.delete_material(db, material_id=material_id, user_id=current_user.id)
+    deleted_material = await db.run_sync(crud.delete_material, material_id=material_id, user_id=current_user.id)
     if deleted_material is None:
         raise HTTPException(status_code=404, detail="Material not found")
     return {"detail": "Material deleted successfully"}
 
 
-@app.post("/transactions/", response_model=schemas.Transaction)
-def create_transaction(
-        transaction_data: schemas.TransactionCreate, db: Session = Depends(get_db),
+@app.post("/transactions/", response_model=list[schemas.Transaction])
+async def create_transaction(
+        transaction_data: schemas.TransactionCreate, db: AsyncSession = Depends(get_async_db),
         current_user: schemas.User = Depends(get_current_user)
 ):
-    material = db.get(models.Material, transaction_data.material_id)
+    material = await db.get(models.Material, transaction_data.material_id)
     if not material:
         raise HTTPException(status_code=404, detail="Material not found")
 
     if material.is_narcotic and transaction_data.delta < 0 and not transaction_data.narcotic_log:
         raise HTTPException(status_code=400, detail="Narcotic log is required for this transaction")
+    # Поступление всегда идет в конкретную партию; FEFO подбирает партии только для списаний
+    if transaction_data.batch_id is None and transaction_data.delta >= 0:
+        raise HTTPException(status_code=400, detail="Batch is required for this transaction")
+
+    transactions = await db.run_sync(crud.create_transaction, trans_data=transaction_data, user_id=current_user.id)
+    if not transactions:
+        detail = "Insufficient quantity in batch" if transaction_data.batch_id else "Insufficient quantity in stock"
+        raise HTTPException(status_code=400, detail=detail)
+
+    return transactions
+
+
+@app.post("/transactions/bulk", response_model=list[schemas.TransactionBulkLineResult])
+async def create_transactions_bulk(
+        bulk_data: schemas.TransactionBulkCreate, db: AsyncSession = Depends(get_async_db),
+        current_user: schemas.User = Depends(get_current_user)
+):
+    return await db.run_sync(crud.create_transactions_bulk, lines=bulk_data.items, user_id=current_user.id)
+
+
+@app.get("/system/db-pool")
+async def read_db_pool_stats(current_user: schemas.User = Depends(require_roles([models.UserRole.admin]))):
+    return pool_stats()
 
-    transaction = crud.create_transaction(db, trans_data=transaction_data, user_id=current_user.id)
-    if not transaction:
-        raise HTTPException(status_code=400, detail="Insufficient quantity in batch")
 
-    return transaction
\ No newline at end of file
+@app.get("/metrics", include_in_schema=False)
+async def read_metrics(request: Request):
+    if metrics.METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {metrics.METRICS_TOKEN}":
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid metrics token")
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
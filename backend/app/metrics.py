@@ -0,0 +1,146 @@
+"""Метрики в текстовом формате Prometheus (GET /metrics) и журнал медленных запросов.
+
+Метрики считаются в памяти процесса: при нескольких воркерах каждый отдает свои,
+Prometheus суммирует их по меткам instance/pod.
+
+Медленным считается запрос дольше SLOW_REQUEST_MS или с числом SQL-запросов больше
+SLOW_REQUEST_QUERIES; в журнал (логгер app.slow) попадают самые дорогие выражения.
+"""
+import logging
+import os
+import threading
+
+from .database import pool_stats
+
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "1000"))
+SLOW_REQUEST_QUERIES = int(os.getenv("SLOW_REQUEST_QUERIES", "30"))
+SLOW_LOG_STATEMENTS = int(os.getenv("SLOW_LOG_STATEMENTS", "5"))
+# Если задан, /metrics требует заголовок Authorization: Bearer <METRICS_TOKEN>
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+logger = logging.getLogger("app.slow")
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value: float):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["buckets"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        names = (*self.labels, "le")
+        with self._lock:
+            for labels, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series["buckets"]):
+                    lines.append(f"{self.name}_bucket{_format_labels(names, (*labels, bound))} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(names, (*labels, '+Inf'))} {series['count']}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labels, labels)} {series['sum']}")
+                lines.append(f"{self.name}_count{_format_labels(self.labels, labels)} {series['count']}")
+        return lines
+
+
+REQUEST_LABELS = ("method", "route", "status")
+
+request_duration = Histogram(
+    "http_request_duration_seconds", "Время обработки HTTP-запроса", REQUEST_LABELS)
+request_db_duration = Histogram(
+    "http_request_db_duration_seconds", "Суммарное время SQL-запросов на HTTP-запрос", REQUEST_LABELS)
+request_db_queries = Histogram(
+    "http_request_db_queries", "Число SQL-запросов на HTTP-запрос", REQUEST_LABELS, buckets=QUERY_COUNT_BUCKETS)
+slow_requests = Counter(
+    "http_slow_requests_total", "Запросы, превысившие порог времени или числа SQL-запросов", ("method", "route"))
+cache_requests = Counter(
+    "cache_requests_total", "Обращения к кэшам приложения", ("cache", "result"))
+
+
+def observe_request(method: str, route: str, status: int, duration: float, query_stats: dict):
+    """Учитывает обработанный HTTP-запрос; медленные пишет в журнал с самыми дорогими выражениями."""
+    labels = (method, route, str(status))
+    request_duration.observe(labels, duration)
+    request_db_duration.observe(labels, query_stats["duration"])
+    request_db_queries.observe(labels, query_stats["queries"])
+
+    if duration * 1000 < SLOW_REQUEST_MS and query_stats["queries"] <= SLOW_REQUEST_QUERIES:
+        return
+    slow_requests.inc((method, route))
+    top = sorted(query_stats["statements"].items(), key=lambda item: item[1][1], reverse=True)[:SLOW_LOG_STATEMENTS]
+    logger.warning(
+        "Медленный запрос %s %s: %.1f мс, SQL-запросов %d (%.1f мс)%s",
+        method, route, duration * 1000, query_stats["queries"], query_stats["duration"] * 1000,
+        "".join(f"\n  x{count} {elapsed * 1000:.1f} мс: {' '.join(statement.split())[:500]}"
+                for statement, (count, elapsed) in top),
+    )
+
+
+def server_timing(duration: float, query_stats: dict) -> str:
+    """Значение заголовка Server-Timing: время БД и общее время обработки, мс."""
+    return (f'db;dur={query_stats["duration"] * 1000:.1f};desc="{query_stats["queries"]} queries", '
+            f"app;dur={duration * 1000:.1f}")
+
+
+def _pool_lines():
+    lines = [
+        "# HELP db_pool_connections Соединения пула по состоянию",
+        "# TYPE db_pool_connections gauge",
+    ]
+    for engine, stats in pool_stats().items():
+        for state in ("size", "checked_in", "checked_out", "overflow"):
+            if state in stats:
+                lines.append(f'db_pool_connections{{engine="{engine}",state="{state}"}} {stats[state]}')
+    return lines
+
+
+def render() -> str:
+    lines = []
+    for metric in (request_duration, request_db_duration, request_db_queries, slow_requests, cache_requests):
+        lines.extend(metric.render())
+    lines.extend(_pool_lines())
+    return "\n".join(lines) + "\n"
@@ -1,8 +1,8 @@
-from sqlalchemy import (Column, Integer, String, Float, ForeignKey, DateTime,
-                        Boolean, Enum as SQLAlchemyEnum)
+from sqlalchemy import (Column, Integer, BigInteger, String, Float, ForeignKey, DateTime, Date,
+                        Boolean, Index, Enum as SQLAlchemyEnum)
 from sqlalchemy.orm import relationship
 from .database import Base
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, text
 import enum
 
 class UnitEnum(enum.Enum):
@@ -26,15 +26,32 @@ class User(Base):
     is_active = Column(Boolean, default=True)
     role = Column(SQLAlchemyEnum(UserRole), default=UserRole.staff)
 
+# activity_logs, transactions и narcotic_logs секционированы по месяцам created_at
+# (миграция 0009): первичный ключ в БД - (id, created_at), старые секции архивирует app.partitions
 class ActivityLog(Base):
     __tablename__ = "activity_logs"
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     action = Column(String, nullable=False)
     details = Column(String, nullable=True)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     user = relationship("User")
 
+    # Лента пользователя и общая лента с пагинацией по ключу (created_at, id)
+    __table_args__ = (
+        Index("ix_activity_logs_user_created_at", "user_id", "created_at", "id"),
+        Index("ix_activity_logs_created_at_id", "created_at", "id"),
+    )
+
+class AuditOutbox(Base):
+    """Записи журнала активности до переноса в activity_logs фоновым писателем (см. audit)."""
+    __tablename__ = "audit_outbox"
+    id = Column(BigInteger, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    action = Column(String, nullable=False)
+    details = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
 class Supplier(Base):
     __tablename__ = "suppliers"
     id = Column(Integer, primary_key=True, index=True)
@@ -45,6 +62,7 @@ class Supplier(Base):
 class Material(Base):
     __tablename__ = "materials"
     id = Column(Integer, primary_key=True, index=True)
+    # Для поиска есть GIN-индекс ix_materials_name_trgm по clinic_translit(name) (миграция 0003)
     name = Column(String, nullable=False, unique=True, index=True)
     unit = Column(SQLAlchemyEnum(UnitEnum, name="unitenum"), nullable=False)
     min_quantity = Column(Float, default=0.0)
@@ -64,6 +82,36 @@ class Batch(Base):
     expiration_date = Column(DateTime, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+    # Покрывает и выборку партий материала, и порядок FEFO при автосписании
+    __table_args__ = (
+        Index("ix_batches_material_expiration", "material_id", "expiration_date"),
+        # Истекающие партии ищутся только среди непустых: исчерпанные архивные партии в индекс не попадают
+        Index("ix_batches_expiring", "expiration_date", postgresql_where=text("current_quantity > 0")),
+    )
+
+class StockBalance(Base):
+    """Денормализованный остаток по материалу, обновляется вместе с каждой проводкой."""
+    __tablename__ = "stock_balances"
+    material_id = Column(Integer, ForeignKey("materials.id", ondelete="CASCADE"), primary_key=True)
+    quantity = Column(Float, nullable=False, default=0.0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class ConsumptionDaily(Base):
+    """Дневная свертка проводок по материалу; ведется триггером на transactions (миграция 0006)."""
+    __tablename__ = "consumption_daily"
+    material_id = Column(Integer, ForeignKey("materials.id", ondelete="CASCADE"), primary_key=True)
+    day = Column(Date, primary_key=True, index=True)
+    received = Column(Float, nullable=False, default=0.0)
+    written_off = Column(Float, nullable=False, default=0.0)
+    expired = Column(Float, nullable=False, default=0.0)
+
+class BalanceCheckpoint(Base):
+    """Остаток материала по всем проводкам с created_at < as_of; избавляет от прохода по всему журналу."""
+    __tablename__ = "balance_checkpoints"
+    material_id = Column(Integer, ForeignKey("materials.id", ondelete="CASCADE"), primary_key=True)
+    as_of = Column(DateTime(timezone=True), primary_key=True)
+    quantity = Column(Float, nullable=False)
+
 class Transaction(Base):
     __tablename__ = "transactions"
     id = Column(Integer, primary_key=True, index=True)
@@ -72,15 +120,49 @@ class Transaction(Base):
     delta = Column(Float, nullable=False)
     note = Column(String, nullable=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     batch_id = Column(Integer, ForeignKey("batches.id"), nullable=True)
 
+    # Пагинация журналов по ключу (created_at, id), в т.ч. в пределах одного материала
+    __table_args__ = (
+        Index("ix_transactions_created_at_id", "created_at", "id"),
+        Index("ix_transactions_material_created_at", "material_id", "created_at", "id"),
+    )
+
 class NarcoticLog(Base):
     __tablename__ = "narcotic_logs"
     id = Column(Integer, primary_key=True, index=True)
-    transaction_id = Column(Integer, ForeignKey("transactions.id"), nullable=False)
+    # Без внешнего ключа: секции проводок архивируются раньше, чем журнал НС
+    transaction_id = Column(Integer, nullable=False, index=True)
     patient_info = Column(String, nullable=False)
     reason = Column(String, nullable=False)
+    # Копия полей проводки: журнал читается без transactions. created_at по умолчанию now() -
+    # время начала транзакции БД, то же, что у проводки, созданной в ней
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    material_id = Column(Integer, ForeignKey("materials.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    delta = Column(Float, nullable=False)
+
+    __table_args__ = (
+        Index("ix_narcotic_logs_created_at_transaction_id", "created_at", "transaction_id"),
+        Index("ix_narcotic_logs_material_created_at", "material_id", "created_at", "transaction_id"),
+    )
+
+class ArchivedPartition(Base):
+    """Секция, выгруженная в архивный файл и удаленная из БД."""
+    __tablename__ = "archived_partitions"
+    id = Column(Integer, primary_key=True)
+    table_name = Column(String, nullable=False)
+    partition_name = Column(String, nullable=False)
+    range_from = Column(DateTime(timezone=True), nullable=False)
+    range_to = Column(DateTime(timezone=True), nullable=False)
+    row_count = Column(BigInteger, nullable=False)
+    file_path = Column(String, nullable=False)
+    archived_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+    __table_args__ = (
+        Index("ix_archived_partitions_table_range", "table_name", "range_to"),
+    )
 
 class PurchaseRequest(Base):
     __tablename__ = "purchase_requests"
@@ -93,7 +175,7 @@ class PurchaseRequest(Base):
 class PurchaseRequestItem(Base):
     __tablename__ = "purchase_request_items"
     id = Column(Integer, primary_key=True, index=True)
-    request_id = Column(Integer, ForeignKey("purchase_requests.id"), nullable=False)
+    request_id = Column(Integer, ForeignKey("purchase_requests.id"), nullable=False, index=True)
     material_name = Column(String, nullable=False)
     quantity = Column(Float, nullable=False)
     unit = Column(SQLAlchemyEnum(UnitEnum, name="unitenum"), nullable=False)
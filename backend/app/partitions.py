@@ -0,0 +1,194 @@
+"""Помесячные секции transactions, narcotic_logs и activity_logs (миграция 0009) и их архивирование.
+
+Секции создаются на PARTITION_MONTHS_AHEAD месяцев вперед; строки, попавшие в секцию по
+умолчанию (*_default), переносятся в секцию своего месяца. Секции старше срока хранения
+выгружаются в ARCHIVE_DIR (CSV, gzip), записываются в archived_partitions и удаляются из БД.
+
+Журнал НС не зависит от проводок и хранится по своему сроку NARCOTIC_RETENTION_MONTHS
+(0 - бессрочно), поэтому остается доступным после архивирования проводок. Перед удалением
+каждой секции проводок сохраняются контрольные точки остатков на ее верхней границе: остатки на дату,
+журнал материала и сверка после этой границы остаются точными.
+
+Запуск (например, из cron раз в сутки):
+    python -m app.partitions                      # создать секции вперед
+    python -m app.partitions --archive --dry-run  # показать, что будет архивировано
+    python -m app.partitions --archive
+"""
+import argparse
+import gzip
+import os
+import re
+import sys
+from datetime import date, datetime, timezone
+
+from sqlalchemy import insert, text
+from sqlalchemy.orm import Session
+
+from .database import open_session
+from . import crud, models
+
+PARTITIONED_TABLES = ("transactions", "narcotic_logs", "activity_logs")
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+ARCHIVE_RETENTION_MONTHS = int(os.getenv("ARCHIVE_RETENTION_MONTHS", "24"))
+NARCOTIC_RETENTION_MONTHS = int(os.getenv("NARCOTIC_RETENTION_MONTHS", "0"))
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+# Отсоединение секции ненадолго блокирует всю таблицу; дольше этого не ждем очереди за блокировкой
+ARCHIVE_LOCK_TIMEOUT = os.getenv("ARCHIVE_LOCK_TIMEOUT", "5s")
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def current_month() -> date:
+    return datetime.now(timezone.utc).date().replace(day=1)
+
+
+def ensure_partitions(db: Session, months_ahead: int = PARTITION_MONTHS_AHEAD):
+    """Создает секции до months_ahead месяцев вперед и разбирает секции по умолчанию.
+
+    Возвращает число созданных секций.
+    """
+    month, last = current_month(), add_months(current_month(), months_ahead)
+    created = 0
+    for table in PARTITIONED_TABLES:
+        stray = db.execute(text(
+            f"SELECT DISTINCT date_trunc('month', created_at AT TIME ZONE 'UTC')::date FROM {table}_default"
+        )).scalars().all()
+        for stray_month in sorted(stray):
+            created += db.execute(text("SELECT create_monthly_partitions(:table, :month, :month)"),
+                                  {"table": table, "month": stray_month}).scalar()
+        created += db.execute(text("SELECT create_monthly_partitions(:table, :from_month, :to_month)"),
+                              {"table": table, "from_month": month, "to_month": last}).scalar()
+    db.commit()
+    return created
+
+
+def list_partitions(db: Session, table: str):
+    """Помесячные секции таблицы по возрастанию: (имя, начало, конец диапазона)."""
+    pattern = re.compile(rf"^{table}_y(\d{{4}})m(\d{{2}})$")
+    names = db.execute(text("""
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = CAST(:table AS regclass)
+    """), {"table": table}).scalars().all()
+    partitions = []
+    for name in names:
+        match = pattern.match(name)
+        if match:
+            month = date(int(match.group(1)), int(match.group(2)), 1)
+            partitions.append((name, month, add_months(month, 1)))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def archive_candidates(db: Session, retention_months: int, narcotic_retention_months: int):
+    """Секции, целиком лежащие раньше начала месяца (текущий минус срок хранения)."""
+    candidates = []
+    for table in PARTITIONED_TABLES:
+        months = narcotic_retention_months if table == "narcotic_logs" else retention_months
+        if months <= 0:
+            continue
+        cutoff = add_months(current_month(), -months)
+        candidates.extend((table, *partition) for partition in list_partitions(db, table)
+                          if partition[2] <= cutoff)
+    return candidates
+
+
+def _utc(month: date) -> datetime:
+    return datetime(month.year, month.month, 1, tzinfo=timezone.utc)
+
+
+def archive_partition(db: Session, table: str, name: str, range_from: date, range_to: date,
+                      archive_dir: str = ARCHIVE_DIR):
+    """Выгружает секцию в gzip-CSV, отсоединяет и удаляет ее одной транзакцией.
+
+    Файл пишется во временный и переименовывается только после полной выгрузки;
+    при ошибке транзакция откатывается, а недописанный файл удаляется.
+    """
+    directory = os.path.join(archive_dir, table)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{name}-{datetime.now(timezone.utc):%Y%m%dT%H%M%S}.csv.gz")
+    partial = path + ".part"
+    try:
+        cursor = db.connection().connection.cursor()
+        with open(partial, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb") as archive:
+            cursor.copy_expert(f"COPY {name} TO STDOUT WITH (FORMAT csv, HEADER)", archive)
+            rows = cursor.rowcount
+        with open(partial, "rb") as raw:
+            os.fsync(raw.fileno())
+        os.replace(partial, path)
+
+        db.execute(text(f"SET LOCAL lock_timeout = '{ARCHIVE_LOCK_TIMEOUT}'"))
+        db.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+        db.execute(text(f"DROP TABLE {name}"))
+        db.execute(insert(models.ArchivedPartition).values(
+            table_name=table, partition_name=name, range_from=_utc(range_from), range_to=_utc(range_to),
+            row_count=rows, file_path=os.path.abspath(path)))
+        db.commit()
+    except BaseException:
+        db.rollback()
+        for leftover in (partial, path):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        raise
+    return path, rows
+
+
+def archive_partitions(db: Session, retention_months: int = ARCHIVE_RETENTION_MONTHS,
+                       narcotic_retention_months: int = NARCOTIC_RETENTION_MONTHS, archive_dir: str = ARCHIVE_DIR):
+    """Архивирует все секции старше срока хранения; возвращает [(таблица, секция, файл, строк)]."""
+    archived = []
+    for table, name, range_from, range_to in archive_candidates(db, retention_months, narcotic_retention_months):
+        if table == "transactions":
+            # Пока проводки секции еще в БД: остатки на ее верхней границе заменят их в get_stock_as_of
+            # и в сверке. Точка пишется перед каждой секцией, поэтому и при сбое на середине
+            # у границы архива всегда есть своя контрольная точка
+            crud.create_balance_checkpoints(db, _utc(range_to))
+        path, rows = archive_partition(db, table, name, range_from, range_to, archive_dir)
+        archived.append((table, name, path, rows))
+    return archived
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Обслуживание помесячных секций журналов и их архивирование")
+    parser.add_argument("--months-ahead", type=int, default=PARTITION_MONTHS_AHEAD,
+                        help="на сколько месяцев вперед создавать секции")
+    parser.add_argument("--archive", action="store_true", help="архивировать секции старше срока хранения")
+    parser.add_argument("--retention-months", type=int, default=ARCHIVE_RETENTION_MONTHS,
+                        help="срок хранения проводок и журнала активности в БД, мес.")
+    parser.add_argument("--narcotic-retention-months", type=int, default=NARCOTIC_RETENTION_MONTHS,
+                        help="срок хранения журнала НС в БД, мес. (0 - бессрочно)")
+    parser.add_argument("--archive-dir", default=ARCHIVE_DIR, help="каталог архивных файлов")
+    parser.add_argument("--dry-run", action="store_true", help="только показать секции для архивирования")
+    args = parser.parse_args(argv)
+
+    db = open_session()
+    try:
+        created = ensure_partitions(db, args.months_ahead)
+        print(f"[INFO] Создано секций: {created}")
+        if not args.archive:
+            return 0
+
+        if args.dry_run:
+            candidates = archive_candidates(db, args.retention_months, args.narcotic_retention_months)
+            for table, name, range_from, range_to in candidates:
+                print(f"[INFO] К архивированию: {name} ({range_from} - {range_to})")
+            print(f"[INFO] Секций к архивированию: {len(candidates)}")
+            return 0
+
+        try:
+            archived = archive_partitions(db, args.retention_months, args.narcotic_retention_months,
+                                          args.archive_dir)
+        except Exception as e:
+            print(f"[ERROR] Архивирование прервано: {e}")
+            return 1
+        for table, name, path, rows in archived:
+            print(f"[INFO] {name}: {rows} строк -> {path}")
+        print(f"[INFO] Архивировано секций: {len(archived)}")
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,40 @@
+"""Сверка таблицы остатков stock_balances с журналом проводок.
+
+Запуск:
+    python -m app.reconcile          # только отчет о расхождениях
+    python -m app.reconcile --apply  # перестроить остатки по журналу
+"""
+import argparse
+import sys
+
+from .database import open_session
+from . import crud
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Сверка остатков с журналом проводок")
+    parser.add_argument("--apply", action="store_true", help="перезаписать остатки значениями из журнала")
+    args = parser.parse_args(argv)
+
+    db = open_session()
+    try:
+        drift = crud.reconcile_stock_balances(db, apply=args.apply)
+    except ValueError as e:
+        print(f"[ERROR] {e}")
+        return 2
+    finally:
+        db.close()
+
+    if not drift:
+        print("[INFO] Остатки совпадают с журналом проводок")
+        return 0
+
+    for row in drift:
+        print(f"[WARN] #{row['id']} {row['name']}: остаток {row['balance']}, "
+              f"по журналу {row['ledger']}, расхождение {row['drift']:+}")
+    print(f"[INFO] Расхождений: {len(drift)}" + (" (исправлено)" if args.apply else ""))
+    return 0 if args.apply else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
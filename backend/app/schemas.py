@@ -1,6 +1,6 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 from typing import Optional
-from datetime import datetime
+from datetime import date, datetime
 from .models import UserRole, UnitEnum
 
 
@@ -24,9 +24,22 @@ class User(UserBase):
         from_attributes = True
 
 
+class Principal(BaseModel):
+    """Аутентифицированный пользователь, отвязанный от сессии БД (хранится в кэше)."""
+    id: int
+    email: str
+    full_name: Optional[str] = None
+    is_active: bool = True
+    role: UserRole
+
+    class Config:
+        from_attributes = True
+
+
 # Activity Log Schemas
 class ActivityLog(BaseModel):
     id: int
+    user_id: int
     action: str
     details: Optional[str] = None
     created_at: datetime
@@ -39,6 +52,16 @@ class ActivityLog(BaseModel):
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+
+
+class TokenRefresh(BaseModel):
+    refresh_token: str
+
+
+class StreamTicket(BaseModel):
+    ticket: str
+    expires_in: int
 
 
 class TokenData(BaseModel):
@@ -104,6 +127,27 @@ class Material(MaterialBase):
         from_attributes = True
 
 
+class MaterialImportError(BaseModel):
+    row: int
+    error: str
+
+
+class MaterialImportReport(BaseModel):
+    rows: int
+    created: int
+    updated: int
+    batches: int
+    error_count: int
+    errors: list[MaterialImportError] = []
+
+
+class MaterialSuggestion(BaseModel):
+    id: int
+    name: str
+    unit: UnitEnum
+    total_quantity: float = 0.0
+
+
 # Narcotic Log Schemas
 class NarcoticLogBase(BaseModel):
     patient_info: str
@@ -136,6 +180,38 @@ class Transaction(TransactionBase):
         from_attributes = True
 
 
+# Пакет обрабатывается одной транзакцией с блокировкой всех затронутых партий
+TRANSACTION_BULK_MAX_ITEMS = 500
+
+
+class TransactionBulkCreate(BaseModel):
+    items: list[TransactionCreate] = Field(max_length=TRANSACTION_BULK_MAX_ITEMS)
+
+
+class TransactionBulkLineResult(BaseModel):
+    index: int
+    ok: bool
+    transaction_ids: list[int] = []
+    error: Optional[str] = None
+
+
+class LedgerEntry(BaseModel):
+    id: int
+    created_at: datetime
+    delta: float
+    note: Optional[str] = None
+    batch_id: Optional[int] = None
+    user_id: int
+    balance: float
+
+
+class StockAsOf(BaseModel):
+    material_id: int
+    name: str
+    unit: UnitEnum
+    quantity: float
+
+
 # Purchase Request Item Schemas
 class PurchaseRequestItemBase(BaseModel):
     material_name: str
@@ -169,12 +245,51 @@ class PurchaseRequest(PurchaseRequestBase):
     requester_id: int
     status: str
     created_at: datetime
+    item_count: Optional[int] = None
     items: list[PurchaseRequestItem] = []
 
     class Config:
         from_attributes = True
 
 
+# Разреженные ответы списков (?fields=/?include=): в ответе только запрошенные поля,
+# поэтому все поля необязательны, а связи есть лишь при include
+class BatchSparse(BaseModel):
+    id: Optional[int] = None
+    initial_quantity: Optional[float] = None
+    current_quantity: Optional[float] = None
+    expiration_date: Optional[datetime] = None
+    created_at: Optional[datetime] = None
+
+
+class MaterialSparse(BaseModel):
+    id: Optional[int] = None
+    name: Optional[str] = None
+    unit: Optional[UnitEnum] = None
+    min_quantity: Optional[float] = None
+    is_narcotic: Optional[bool] = None
+    supplier_id: Optional[int] = None
+    total_quantity: Optional[float] = None
+    batches: Optional[list[BatchSparse]] = None
+
+
+class PurchaseRequestItemSparse(BaseModel):
+    id: Optional[int] = None
+    material_name: Optional[str] = None
+    quantity: Optional[float] = None
+    unit: Optional[UnitEnum] = None
+    expiration_date: Optional[datetime] = None
+
+
+class PurchaseRequestSparse(BaseModel):
+    id: Optional[int] = None
+    requester_id: Optional[int] = None
+    status: Optional[str] = None
+    created_at: Optional[datetime] = None
+    item_count: Optional[int] = None
+    items: Optional[list[PurchaseRequestItemSparse]] = None
+
+
 # Narcotic Journal Schemas
 class UserInfo(BaseModel):
     email: str
@@ -194,6 +309,7 @@ class MaterialInfo(BaseModel):
 
 class NarcoticLogEntry(BaseModel):
     id: int
+    transaction_id: int
     created_at: datetime
     delta: float
     patient_info: str
@@ -202,4 +318,24 @@ class NarcoticLogEntry(BaseModel):
     material: MaterialInfo
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+
+# Consumption Report Schemas
+class ConsumptionPoint(BaseModel):
+    day: date
+    received: float
+    written_off: float
+    expired: float
+    moving_average: float
+
+
+class ConsumptionReport(BaseModel):
+    material_id: Optional[int] = None
+    date_from: date
+    date_to: date
+    window: int
+    series: list[ConsumptionPoint]
+    average_daily_consumption: float
+    current_quantity: Optional[float] = None
+    days_until_stockout: Optional[float] = None
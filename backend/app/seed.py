@@ -0,0 +1,256 @@
+"""Генератор синтетических данных клиники для нагрузочного тестирования (см. app.bench).
+
+Данные согласованы между собой: остаток партии равен поступлению минус списания,
+stock_balances совпадает с журналом проводок, у каждого списания наркотического
+материала есть запись журнала. При одинаковом --seed набор данных повторяется.
+
+Запуск (только на локальной/стендовой базе!):
+    python -m app.seed --reset
+    python -m app.seed --reset --materials 5000 --transactions 1000000 --days 730
+
+Все пользователи получают пароль --password; администратор - admin@bench.example.com.
+"""
+import argparse
+import random
+import sys
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import insert, select, func, text
+
+from .database import open_session
+from . import models, partitions, security
+
+# Таблицы с данными (порядок не важен: TRUNCATE ... CASCADE)
+DATA_TABLES = (
+    "narcotic_logs", "transactions", "batches", "stock_balances", "consumption_daily", "balance_checkpoints",
+    "purchase_request_items", "purchase_requests", "activity_logs", "materials", "suppliers", "users",
+    "archived_partitions", "audit_outbox",
+)
+
+MATERIAL_KINDS = (
+    ("Шприц", models.UnitEnum.piece, ("2 мл", "5 мл", "10 мл", "20 мл")),
+    ("Игла инъекционная", models.UnitEnum.piece, ("21G", "23G", "25G")),
+    ("Перчатки нитриловые", models.UnitEnum.pack, ("S", "M", "L", "XL")),
+    ("Бинт стерильный", models.UnitEnum.piece, ("5x10", "7x14", "10x16")),
+    ("Маска медицинская", models.UnitEnum.pack, ("трехслойная", "FFP2")),
+    ("Натрия хлорид", models.UnitEnum.milliliter, ("0,9% 200 мл", "0,9% 400 мл")),
+    ("Глюкоза", models.UnitEnum.milliliter, ("5% 250 мл", "10% 400 мл")),
+    ("Парацетамол", models.UnitEnum.piece, ("500 мг", "табл. 200 мг")),
+    ("Хлоргексидин", models.UnitEnum.milliliter, ("0,05% 100 мл", "1 л")),
+    ("Вата хирургическая", models.UnitEnum.gram, ("50 г", "100 г")),
+    ("Лидокаин", models.UnitEnum.ampoule, ("2% 2 мл", "10% 2 мл")),
+    ("Катетер внутривенный", models.UnitEnum.piece, ("18G", "20G", "22G")),
+)
+NARCOTIC_KINDS = (
+    ("Морфин", ("1% 1 мл",)),
+    ("Фентанил", ("0,005% 2 мл",)),
+    ("Промедол", ("2% 1 мл",)),
+    ("Трамадол", ("5% 2 мл",)),
+)
+REASONS = ("Послеоперационное обезболивание", "Болевой синдром", "Премедикация", "Паллиативная помощь")
+
+
+def chunked(rows, size):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def insert_returning_ids(db, model, rows, chunk_size):
+    """Многострочный INSERT ... RETURNING id; id возвращаются в порядке rows."""
+    ids = []
+    for chunk in chunked(rows, chunk_size):
+        ids.extend(db.execute(
+            insert(model).returning(model.id, sort_by_parameter_order=True), chunk
+        ).scalars().all())
+    return ids
+
+
+def insert_rows(db, model, rows, chunk_size):
+    for chunk in chunked(rows, chunk_size):
+        db.execute(insert(model), chunk)
+
+
+def random_moment(rng, start, end):
+    return start + (end - start) * rng.random()
+
+
+def seed_users(db, rng, count, password):
+    hashed_password = security.get_password_hash(password)
+    rows = [{"email": "admin@bench.example.com", "full_name": "Администратор стенда",
+             "hashed_password": hashed_password, "is_active": True, "role": models.UserRole.admin}]
+    for n in range(1, count):
+        role = models.UserRole.head_nurse if rng.random() < 0.1 else models.UserRole.staff
+        rows.append({"email": f"user{n}@bench.example.com", "full_name": f"Сотрудник {n}",
+                     "hashed_password": hashed_password, "is_active": True, "role": role})
+    return insert_returning_ids(db, models.User, rows, 1000)
+
+
+def seed_materials(db, rng, count, narcotic_share, supplier_ids):
+    rows = []
+    for n in range(count):
+        if rng.random() < narcotic_share:
+            base, variants = rng.choice(NARCOTIC_KINDS)
+            unit, is_narcotic = models.UnitEnum.ampoule, True
+        else:
+            base, unit, variants = rng.choice(MATERIAL_KINDS)
+            is_narcotic = False
+        rows.append({
+            "name": f"{base} {rng.choice(variants)} №{n + 1}", "unit": unit, "is_narcotic": is_narcotic,
+            "min_quantity": float(rng.choice((0, 10, 20, 50, 100))),
+            "supplier_id": rng.choice(supplier_ids) if supplier_ids and rng.random() < 0.8 else None,
+        })
+    ids = insert_returning_ids(db, models.Material, rows, 1000)
+    return [(material_id, row["is_narcotic"]) for material_id, row in zip(ids, rows)]
+
+
+def seed_stock(db, rng, materials, user_ids, batches_per_material, write_offs_per_batch, start, now, chunk_size):
+    """Партии, проводки (поступление + списания), журнал наркотиков и активность по порции материалов.
+
+    Возвращает (партий, проводок, записей журнала наркотиков, остатки {material_id: quantity}).
+    """
+    batch_rows, batch_plans = [], []
+    for material_id, is_narcotic in materials:
+        for _ in range(max(1, round(rng.gauss(batches_per_material, batches_per_material / 3)))):
+            created_at = random_moment(rng, start, now)
+            # Часть партий к текущему моменту уже просрочена
+            expiration = (created_at + timedelta(days=rng.randint(60, 720))).replace(tzinfo=None)
+            moments = sorted(random_moment(rng, created_at, now)
+                             for _ in range(rng.randint(0, 2 * write_offs_per_batch)))
+            # Партии хватает примерно на все запланированные списания, часть остается на складе
+            initial = float(rng.randint(10, 500) + 2 * len(moments))
+            remaining, write_offs = initial, []
+            for moment in moments:
+                if remaining < 1:
+                    break
+                amount = min(remaining, float(max(1, round(initial * rng.uniform(0.2, 1.6) / (len(moments) + 1)))))
+                remaining -= amount
+                write_offs.append((moment, amount))
+            batch_rows.append({"material_id": material_id, "initial_quantity": initial, "current_quantity": remaining,
+                               "expiration_date": expiration, "created_at": created_at})
+            batch_plans.append((material_id, is_narcotic, created_at, initial, write_offs))
+    batch_ids = insert_returning_ids(db, models.Batch, batch_rows, chunk_size)
+
+    transaction_rows, narcotic_flags, activity_rows, balances = [], [], [], {}
+    for batch_id, (material_id, is_narcotic, created_at, initial, write_offs) in zip(batch_ids, batch_plans):
+        user_id = rng.choice(user_ids)
+        transaction_rows.append({"material_id": material_id, "delta": initial, "note": "Поступление партии",
+                                 "user_id": user_id, "created_at": created_at, "batch_id": batch_id})
+        narcotic_flags.append(False)
+        activity_rows.append({"user_id": user_id, "action": "Поступление материала", "created_at": created_at,
+                              "details": f"{initial} материала #{material_id}"})
+        balances[material_id] = balances.get(material_id, 0.0) + initial
+        for moment, amount in write_offs:
+            user_id = rng.choice(user_ids)
+            transaction_rows.append({"material_id": material_id, "delta": -amount, "note": None,
+                                     "user_id": user_id, "created_at": moment, "batch_id": batch_id})
+            narcotic_flags.append(is_narcotic)
+            activity_rows.append({"user_id": user_id, "action": "Списание материала", "created_at": moment,
+                                  "details": f"{amount} материала #{material_id}"})
+            balances[material_id] -= amount
+
+    transaction_ids = insert_returning_ids(db, models.Transaction, transaction_rows, chunk_size)
+    narcotic_rows = [
+        {"transaction_id": transaction_id, "created_at": row["created_at"], "material_id": row["material_id"],
+         "user_id": row["user_id"], "delta": row["delta"],
+         "patient_info": f"Пациент {rng.randint(1, 99999):05d}", "reason": rng.choice(REASONS)}
+        for transaction_id, row, is_narcotic in zip(transaction_ids, transaction_rows, narcotic_flags)
+        if is_narcotic
+    ]
+    insert_rows(db, models.NarcoticLog, narcotic_rows, chunk_size)
+    insert_rows(db, models.ActivityLog, activity_rows, chunk_size)
+    return len(batch_ids), len(transaction_ids), len(narcotic_rows), balances
+
+
+def seed_requests(db, rng, count, user_ids, materials_count, start, now, chunk_size):
+    request_rows = []
+    for _ in range(count):
+        created_at = random_moment(rng, start, now)
+        # Старые заявки уже подтверждены, последние две недели - в ожидании
+        status = "pending" if now - created_at < timedelta(days=14) else "approved"
+        request_rows.append({"requester_id": rng.choice(user_ids), "status": status, "created_at": created_at})
+    request_ids = insert_returning_ids(db, models.PurchaseRequest, request_rows, chunk_size)
+
+    item_rows = []
+    for request_id in request_ids:
+        for _ in range(rng.randint(1, 5)):
+            base, unit, variants = rng.choice(MATERIAL_KINDS)
+            item_rows.append({
+                "request_id": request_id, "unit": unit, "quantity": float(rng.randint(10, 300)),
+                "material_name": f"{base} {rng.choice(variants)} №{rng.randint(1, max(1, materials_count))}",
+                "expiration_date": (now + timedelta(days=rng.randint(90, 720))).replace(tzinfo=None),
+            })
+    insert_rows(db, models.PurchaseRequestItem, item_rows, chunk_size)
+    return len(request_ids)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Генерация синтетических данных для нагрузочных тестов")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--suppliers", type=int, default=20)
+    parser.add_argument("--materials", type=int, default=2000)
+    parser.add_argument("--batches", type=float, default=3, help="среднее число партий на материал")
+    parser.add_argument("--transactions", type=int, default=100000, help="примерное общее число проводок")
+    parser.add_argument("--narcotic-share", type=float, default=0.05, help="доля наркотических материалов")
+    parser.add_argument("--requests", type=int, default=500, help="число заявок на закупку")
+    parser.add_argument("--days", type=int, default=365, help="глубина истории в днях")
+    parser.add_argument("--password", default="bench", help="пароль всех пользователей")
+    parser.add_argument("--seed", type=int, default=42, help="зерно генератора (воспроизводимость)")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="строк в одном INSERT")
+    parser.add_argument("--reset", action="store_true", help="очистить таблицы перед генерацией")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    now = datetime.now(timezone.utc)
+    start = now - timedelta(days=args.days)
+    total_batches = max(1, round(args.materials * args.batches))
+    # Поступление партии - тоже проводка, остальное делится на списания
+    write_offs_per_batch = max(0, round((args.transactions - total_batches) / total_batches))
+
+    db = open_session()
+    try:
+        if args.reset:
+            db.execute(text(f"TRUNCATE {', '.join(DATA_TABLES)} RESTART IDENTITY CASCADE"))
+        elif db.scalar(select(func.count()).select_from(models.Material)):
+            print("[ERROR] База уже содержит материалы; используйте --reset на стендовой базе")
+            return 1
+
+        user_ids = seed_users(db, rng, max(1, args.users), args.password)
+        supplier_ids = insert_returning_ids(db, models.Supplier, [
+            {"name": f"Поставщик {n + 1}", "contact": f"+7 900 {n:03d}-00-00"} for n in range(args.suppliers)
+        ], 1000)
+        materials = seed_materials(db, rng, args.materials, args.narcotic_share, supplier_ids)
+        db.commit()
+        print(f"[INFO] Пользователей: {len(user_ids)}, поставщиков: {len(supplier_ids)}, материалов: {len(materials)}")
+
+        totals = [0, 0, 0]
+        for portion in chunked(materials, 200):
+            batches, transactions, narcotic, balances = seed_stock(
+                db, rng, portion, user_ids, args.batches, write_offs_per_batch, start, now, args.chunk_size)
+            insert_rows(db, models.StockBalance, [
+                {"material_id": material_id, "quantity": balances.get(material_id, 0.0)}
+                for material_id, _ in portion
+            ], args.chunk_size)
+            db.commit()
+            totals = [totals[0] + batches, totals[1] + transactions, totals[2] + narcotic]
+            print(f"[INFO] Партий: {totals[0]}, проводок: {totals[1]}, записей журнала наркотиков: {totals[2]}",
+                  end="\r", flush=True)
+        print()
+
+        requests = seed_requests(db, rng, args.requests, user_ids, args.materials, start, now, args.chunk_size)
+        db.commit()
+        print(f"[INFO] Заявок: {requests}")
+
+        # История старше существующих секций попала в секции по умолчанию - разносим по месяцам
+        print(f"[INFO] Создано секций: {partitions.ensure_partitions(db)}")
+
+        # Свежая статистика планировщика, иначе первые прогоны бенчмарка идут по чужим планам
+        db.execute(text("ANALYZE"))
+        db.commit()
+    finally:
+        db.close()
+    print("[INFO] Готово")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
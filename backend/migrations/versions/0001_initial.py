@@ -0,0 +1,130 @@
+"""initial schema
+
+Схема, которую раньше создавал Base.metadata.create_all. Для базы, созданной
+таким образом, выполнить `alembic stamp 0001` и затем `alembic upgrade head`.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+unitenum = postgresql.ENUM("piece", "milliliter", "gram", "pack", "ampoule", name="unitenum", create_type=False)
+userrole = postgresql.ENUM("staff", "admin", "head_nurse", name="userrole", create_type=False)
+
+
+def upgrade():
+    bind = op.get_bind()
+    unitenum.create(bind, checkfirst=True)
+    userrole.create(bind, checkfirst=True)
+
+    op.create_table(
+        "users",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("full_name", sa.String()),
+        sa.Column("email", sa.String(), nullable=False),
+        sa.Column("hashed_password", sa.String(), nullable=False),
+        sa.Column("is_active", sa.Boolean()),
+        sa.Column("role", userrole),
+    )
+    op.create_index("ix_users_id", "users", ["id"])
+    op.create_index("ix_users_full_name", "users", ["full_name"])
+    op.create_index("ix_users_email", "users", ["email"], unique=True)
+
+    op.create_table(
+        "activity_logs",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("action", sa.String(), nullable=False),
+        sa.Column("details", sa.String()),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.text("now()")),
+    )
+    op.create_index("ix_activity_logs_id", "activity_logs", ["id"])
+
+    op.create_table(
+        "suppliers",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("name", sa.String(), nullable=False, unique=True),
+        sa.Column("contact", sa.String()),
+    )
+    op.create_index("ix_suppliers_id", "suppliers", ["id"])
+
+    op.create_table(
+        "materials",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column("unit", unitenum, nullable=False),
+        sa.Column("min_quantity", sa.Float()),
+        sa.Column("is_narcotic", sa.Boolean()),
+        sa.Column("supplier_id", sa.Integer(), sa.ForeignKey("suppliers.id")),
+    )
+    op.create_index("ix_materials_id", "materials", ["id"])
+    op.create_index("ix_materials_name", "materials", ["name"], unique=True)
+
+    op.create_table(
+        "batches",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("material_id", sa.Integer(), sa.ForeignKey("materials.id"), nullable=False),
+        sa.Column("initial_quantity", sa.Float(), nullable=False),
+        sa.Column("current_quantity", sa.Float(), nullable=False),
+        sa.Column("expiration_date", sa.DateTime()),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.text("now()")),
+    )
+    op.create_index("ix_batches_id", "batches", ["id"])
+
+    op.create_table(
+        "transactions",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("material_id", sa.Integer(), sa.ForeignKey("materials.id"), nullable=False),
+        sa.Column("delta", sa.Float(), nullable=False),
+        sa.Column("note", sa.String()),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.text("now()")),
+        sa.Column("batch_id", sa.Integer(), sa.ForeignKey("batches.id")),
+    )
+    op.create_index("ix_transactions_id", "transactions", ["id"])
+
+    op.create_table(
+        "narcotic_logs",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("transaction_id", sa.Integer(), sa.ForeignKey("transactions.id"), nullable=False),
+        sa.Column("patient_info", sa.String(), nullable=False),
+        sa.Column("reason", sa.String(), nullable=False),
+    )
+    op.create_index("ix_narcotic_logs_id", "narcotic_logs", ["id"])
+
+    op.create_table(
+        "purchase_requests",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("requester_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("status", sa.String()),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.text("now()")),
+    )
+    op.create_index("ix_purchase_requests_id", "purchase_requests", ["id"])
+
+    op.create_table(
+        "purchase_request_items",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("request_id", sa.Integer(), sa.ForeignKey("purchase_requests.id"), nullable=False),
+        sa.Column("material_name", sa.String(), nullable=False),
+        sa.Column("quantity", sa.Float(), nullable=False),
+        sa.Column("unit", unitenum, nullable=False),
+        sa.Column("expiration_date", sa.DateTime()),
+    )
+    op.create_index("ix_purchase_request_items_id", "purchase_request_items", ["id"])
+
+
+def downgrade():
+    for table in ("purchase_request_items", "purchase_requests", "narcotic_logs", "transactions", "batches",
+                  "materials", "suppliers", "activity_logs", "users"):
+        op.drop_table(table)
+    bind = op.get_bind()
+    userrole.drop(bind, checkfirst=True)
+    unitenum.drop(bind, checkfirst=True)
@@ -0,0 +1,38 @@
+"""stock balances and batch indexes
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "stock_balances",
+        sa.Column("material_id", sa.Integer(), sa.ForeignKey("materials.id", ondelete="CASCADE"), primary_key=True),
+        sa.Column("quantity", sa.Float(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.text("now()")),
+    )
+    # Начальные остатки по журналу проводок (то же, что python -m app.reconcile --apply)
+    op.execute("""
+        INSERT INTO stock_balances (material_id, quantity)
+        SELECT m.id, COALESCE(SUM(t.delta), 0)
+        FROM materials m LEFT JOIN transactions t ON t.material_id = m.id
+        GROUP BY m.id
+    """)
+    op.create_index("ix_batches_material_expiration", "batches", ["material_id", "expiration_date"])
+    op.create_index("ix_batches_expiring", "batches", ["expiration_date"],
+                    postgresql_where=sa.text("current_quantity > 0"))
+
+
+def downgrade():
+    op.drop_index("ix_batches_expiring", table_name="batches")
+    op.drop_index("ix_batches_material_expiration", table_name="batches")
+    op.drop_table("stock_balances")
@@ -0,0 +1,34 @@
+"""trigram material search
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+"""
+from alembic import op
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    # Нижний регистр + транслитерация кириллицы в латиницу: "Парацетамол" и "paracetamol"
+    # сравниваются как "paratsetamol"/"paracetamol" и близки по триграммам
+    op.execute("""
+        CREATE OR REPLACE FUNCTION clinic_translit(value text) RETURNS text
+        LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE AS $$
+            SELECT translate(
+                replace(replace(replace(replace(replace(replace(replace(replace(replace(lower(value),
+                    'щ', 'shch'), 'ш', 'sh'), 'ч', 'ch'), 'ц', 'ts'), 'ж', 'zh'), 'х', 'kh'),
+                    'ю', 'iu'), 'я', 'ia'), 'ё', 'e'),
+                'абвгдезийклмнопрстуфыэъь', 'abvgdeziiklmnoprstufye')
+        $$
+    """)
+    op.execute("CREATE INDEX ix_materials_name_trgm ON materials USING gin (clinic_translit(name) gin_trgm_ops)")
+
+
+def downgrade():
+    op.execute("DROP INDEX IF EXISTS ix_materials_name_trgm")
+    op.execute("DROP FUNCTION IF EXISTS clinic_translit(text)")
@@ -0,0 +1,22 @@
+"""journal keyset indexes
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17
+"""
+from alembic import op
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_transactions_created_at_id", "transactions", ["created_at", "id"])
+    op.create_index("ix_narcotic_logs_transaction_id", "narcotic_logs", ["transaction_id"])
+
+
+def downgrade():
+    op.drop_index("ix_narcotic_logs_transaction_id", table_name="narcotic_logs")
+    op.drop_index("ix_transactions_created_at_id", table_name="transactions")
@@ -0,0 +1,22 @@
+"""activity log indexes
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17
+"""
+from alembic import op
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_activity_logs_user_created_at", "activity_logs", ["user_id", "created_at", "id"])
+    op.create_index("ix_activity_logs_created_at_id", "activity_logs", ["created_at", "id"])
+
+
+def downgrade():
+    op.drop_index("ix_activity_logs_created_at_id", table_name="activity_logs")
+    op.drop_index("ix_activity_logs_user_created_at", table_name="activity_logs")
@@ -0,0 +1,71 @@
+"""daily consumption rollup
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+# Разбор новых проводок по дням (UTC): поступило / списано / списано просроченным
+# (списание из партии, срок годности которой уже истек на момент проводки)
+ROLLUP_SELECT = """
+    SELECT t.material_id, (t.created_at AT TIME ZONE 'UTC')::date,
+           SUM(CASE WHEN t.delta > 0 THEN t.delta ELSE 0 END),
+           SUM(CASE WHEN t.delta < 0 AND NOT COALESCE(b.expiration_date <= (t.created_at AT TIME ZONE 'UTC'), false)
+                    THEN -t.delta ELSE 0 END),
+           SUM(CASE WHEN t.delta < 0 AND COALESCE(b.expiration_date <= (t.created_at AT TIME ZONE 'UTC'), false)
+                    THEN -t.delta ELSE 0 END)
+    FROM {source} t LEFT JOIN batches b ON b.id = t.batch_id
+    GROUP BY 1, 2
+"""
+
+
+def upgrade():
+    op.create_table(
+        "consumption_daily",
+        sa.Column("material_id", sa.Integer(), sa.ForeignKey("materials.id", ondelete="CASCADE"), primary_key=True),
+        sa.Column("day", sa.Date(), primary_key=True),
+        sa.Column("received", sa.Float(), nullable=False, server_default="0"),
+        sa.Column("written_off", sa.Float(), nullable=False, server_default="0"),
+        sa.Column("expired", sa.Float(), nullable=False, server_default="0"),
+    )
+    op.create_index("ix_consumption_daily_day", "consumption_daily", ["day"])
+
+    # Триггер уровня оператора: пакетная вставка проводок обновляет свертку одним INSERT
+    op.execute(f"""
+        CREATE OR REPLACE FUNCTION consumption_daily_apply() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            INSERT INTO consumption_daily (material_id, day, received, written_off, expired)
+            {ROLLUP_SELECT.format(source="new_rows")}
+            ON CONFLICT (material_id, day) DO UPDATE SET
+                received = consumption_daily.received + EXCLUDED.received,
+                written_off = consumption_daily.written_off + EXCLUDED.written_off,
+                expired = consumption_daily.expired + EXCLUDED.expired;
+            RETURN NULL;
+        END
+        $$
+    """)
+    op.execute("""
+        CREATE TRIGGER transactions_consumption_daily
+        AFTER INSERT ON transactions REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION consumption_daily_apply()
+    """)
+
+    op.execute(f"""
+        INSERT INTO consumption_daily (material_id, day, received, written_off, expired)
+        {ROLLUP_SELECT.format(source="transactions")}
+    """)
+
+
+def downgrade():
+    op.execute("DROP TRIGGER IF EXISTS transactions_consumption_daily ON transactions")
+    op.execute("DROP FUNCTION IF EXISTS consumption_daily_apply()")
+    op.drop_index("ix_consumption_daily_day", table_name="consumption_daily")
+    op.drop_table("consumption_daily")
@@ -0,0 +1,28 @@
+"""material ledger index and balance checkpoints
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_transactions_material_created_at", "transactions", ["material_id", "created_at", "id"])
+    op.create_table(
+        "balance_checkpoints",
+        sa.Column("material_id", sa.Integer(), sa.ForeignKey("materials.id", ondelete="CASCADE"), primary_key=True),
+        sa.Column("as_of", sa.DateTime(timezone=True), primary_key=True),
+        sa.Column("quantity", sa.Float(), nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table("balance_checkpoints")
+    op.drop_index("ix_transactions_material_created_at", table_name="transactions")
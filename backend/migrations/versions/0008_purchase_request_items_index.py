@@ -0,0 +1,20 @@
+"""purchase request items index
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-17
+"""
+from alembic import op
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_purchase_request_items_request_id", "purchase_request_items", ["request_id"])
+
+
+def downgrade():
+    op.drop_index("ix_purchase_request_items_request_id", table_name="purchase_request_items")
@@ -0,0 +1,171 @@
+"""monthly range partitions for transactions, narcotic and activity logs
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+PARTITIONED_TABLES = ("transactions", "narcotic_logs", "activity_logs")
+MONTHS_AHEAD = 3
+
+# Индексы и внешние ключи, которые пересоздаются на секционированной таблице
+# (ключ секционирования created_at обязан входить в первичный ключ)
+INDEXES = {
+    "transactions": {
+        "ix_transactions_id": ["id"],
+        "ix_transactions_created_at_id": ["created_at", "id"],
+        "ix_transactions_material_created_at": ["material_id", "created_at", "id"],
+    },
+    "narcotic_logs": {
+        "ix_narcotic_logs_id": ["id"],
+        "ix_narcotic_logs_transaction_id": ["transaction_id"],
+        "ix_narcotic_logs_created_at_transaction_id": ["created_at", "transaction_id"],
+        "ix_narcotic_logs_material_created_at": ["material_id", "created_at", "transaction_id"],
+    },
+    "activity_logs": {
+        "ix_activity_logs_id": ["id"],
+        "ix_activity_logs_user_created_at": ["user_id", "created_at", "id"],
+        "ix_activity_logs_created_at_id": ["created_at", "id"],
+    },
+}
+FOREIGN_KEYS = {
+    "transactions": {"material_id": "materials", "user_id": "users", "batch_id": "batches"},
+    "narcotic_logs": {"material_id": "materials", "user_id": "users"},
+    "activity_logs": {"user_id": "users"},
+}
+
+# Создает недостающие помесячные секции (границы - месяцы по UTC). Строки нужного месяца,
+# успевшие попасть в секцию по умолчанию, переносятся в новую секцию.
+CREATE_MONTHLY_PARTITIONS = """
+    CREATE OR REPLACE FUNCTION create_monthly_partitions(parent text, from_month date, to_month date)
+    RETURNS integer LANGUAGE plpgsql AS $$
+    DECLARE
+        month date := date_trunc('month', from_month)::date;
+        lower_bound timestamptz;
+        upper_bound timestamptz;
+        part text;
+        created integer := 0;
+    BEGIN
+        WHILE month <= to_month LOOP
+            part := parent || to_char(month, '"_y"YYYY"m"MM');
+            IF to_regclass(part) IS NULL THEN
+                lower_bound := month::timestamp AT TIME ZONE 'UTC';
+                upper_bound := (month + interval '1 month')::timestamp AT TIME ZONE 'UTC';
+                EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS)', part, parent);
+                EXECUTE format('WITH moved AS (DELETE FROM %I WHERE created_at >= %L AND created_at < %L RETURNING *) '
+                               'INSERT INTO %I SELECT * FROM moved', parent || '_default', lower_bound, upper_bound,
+                               part);
+                EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                               parent, part, lower_bound, upper_bound);
+                created := created + 1;
+            END IF;
+            month := (month + interval '1 month')::date;
+        END LOOP;
+        RETURN created;
+    END
+    $$
+"""
+
+CONSUMPTION_TRIGGER = """
+    CREATE TRIGGER transactions_consumption_daily
+    AFTER INSERT ON transactions REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION consumption_daily_apply()
+"""
+
+
+def _recreate_keys(table):
+    for name, columns in INDEXES[table].items():
+        op.create_index(name, table, columns)
+    for column, target in FOREIGN_KEYS[table].items():
+        op.create_foreign_key(f"{table}_{column}_fkey", table, target, [column], ["id"])
+
+
+def _partition(table):
+    """Переносит таблицу в секционированную по месяцам created_at с теми же колонками и данными."""
+    old = f"{table}_unpartitioned"
+    op.execute(f"ALTER TABLE {table} RENAME TO {old}")
+    op.execute(f"CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)")
+    op.execute(f"ALTER TABLE {table} ALTER COLUMN created_at SET NOT NULL")
+    op.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+    op.execute(f"""
+        SELECT create_monthly_partitions(
+            '{table}',
+            (COALESCE((SELECT MIN(created_at) FROM {old}), now()) AT TIME ZONE 'UTC')::date,
+            ((now() AT TIME ZONE 'UTC') + interval '{MONTHS_AHEAD} months')::date
+        )
+    """)
+    op.execute(f"INSERT INTO {table} SELECT * FROM {old}")
+    op.execute(f"ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id")
+    op.execute(f"DROP TABLE {old}")
+    op.create_primary_key(f"{table}_pkey", table, ["id", "created_at"])
+    _recreate_keys(table)
+
+
+def _unpartition(table):
+    old = f"{table}_partitioned"
+    op.execute(f"ALTER TABLE {table} RENAME TO {old}")
+    op.execute(f"CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS)")
+    op.execute(f"INSERT INTO {table} SELECT * FROM {old}")
+    op.execute(f"ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id")
+    op.execute(f"DROP TABLE {old} CASCADE")
+    op.create_primary_key(f"{table}_pkey", table, ["id"])
+    _recreate_keys(table)
+
+
+def upgrade():
+    # Журнал НС становится самодостаточным: после архивирования старых секций проводок
+    # он по-прежнему показывает дату, количество, материал и сотрудника
+    op.add_column("narcotic_logs", sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()))
+    op.add_column("narcotic_logs", sa.Column("material_id", sa.Integer()))
+    op.add_column("narcotic_logs", sa.Column("user_id", sa.Integer()))
+    op.add_column("narcotic_logs", sa.Column("delta", sa.Float()))
+    op.execute("""
+        UPDATE narcotic_logs n
+        SET created_at = t.created_at, material_id = t.material_id, user_id = t.user_id, delta = t.delta
+        FROM transactions t WHERE t.id = n.transaction_id
+    """)
+    for column in ("material_id", "user_id", "delta"):
+        op.alter_column("narcotic_logs", column, nullable=False)
+    # Внешний ключ на секционированную таблицу требовал бы created_at проводки и мешал бы
+    # удалять ее архивные секции
+    op.drop_constraint("narcotic_logs_transaction_id_fkey", "narcotic_logs", type_="foreignkey")
+
+    op.execute(CREATE_MONTHLY_PARTITIONS)
+    for table in PARTITIONED_TABLES:
+        _partition(table)
+    op.execute(CONSUMPTION_TRIGGER)
+
+    op.create_table(
+        "archived_partitions",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("table_name", sa.String(), nullable=False),
+        sa.Column("partition_name", sa.String(), nullable=False),
+        sa.Column("range_from", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("range_to", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("row_count", sa.BigInteger(), nullable=False),
+        sa.Column("file_path", sa.String(), nullable=False),
+        sa.Column("archived_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+    )
+    op.create_index("ix_archived_partitions_table_range", "archived_partitions", ["table_name", "range_to"])
+
+
+def downgrade():
+    op.drop_index("ix_archived_partitions_table_range", table_name="archived_partitions")
+    op.drop_table("archived_partitions")
+
+    for table in PARTITIONED_TABLES:
+        _unpartition(table)
+    op.execute(CONSUMPTION_TRIGGER)
+    op.execute("DROP FUNCTION IF EXISTS create_monthly_partitions(text, date, date)")
+
+    op.create_foreign_key("narcotic_logs_transaction_id_fkey", "narcotic_logs", "transactions",
+                          ["transaction_id"], ["id"])
+    for column in ("delta", "user_id", "material_id", "created_at"):
+        op.drop_column("narcotic_logs", column)
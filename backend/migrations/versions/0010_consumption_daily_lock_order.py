@@ -0,0 +1,45 @@
+"""consumption_daily trigger upserts rows in key order
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-17
+"""
+from alembic import op
+
+revision = "0010"
+down_revision = "0009"
+branch_labels = None
+depends_on = None
+
+APPLY_FUNCTION = """
+    CREATE OR REPLACE FUNCTION consumption_daily_apply() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        INSERT INTO consumption_daily (material_id, day, received, written_off, expired)
+        SELECT t.material_id, (t.created_at AT TIME ZONE 'UTC')::date,
+               SUM(CASE WHEN t.delta > 0 THEN t.delta ELSE 0 END),
+               SUM(CASE WHEN t.delta < 0 AND NOT COALESCE(b.expiration_date <= (t.created_at AT TIME ZONE 'UTC'), false)
+                        THEN -t.delta ELSE 0 END),
+               SUM(CASE WHEN t.delta < 0 AND COALESCE(b.expiration_date <= (t.created_at AT TIME ZONE 'UTC'), false)
+                        THEN -t.delta ELSE 0 END)
+        FROM new_rows t LEFT JOIN batches b ON b.id = t.batch_id
+        GROUP BY 1, 2
+        {order_by}
+        ON CONFLICT (material_id, day) DO UPDATE SET
+            received = consumption_daily.received + EXCLUDED.received,
+            written_off = consumption_daily.written_off + EXCLUDED.written_off,
+            expired = consumption_daily.expired + EXCLUDED.expired;
+        RETURN NULL;
+    END
+    $$
+"""
+
+
+def upgrade():
+    # Строки свертки блокируются в порядке (material_id, day), как stock_balances в порядке id:
+    # два пакета проводок по одним и тем же материалам не взаимоблокируются
+    op.execute(APPLY_FUNCTION.format(order_by="ORDER BY 1, 2"))
+
+
+def downgrade():
+    op.execute(APPLY_FUNCTION.format(order_by=""))
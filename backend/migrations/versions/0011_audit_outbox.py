@@ -0,0 +1,34 @@
+"""audit outbox
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0011"
+down_revision = "0010"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Без внешних ключей и вторичных индексов: запись в outbox - часть каждой пишущей транзакции
+    op.create_table(
+        "audit_outbox",
+        sa.Column("id", sa.BigInteger(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("action", sa.String(), nullable=False),
+        sa.Column("details", sa.String(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+    )
+
+
+def downgrade():
+    # Еще не перенесенные записи не теряем
+    op.execute("""
+        INSERT INTO activity_logs (user_id, action, details, created_at)
+        SELECT user_id, action, details, created_at FROM audit_outbox ORDER BY id
+    """)
+    op.drop_table("audit_outbox")
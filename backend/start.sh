@@ -0,0 +1,10 @@
+#!/usr/bin/env bash
+# Миграции выполняются один раз до запуска воркеров, а не при импорте приложения
+set -e
+alembic upgrade head
+# Автоперезагрузка только для разработки (docker-compose монтирует код): следит за файлами
+# и запускает приложение в одном процессе
+if [ "${UVICORN_RELOAD:-false}" = "true" ]; then
+    exec uvicorn app.main:app --host 0.0.0.0 --port 8000 --reload
+fi
+exec uvicorn app.main:app --host 0.0.0.0 --port 8000
@@ -0,0 +1,23 @@
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select
+
+from app import checkpoints, crud, models, schemas
+
+
+def test_default_checkpoint_lags_behind_open_transactions(db, user):
+    crud.create_material(db, schemas.MaterialCreate(name="Бинт", unit="piece", initial_quantity=5), user_id=user.id)
+
+    assert checkpoints.main([]) == 0
+
+    as_of = db.scalar(select(models.BalanceCheckpoint.as_of))
+    assert as_of <= datetime.now(timezone.utc) - timedelta(hours=checkpoints.CHECKPOINT_LAG_HOURS)
+    assert as_of.astimezone(timezone.utc).time() == datetime.min.time()
+
+
+def test_recent_checkpoint_is_refused(db, user):
+    crud.create_material(db, schemas.MaterialCreate(name="Бинт", unit="piece", initial_quantity=5), user_id=user.id)
+    recent = datetime.now(timezone.utc) - timedelta(minutes=5)
+
+    assert checkpoints.main(["--at", recent.isoformat()]) == 1
+    assert db.scalar(select(models.BalanceCheckpoint.as_of)) is None
@@ -0,0 +1,43 @@
+import io
+
+from app import models
+from app.importer import import_materials
+
+
+def _import(user, content: str):
+    return import_materials(io.BytesIO(content.encode()), "csv", user.id)
+
+
+def test_reimport_without_columns_keeps_narcotic_properties(db, user):
+    supplier = models.Supplier(name="Pharma")
+    db.add(supplier)
+    db.commit()
+    _import(user, f"name,unit,min_quantity,is_narcotic,supplier_id\nМорфин 1%,ampoule,10,true,{supplier.id}\n")
+
+    report = _import(user, "name,unit\nМорфин 1%,ampoule\n")
+
+    assert report["updated"] == 1 and report["error_count"] == 0
+    material = db.query(models.Material).filter_by(name="Морфин 1%").one()
+    assert material.is_narcotic is True
+    assert material.min_quantity == 10
+    assert material.supplier_id == supplier.id
+
+
+def test_reimport_updates_only_filled_columns(db, user):
+    _import(user, "name,unit,min_quantity,is_narcotic\nМорфин 1%,ampoule,10,true\nБинт,piece,5,\n")
+
+    report = _import(user, "name,unit,min_quantity,is_narcotic\nМорфин 1%,ampoule,20,\nБинт,piece,,true\n")
+
+    assert report["updated"] == 2
+    materials = {m.name: m for m in db.query(models.Material)}
+    assert (materials["Морфин 1%"].min_quantity, materials["Морфин 1%"].is_narcotic) == (20, True)
+    assert (materials["Бинт"].min_quantity, materials["Бинт"].is_narcotic) == (5, True)
+
+
+def test_new_material_gets_defaults_for_empty_cells(db, user):
+    report = _import(user, "name,unit,initial_quantity\nШприц 5 мл,piece,100\n")
+
+    assert (report["created"], report["batches"]) == (1, 1)
+    material = db.query(models.Material).filter_by(name="Шприц 5 мл").one()
+    assert (material.min_quantity, material.is_narcotic, material.supplier_id) == (0, False, None)
+    assert material.unit == models.UnitEnum.piece
@@ -0,0 +1,56 @@
+from datetime import datetime, timezone
+
+import pytest
+from sqlalchemy import delete, select, text, update
+
+from app import crud, models, partitions, schemas
+
+
+def _at(year, month, day):
+    return datetime(year, month, day, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def old_ledger(db, user):
+    """Приход 10 в январе 2024 и списания по 3 в феврале и марте; остаток 4."""
+    material = crud.create_material(
+        db, schemas.MaterialCreate(name="Бинт", unit="piece", initial_quantity=10), user_id=user.id)
+    for _ in range(2):
+        crud.create_transaction(db, schemas.TransactionCreate(material_id=material.id, delta=-3), user.id)
+    ids = db.scalars(select(models.Transaction.id).order_by(models.Transaction.id)).all()
+    for transaction_id, at in zip(ids, (_at(2024, 1, 15), _at(2024, 2, 10), _at(2024, 3, 5))):
+        db.execute(update(models.Transaction).where(models.Transaction.id == transaction_id).values(created_at=at))
+    db.commit()
+    partitions.ensure_partitions(db)
+    return material
+
+
+def test_checkpoint_written_for_each_archived_partition(db, old_ledger, tmp_path, monkeypatch):
+    archive_partition = partitions.archive_partition
+
+    def fail_on_march(db, table, name, *args):
+        if name == "transactions_y2024m03":
+            raise OSError("disk full")
+        return archive_partition(db, table, name, *args)
+
+    monkeypatch.setattr(partitions, "archive_partition", fail_on_march)
+    with pytest.raises(OSError):
+        partitions.archive_partitions(db, retention_months=1, archive_dir=str(tmp_path))
+
+    # Архив прерван после февраля: граница - 1 марта, и на ней есть своя контрольная точка
+    assert crud.get_archive_boundary(db, "transactions") == _at(2024, 3, 1)
+    assert crud.reconcile_stock_balances(db) == []
+    assert crud.get_stock_as_of(db, _at(2024, 3, 1), old_ledger.id)[0]["quantity"] == 7
+    assert [row["balance"] for row in crud.get_material_ledger(db, old_ledger.id)] == [4]
+
+
+def test_reconcile_refuses_without_boundary_checkpoint(db, old_ledger, tmp_path):
+    partitions.archive_partitions(db, retention_months=1, archive_dir=str(tmp_path))
+    assert crud.reconcile_stock_balances(db) == []
+
+    db.execute(delete(models.BalanceCheckpoint).where(models.BalanceCheckpoint.as_of == _at(2024, 4, 1)))
+    db.commit()
+
+    with pytest.raises(ValueError):
+        crud.reconcile_stock_balances(db, apply=True)
+    assert db.execute(text("SELECT quantity FROM stock_balances")).scalar() == 4
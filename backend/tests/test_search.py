@@ -0,0 +1,33 @@
+import pytest
+
+from app import crud, schemas
+
+NAMES = ["Парацетамол табл. 200 мг №1234", "Лидокаин 2% 2 мл", "Шприц 5 мл", "Бинт стерильный 7x14"]
+
+
+@pytest.fixture
+def materials(db, user):
+    for name in NAMES:
+        crud.create_material(db, schemas.MaterialCreate(name=name, unit="piece"), user_id=user.id)
+
+
+@pytest.mark.parametrize("q, expected", [
+    ("paracetamol", "Парацетамол табл. 200 мг №1234"),
+    ("парацетомол", "Парацетамол табл. 200 мг №1234"),
+    ("lidocaine", "Лидокаин 2% 2 мл"),
+    ("лидокаин", "Лидокаин 2% 2 мл"),
+    ("bint", "Бинт стерильный 7x14"),
+])
+def test_search_matches_name_with_dosage_suffix(db, materials, q, expected):
+    assert [m["name"] for m in crud.get_materials(db, q=q, fields=["name"])] == [expected]
+    assert crud.suggest_materials(db, q)[0]["name"] == expected
+
+
+def test_suggest_ranks_by_word_similarity(db, materials, user):
+    crud.create_material(db, schemas.MaterialCreate(name="Парацетамол сироп 120 мг/5 мл", unit="milliliter"),
+                         user_id=user.id)
+
+    names = [m["name"] for m in crud.suggest_materials(db, "парацетамол сироп")]
+
+    assert names[0] == "Парацетамол сироп 120 мг/5 мл"
+    assert "Шприц 5 мл" not in names
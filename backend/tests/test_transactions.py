@@ -0,0 +1,104 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import func, select
+
+from app import crud, models, schemas
+from app.database import open_session
+
+
+def _material(db, user, quantity, name="Бинт"):
+    return crud.create_material(
+        db, schemas.MaterialCreate(name=name, unit="piece", initial_quantity=quantity), user_id=user.id)
+
+
+def _write_off(user_id, material_id, delta=-1, batch_id=None):
+    session = open_session()
+    try:
+        return crud.create_transaction(
+            session, schemas.TransactionCreate(material_id=material_id, delta=delta, batch_id=batch_id), user_id)
+    finally:
+        session.close()
+
+
+def _parallel_write_offs(user_id, material_id, count, batch_id=None, explicit_every=0, workers=32):
+    """count списаний по единице из workers потоков; каждое explicit_every-е - с явной партией."""
+    def run(i):
+        explicit = explicit_every and i % explicit_every == 0
+        return _write_off(user_id, material_id, batch_id=batch_id if explicit else None)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(run, range(count)))
+
+
+def _totals(db, material_id):
+    """(остаток партий, остаток материала, сумма проводок, число проводок)."""
+    batches = db.scalar(select(func.sum(models.Batch.current_quantity)).where(models.Batch.material_id == material_id))
+    ledger = db.execute(select(func.sum(models.Transaction.delta), func.count())
+                        .where(models.Transaction.material_id == material_id)).one()
+    return batches, crud.get_stock_quantity(db, material_id), *ledger
+
+
+def test_parallel_fefo_write_offs_never_rejected_while_stock_remains(db, user):
+    material = _material(db, user, 200)
+
+    results = _parallel_write_offs(user.id, material.id, 200)
+
+    assert sum(1 for result in results if not result) == 0
+    assert _totals(db, material.id) == (0, 0, 0, 201)
+
+
+def test_parallel_write_offs_do_not_oversell(db, user):
+    material = _material(db, user, 100)
+
+    results = _parallel_write_offs(user.id, material.id, 300, batch_id=material.batches[0].id, explicit_every=2)
+
+    assert sum(1 for result in results if result) == 100
+    assert _totals(db, material.id) == (0, 0, 0, 101)
+
+
+def test_fefo_write_off_waits_for_locked_batch(db, user):
+    material = _material(db, user, 10)
+    batch_id = material.batches[0].id
+    locker = open_session()
+    locker.execute(select(models.Batch.id).where(models.Batch.id == batch_id).with_for_update())
+
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(transactions=_write_off(user.id, material.id)))
+    try:
+        thread.start()
+        thread.join(0.5)
+        # Занятая партия - не повод отказать в списании: запрос ждет блокировку
+        assert thread.is_alive()
+    finally:
+        locker.rollback()
+        locker.close()
+    thread.join(10)
+
+    assert [t.batch_id for t in result["transactions"]] == [batch_id]
+    assert db.scalar(select(models.Batch.current_quantity).where(models.Batch.id == batch_id)) == 9
+
+
+def test_fefo_write_off_rejected_only_without_stock(db, user):
+    material = _material(db, user, 1)
+
+    assert _write_off(user.id, material.id, delta=-2) is None
+    assert _write_off(user.id, material.id, delta=-1)
+    assert _write_off(user.id, material.id, delta=-1) is None
+
+
+def test_receipt_without_batch_is_rejected_with_clear_error(db, user, client, auth_headers):
+    material = _material(db, user, 0)
+    response = client.post("/transactions/", json={"material_id": material.id, "delta": 5}, headers=auth_headers)
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Batch is required for this transaction"
+
+
+def test_bulk_rejects_oversized_batch(db, user, client, auth_headers):
+    material = _material(db, user, 1000)
+    items = [{"material_id": material.id, "delta": -1}] * (schemas.TRANSACTION_BULK_MAX_ITEMS + 1)
+    response = client.post("/transactions/bulk", json={"items": items}, headers=auth_headers)
+
+    assert response.status_code == 422
+    assert crud.get_stock_quantity(db, material.id) == 1000
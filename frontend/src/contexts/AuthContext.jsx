@@ -19,6 +19,7 @@ export const AuthProvider = ({ children }) => {
         })
         .catch(() => {
           localStorage.removeItem('token');
+          localStorage.removeItem('refreshToken');
           setUser(null);
         })
         .finally(() => setLoading(false));
@@ -32,9 +33,10 @@ export const AuthProvider = ({ children }) => {
       username: email,
       password: password
     }));
-    const { access_token } = response.data;
+    const { access_token, refresh_token } = response.data;
     // Убедитесь, что здесь используется тот же ключ, что и в api.js
     localStorage.setItem('token', access_token);
+    localStorage.setItem('refreshToken', refresh_token);
     api.defaults.headers.Authorization = `Bearer ${access_token}`;
     const userResponse = await api.get('/users/me/');
     setUser(userResponse.data);
@@ -43,6 +45,7 @@ export const AuthProvider = ({ children }) => {
 
   const logout = () => {
     localStorage.removeItem('token');
+    localStorage.removeItem('refreshToken');
     delete api.defaults.headers.Authorization;
     setUser(null);
     navigate('/login');
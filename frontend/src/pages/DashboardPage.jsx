@@ -1,5 +1,5 @@
-import React, { useState, useEffect } from 'react';
-import { Grid, Paper, Typography, Box, Table, TableBody, TableCell, TableContainer, TableHead, TableRow, CircularProgress } from '@mui/material';
+import React, { useState, useEffect, useCallback } from 'react';
+import { Grid, Paper, Typography, Box, Table, TableBody, TableCell, TableContainer, TableHead, TableRow, CircularProgress, Snackbar, Alert } from '@mui/material';
 import { Pie } from 'react-chartjs-2';
 import { Chart as ChartJS, ArcElement, Tooltip, Legend } from 'chart.js';
 import WarningIcon from '@mui/icons-material/Warning';
@@ -14,6 +14,23 @@ const formatDate = (dateString) => {
   return new Date(dateString).toLocaleDateString();
 };
 
+// Пока потока оповещений нет, статистика опрашивается с этим интервалом
+const POLL_INTERVAL_MS = 60000;
+// Пауза перед переподключением потока с новым билетом
+const STREAM_RETRY_MS = 5000;
+// Одно событие приходит всем открытым дашбордам: перечитывание размазывается по этому окну
+const REFETCH_JITTER_MS = 2000;
+
+// Текст всплывающего уведомления по событию из /alerts/stream
+const alertMessage = (event) => {
+  switch (event.type) {
+    case 'low_stock': return `Заканчивается: ${event.name} (остаток ${event.quantity}, мин. ${event.min_quantity})`;
+    case 'stock_restored': return `Запас восстановлен: ${event.name} (остаток ${event.quantity})`;
+    case 'expiring': return `Истекает срок годности: ${event.name}, партия #${event.batch_id} до ${formatDate(event.expiration_date)}`;
+    default: return null;
+  }
+};
+
 // Виджет для Уведомлений
 const AlertWidget = ({ title, icon, data, columns }) => (
   <Paper sx={{ p: 2, height: '100%' }}>
@@ -69,19 +86,91 @@ const DashboardPage = () => {
   const [stats, setStats] = useState(null);
   const [loading, setLoading] = useState(true);
 
+  const [notice, setNotice] = useState(null);
+
+  const fetchStats = useCallback(async () => {
+    try {
+      const response = await api.get('/dashboard/stats');
+      setStats(response.data);
+    } catch (error) {
+      console.error("Ошибка при загрузке статистики:", error);
+    } finally {
+      setLoading(false);
+    }
+  }, []);
+
   useEffect(() => {
-    const fetchStats = async () => {
+    fetchStats();
+  }, [fetchStats]);
+
+  // Вместо опроса: сервер присылает событие, и только тогда статистика перечитывается.
+  // Поток открывается по короткоживущему билету; запрос билета идет через api, поэтому
+  // истекший access-токен обновляется, и каждое переподключение получает свежий билет.
+  useEffect(() => {
+    let source = null;
+    let closed = false;
+    let pollTimer = null;
+    let retryTimer = null;
+    let refetchTimer = null;
+
+    const scheduleRefetch = () => {
+      if (refetchTimer) return;
+      refetchTimer = setTimeout(() => {
+        refetchTimer = null;
+        fetchStats();
+      }, Math.random() * REFETCH_JITTER_MS);
+    };
+
+    const startPolling = () => {
+      if (!pollTimer) pollTimer = setInterval(fetchStats, POLL_INTERVAL_MS);
+    };
+
+    const stopPolling = () => {
+      clearInterval(pollTimer);
+      pollTimer = null;
+    };
+
+    const reconnect = () => {
+      startPolling();
+      if (!closed) retryTimer = setTimeout(connect, STREAM_RETRY_MS);
+    };
+
+    const connect = async () => {
+      let ticket;
       try {
-        const response = await api.get('/dashboard/stats');
-        setStats(response.data);
+        ({ data: { ticket } } = await api.post('/alerts/ticket'));
       } catch (error) {
-        console.error("Ошибка при загрузке статистики:", error);
-      } finally {
-        setLoading(false);
+        console.error("Ошибка при подключении к оповещениям:", error);
+        reconnect();
+        return;
       }
+      if (closed) return;
+      source = new EventSource(`${api.defaults.baseURL}/alerts/stream?ticket=${encodeURIComponent(ticket)}`);
+      source.addEventListener('alert', (message) => {
+        setNotice(alertMessage(JSON.parse(message.data)));
+        scheduleRefetch();
+      });
+      // После переподключения события за время обрыва могли потеряться
+      source.addEventListener('open', () => {
+        stopPolling();
+        scheduleRefetch();
+      });
+      // Сам EventSource переподключился бы со старым, уже истекшим билетом
+      source.addEventListener('error', () => {
+        source.close();
+        reconnect();
+      });
     };
-    fetchStats();
-  }, []);
+
+    connect();
+    return () => {
+      closed = true;
+      source?.close();
+      stopPolling();
+      clearTimeout(retryTimer);
+      clearTimeout(refetchTimer);
+    };
+  }, [fetchStats]);
 
   if (loading) {
     return <Box sx={{ display: 'flex', justifyContent: 'center', mt: 4 }}><CircularProgress /></Box>;
@@ -147,6 +236,9 @@ const DashboardPage = () => {
             <ChartWidget title="Топ-10 материалов по количеству" chartData={chartData} />
         </Grid>
       </Grid>
+      <Snackbar open={Boolean(notice)} autoHideDuration={8000} onClose={() => setNotice(null)}>
+        <Alert severity="warning" onClose={() => setNotice(null)} sx={{ width: '100%' }}>{notice}</Alert>
+      </Snackbar>
     </Box>
   );
 };
@@ -144,7 +144,7 @@ const MaterialsPage = () => {
   const fetchMaterials = useCallback(async () => {
     setLoading(true);
     try {
-      const response = await api.get('/materials/', { params: { q: searchTerm } });
+      const response = await api.get('/materials/', { params: { q: searchTerm, fields: 'batches.id,batches.current_quantity,batches.expiration_date' } });
       setMaterials(response.data);
     } catch (error) { console.error("Ошибка при загрузке материалов:", error); }
     finally { setLoading(false); }
@@ -181,6 +181,17 @@ const MaterialsPage = () => {
       const fullTransactionData = { ...narcoticLogData, narcotic_log: logData };
       executeTransaction(fullTransactionData);
   };
+  const handleExport = async () => {
+      try {
+          const response = await api.get('/exports/inventory', { params: { format: 'csv' }, responseType: 'blob' });
+          const url = URL.createObjectURL(response.data);
+          const link = document.createElement('a');
+          link.href = url;
+          link.download = 'inventory.csv';
+          link.click();
+          URL.revokeObjectURL(url);
+      } catch (error) { console.error("Ошибка выгрузки остатков:", error); }
+  };
   const executeTransaction = async (transactionData) => {
       try { await api.post('/transactions/', transactionData); fetchMaterials(); }
       catch (error) { console.error("Ошибка списания:", error); alert(error.response?.data?.detail || 'Ошибка списания!'); }
@@ -191,7 +202,10 @@ const MaterialsPage = () => {
     <Box>
       <Box sx={{ display: 'flex', justifyContent: 'space-between', alignItems: 'center', mb: 2 }}>
         <Typography variant="h4">Управление материалами</Typography>
-        <Button variant="contained" startIcon={<AddCircleIcon />} onClick={() => handleOpenFormModal()}>Добавить</Button>
+        <Box>
+          <Button variant="outlined" onClick={handleExport} sx={{ mr: 1 }}>Выгрузить остатки</Button>
+          <Button variant="contained" startIcon={<AddCircleIcon />} onClick={() => handleOpenFormModal()}>Добавить</Button>
+        </Box>
       </Box>
       <TextField fullWidth label="Поиск по названию..." value={searchTerm} onChange={(e) => setSearchTerm(e.target.value)} sx={{ mb: 2 }}/>
       <Paper sx={{ mb: 2 }}>
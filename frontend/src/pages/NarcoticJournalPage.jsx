@@ -1,32 +1,58 @@
 import React, { useState, useEffect } from 'react';
 import {
   Box, Typography, Paper, Table, TableBody, TableCell,
-  TableContainer, TableHead, TableRow, CircularProgress
+  TableContainer, TableHead, TableRow, CircularProgress, Button
 } from '@mui/material';
 import api from '@/services/api.js';
 import { translateUnit } from '@/utils/translation.js';
 
+const PAGE_SIZE = 100;
+
 const NarcoticJournalPage = () => {
   const [logs, setLogs] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [hasMore, setHasMore] = useState(false);
 
-  useEffect(() => {
-    const fetchLogs = async () => {
-      try {
-        const response = await api.get('/narcotic-logs/');
-        setLogs(response.data);
-      } catch (error) {
-        console.error("Ошибка при загрузке журнала:", error);
-      } finally {
-        setLoading(false);
+  // Журнал грузится страницами: следующая начинается после последней загруженной записи
+  const fetchLogs = async (after = null) => {
+    try {
+      const params = { limit: PAGE_SIZE };
+      if (after) {
+        params.before_created_at = after.created_at;
+        params.before_transaction_id = after.transaction_id;
       }
-    };
-    fetchLogs();
-  }, []);
+      const response = await api.get('/narcotic-logs/', { params });
+      setLogs(prev => (after ? [...prev, ...response.data] : response.data));
+      setHasMore(response.data.length === PAGE_SIZE);
+    } catch (error) {
+      console.error("Ошибка при загрузке журнала:", error);
+    } finally {
+      setLoading(false);
+    }
+  };
+
+  useEffect(() => { fetchLogs(); }, []);
+
+  const handleExport = async () => {
+    try {
+      const response = await api.get('/narcotic-logs/export', { params: { format: 'csv' }, responseType: 'blob' });
+      const url = URL.createObjectURL(response.data);
+      const link = document.createElement('a');
+      link.href = url;
+      link.download = 'narcotic_journal.csv';
+      link.click();
+      URL.revokeObjectURL(url);
+    } catch (error) {
+      console.error("Ошибка выгрузки журнала:", error);
+    }
+  };
 
   return (
     <Box>
-      <Typography variant="h4" gutterBottom>Журнал учета наркотических средств</Typography>
+      <Box sx={{ display: 'flex', justifyContent: 'space-between', alignItems: 'center', mb: 2 }}>
+        <Typography variant="h4">Журнал учета наркотических средств</Typography>
+        <Button variant="outlined" onClick={handleExport}>Выгрузить CSV</Button>
+      </Box>
       <Paper>
         <TableContainer>
           <Table stickyHeader>
@@ -61,6 +87,11 @@ const NarcoticJournalPage = () => {
           </Table>
         </TableContainer>
       </Paper>
+      {hasMore && (
+        <Box sx={{ display: 'flex', justifyContent: 'center', mt: 2 }}>
+          <Button onClick={() => fetchLogs(logs[logs.length - 1])}>Показать еще</Button>
+        </Box>
+      )}
     </Box>
   );
 };
@@ -1,27 +1,36 @@
 import React, { useState, useEffect, useContext } from 'react';
-import { Box, Typography, Paper, List, ListItem, ListItemText, Divider, CircularProgress } from '@mui/material';
+import { Box, Typography, Paper, List, ListItem, ListItemText, Divider, CircularProgress, Button } from '@mui/material';
 import { AuthContext } from '@/contexts/AuthContext.jsx';
 import api from '@/services/api.js';
 import { translateRole } from '@/utils/translation.js';
 
+const PAGE_SIZE = 100;
+
 const ProfilePage = () => {
   const { user } = useContext(AuthContext);
   const [activity, setActivity] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [hasMore, setHasMore] = useState(false);
 
-  useEffect(() => {
-    const fetchActivity = async () => {
-      try {
-        const response = await api.get('/users/me/activity');
-        setActivity(response.data);
-      } catch (error) {
-        console.error("Ошибка при загрузке активности:", error);
-      } finally {
-        setLoading(false);
+  // История грузится страницами: следующая начинается после последней загруженной записи
+  const fetchActivity = async (after = null) => {
+    try {
+      const params = { limit: PAGE_SIZE };
+      if (after) {
+        params.before_created_at = after.created_at;
+        params.before_id = after.id;
       }
-    };
-    fetchActivity();
-  }, []);
+      const response = await api.get('/users/me/activity', { params });
+      setActivity(prev => (after ? [...prev, ...response.data] : response.data));
+      setHasMore(response.data.length === PAGE_SIZE);
+    } catch (error) {
+      console.error("Ошибка при загрузке активности:", error);
+    } finally {
+      setLoading(false);
+    }
+  };
+
+  useEffect(() => { fetchActivity(); }, []);
 
   return (
     <Box>
@@ -49,6 +58,11 @@ const ProfilePage = () => {
           )) : <ListItem><ListItemText primary="История действий пуста." /></ListItem>}
         </List>
       </Paper>
+      {hasMore && (
+        <Box sx={{ display: 'flex', justifyContent: 'center', mt: 2 }}>
+          <Button onClick={() => fetchActivity(activity[activity.length - 1])}>Показать еще</Button>
+        </Box>
+      )}
     </Box>
   );
 };
@@ -19,7 +19,7 @@ const RequestPage = () => {
 
   const fetchRequests = async () => {
     try {
-      const response = await api.get('/requests/');
+      const response = await api.get('/requests/', { params: { fields: 'id,created_at,status,item_count' } });
       setRequests(response.data);
     } catch (error) {
       console.error("Ошибка при загрузке заявок:", error);
@@ -129,7 +129,7 @@ const RequestPage = () => {
                 <TableCell>#{req.id}</TableCell>
                 <TableCell>{new Date(req.created_at).toLocaleString()}</TableCell>
                 <TableCell><Chip label={req.status} color={req.status === 'approved' ? 'success' : 'warning'} size="small" /></TableCell>
-                <TableCell>{req.items.length}</TableCell>
+                <TableCell>{req.item_count}</TableCell>
                 <TableCell>
                   {user?.role === 'admin' && req.status === 'pending' && (
                     <Tooltip title="Подтвердить поступление на склад">
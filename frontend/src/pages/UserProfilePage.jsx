@@ -1,14 +1,29 @@
 import React, { useState, useEffect } from 'react';
 import { useParams } from 'react-router-dom';
-import { Box, Typography, Paper, List, ListItem, ListItemText, Divider, CircularProgress } from '@mui/material';
+import { Box, Typography, Paper, List, ListItem, ListItemText, Divider, CircularProgress, Button } from '@mui/material';
 import api from '@/services/api.js';
 import { translateRole } from '@/utils/translation.js';
 
+const PAGE_SIZE = 100;
+
 const UserProfilePage = () => {
   const { userId } = useParams();
   const [user, setUser] = useState(null);
   const [activity, setActivity] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [hasMore, setHasMore] = useState(false);
+
+  // История грузится страницами: следующая начинается после последней загруженной записи
+  const fetchActivity = async (after = null) => {
+    const params = { limit: PAGE_SIZE };
+    if (after) {
+      params.before_created_at = after.created_at;
+      params.before_id = after.id;
+    }
+    const response = await api.get(`/users/${userId}/activity`, { params });
+    setActivity(prev => (after ? [...prev, ...response.data] : response.data));
+    setHasMore(response.data.length === PAGE_SIZE);
+  };
 
   useEffect(() => {
     const fetchData = async () => {
@@ -16,8 +31,7 @@ const UserProfilePage = () => {
       try {
         const userResponse = await api.get(`/users/${userId}`);
         setUser(userResponse.data);
-        const activityResponse = await api.get(`/users/${userId}/activity`);
-        setActivity(activityResponse.data);
+        await fetchActivity();
       } catch (error) {
         console.error("Ошибка при загрузке данных профиля:", error);
       } finally {
@@ -27,6 +41,14 @@ const UserProfilePage = () => {
     fetchData();
   }, [userId]);
 
+  const handleLoadMore = async () => {
+    try {
+      await fetchActivity(activity[activity.length - 1]);
+    } catch (error) {
+      console.error("Ошибка при загрузке активности:", error);
+    }
+  };
+
   if (loading) {
     return <Box sx={{ display: 'flex', justifyContent: 'center', mt: 4 }}><CircularProgress /></Box>;
   }
@@ -63,6 +85,11 @@ const UserProfilePage = () => {
           )}
         </List>
       </Paper>
+      {hasMore && (
+        <Box sx={{ display: 'flex', justifyContent: 'center', mt: 2 }}>
+          <Button onClick={handleLoadMore}>Показать еще</Button>
+        </Box>
+      )}
     </Box>
   );
 };
@@ -17,4 +17,28 @@ api.interceptors.request.use(
   (error) => Promise.reject(error)
 );
 
+// При истекшем access-токене один раз обновляем его по refresh-токену и повторяем запрос
+api.interceptors.response.use(
+  (response) => response,
+  async (error) => {
+    const original = error.config;
+    const refreshToken = localStorage.getItem('refreshToken');
+    if (error.response?.status !== 401 || !refreshToken || original._retry || original.url === '/token/refresh') {
+      return Promise.reject(error);
+    }
+    original._retry = true;
+    try {
+      const { data } = await api.post('/token/refresh', { refresh_token: refreshToken });
+      localStorage.setItem('token', data.access_token);
+      localStorage.setItem('refreshToken', data.refresh_token);
+      api.defaults.headers.Authorization = `Bearer ${data.access_token}`;
+      original.headers.Authorization = `Bearer ${data.access_token}`;
+      return api(original);
+    } catch (refreshError) {
+      localStorage.removeItem('refreshToken');
+      return Promise.reject(error);
+    }
+  }
+);
+
 export default api;
\ No newline at end of file